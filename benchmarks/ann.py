@@ -0,0 +1,63 @@
+"""Measure the recall and speed of shortlisted searches against exhaustive pruned searches.
+
+For each target, the exact top N is found with a pruned search over every candidate, then again re-ranking only
+the candidates shortlisted by the approximate index, for each shortlist size. recall@N is the fraction of the exact
+top N found by the shortlisted search.
+
+Run from the project root:
+    python -m benchmarks.ann --years 3 --shortlist 50 100 200 400 --targets 20
+"""
+import argparse
+import time as timer
+import numpy as np
+from loguru import logger
+
+from benchmarks.suite import WINDOW_TIME_START, TARGET_TIME, dataset_files
+from market_sim_search.ann import recall_at_n
+from market_sim_search.config import EST
+from market_sim_search.data import load_csv, resample
+from market_sim_search.matches import STRATEGY_WEIGHTS
+from market_sim_search.search_index import SearchIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='*', default=[3], help='Sizes of synthetic datasets')
+    parser.add_argument('--freq', default='5min')
+    parser.add_argument('--days', type=int, default=1, help='Window size in days')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--targets', type=int, default=20, help='Number of targets, spread over the history')
+    parser.add_argument('--shortlist', type=int, nargs='*', default=[50, 100, 200, 400])
+    args = parser.parse_args()
+
+    logger.remove()
+    print(f'{"dataset":<16}{"shortlist":>10}{"candidates":>12}{"recall@N":>10}{"min recall":>12}'
+          f'{"seconds":>10}{"exact s":>10}{"speedup":>9}')
+    for name, file in dataset_files(args.years).items():
+        data = resample(load_csv(file, EST), args.freq)
+        search_index = SearchIndex(data, WINDOW_TIME_START, args.days, cache_size=0)
+        window_index = search_index.window_index(TARGET_TIME)
+        ends = window_index.index[window_index.ends[window_index.valid]]
+        targets = ends[np.linspace(len(ends) // 2, len(ends) - 1, args.targets).astype(int)]
+        # Warm up the caches and the JIT, so only the searches are timed
+        search_index.search(targets[0], args.top)
+        search_index.approximate_index(TARGET_TIME, STRATEGY_WEIGHTS['dtw_high_low_close_4']).tree
+
+        exact = {}
+        start = timer.perf_counter()
+        for target in targets:
+            exact[target] = search_index.search(target, args.top)
+        exact_seconds = (timer.perf_counter() - start) / len(targets)
+
+        for shortlist in args.shortlist:
+            recalls = []
+            start = timer.perf_counter()
+            for target in targets:
+                recalls.append(recall_at_n(search_index.search(target, args.top, shortlist=shortlist), exact[target]))
+            seconds = (timer.perf_counter() - start) / len(targets)
+            print(f'{name:<16}{shortlist:>10}{len(window_index):>12}{np.mean(recalls):>10.3f}{min(recalls):>12.3f}'
+                  f'{seconds:>10.4f}{exact_seconds:>10.4f}{exact_seconds / seconds:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
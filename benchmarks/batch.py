@@ -0,0 +1,72 @@
+"""Measure batch searches of several targets against the same targets searched one at a time.
+
+The targets are every combination of the last --sessions days, the --end-times and the --lookbacks window sizes,
+as an analyst comparing several targets in one session would search them. Each is run by
+StrategyRunner.find_similar_batch and by one find_similar_features call per target, and the results are checked to
+be identical.
+
+Run from the project root:
+    python -m benchmarks.batch --years 1 --sessions 5 --end-times 10:00 10:30 11:00 --lookbacks 1 2
+"""
+import argparse
+import time as timer
+from datetime import datetime
+
+import pandas as pd
+from loguru import logger
+
+from benchmarks.suite import WINDOW_TIME_START, dataset_files
+from market_sim_search.config import EST
+from market_sim_search.data import load_csv, resample
+from market_sim_search.matches import STRATEGY_WEIGHTS, StrategyRunner
+
+
+def make_runner() -> StrategyRunner:
+    runner = StrategyRunner()
+    runner.max_outer_loop_count = 1
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='*', default=[1])
+    parser.add_argument('--freq', default='5min')
+    parser.add_argument('--sessions', type=int, default=5, help='Number of most recent days to take targets from')
+    parser.add_argument('--end-times', nargs='*', default=['10:00', '10:30', '11:00'])
+    parser.add_argument('--lookbacks', type=int, nargs='*', default=[1, 2], help='Window sizes in days')
+    parser.add_argument('--top', type=int, default=7)
+    parser.add_argument('--strategy', default='dtw_high_low_close_4')
+    args = parser.parse_args()
+
+    logger.remove()
+    weights = STRATEGY_WEIGHTS[args.strategy]
+    print(f'{"dataset":<16}{"prune":>6}{"queries":>9}{"batch s":>10}{"single s":>10}{"speedup":>9}{"identical":>11}')
+    for name, file in dataset_files(args.years).items():
+        data = resample(load_csv(file, EST), args.freq)
+        days = data.index.normalize().unique()[-args.sessions:]
+        queries = [(datetime.combine(day.date(), pd.Timestamp(end_time).time()), days_)
+                   for day in days for end_time in args.end_times for days_ in args.lookbacks]
+        queries = [(pd.Timestamp(target_end).tz_localize(data.index.tz), days_) for target_end, days_ in queries]
+        # Compile the DTW kernels first, so only the searches are timed
+        make_runner().find_similar_batch(data, WINDOW_TIME_START, queries[:1], weights, top=args.top)
+
+        for prune in [False, True]:
+            start = timer.perf_counter()
+            batch = make_runner().find_similar_batch(data, WINDOW_TIME_START, queries, weights, top=args.top,
+                                                     prune=prune)
+            batch_seconds = timer.perf_counter() - start
+
+            start = timer.perf_counter()
+            single = [make_runner().find_similar_features(data, WINDOW_TIME_START, days_, target_end, weights,
+                                                          top=args.top, prune=prune)
+                      for target_end, days_ in queries]
+            single_seconds = timer.perf_counter() - start
+
+            identical = all([(m.start, m.end, m.score) for m in a] == [(m.start, m.end, m.score) for m in b]
+                            for a, b in zip(batch, single))
+            print(f'{name:<16}{str(prune):>6}{len(queries):>9}{batch_seconds:>10.2f}{single_seconds:>10.2f}'
+                  f'{single_seconds / batch_seconds:>9.2f}{str(identical):>11}')
+
+
+if __name__ == '__main__':
+    main()
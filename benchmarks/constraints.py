@@ -0,0 +1,81 @@
+"""Compare constrained and unconstrained DTW search speed and rankings.
+
+Run from the project root:
+    python -m benchmarks.constraints --radius 3 6 12 24 --itakura 2 3
+"""
+import argparse
+import time as timer
+from datetime import datetime, time
+
+import numpy as np
+from loguru import logger
+
+from market_sim_search.config import EST, DATA_DIR
+from market_sim_search.constraints import DtwConstraint
+from market_sim_search.data import load_csv, resample
+from market_sim_search.matches import StrategyRunner
+
+EXAMPLE_FILE = DATA_DIR / 'examples' / 'qqq-20240701-20241004.ohlcv-1m.csv.zip'
+
+
+def rank_correlation(scores_a: np.ndarray, scores_b: np.ndarray) -> float:
+    """Spearman rank correlation of two score arrays over the same candidates"""
+    ranks_a = scores_a.argsort().argsort()
+    ranks_b = scores_b.argsort().argsort()
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def run_search(data, target_end: datetime, window_size_days: int, constraint: DtwConstraint | None,
+               repeat: int):
+    """Return the best time of repeat searches, and the score of each match keyed by its end"""
+    elapsed = []
+    for _ in range(repeat):
+        runner = StrategyRunner()
+        start = timer.perf_counter()
+        matches = runner.find_similar_dtw_high_low_close_4(data, time(9, 30), window_size_days, target_end,
+                                                           constraint=constraint)
+        elapsed.append(timer.perf_counter() - start)
+    return min(elapsed), {match.end: match.score for match in matches}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', default=str(EXAMPLE_FILE))
+    parser.add_argument('--freq', default='5min')
+    parser.add_argument('--target-end', default='2024-10-04T10:00')
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--top', type=int, default=7)
+    parser.add_argument('--radius', type=int, nargs='*', default=[3, 6, 12, 24])
+    parser.add_argument('--itakura', type=float, nargs='*', default=[2.])
+    parser.add_argument('--repeat', type=int, default=2, help='Take the best of n runs, so JIT warmup is excluded')
+    args = parser.parse_args()
+
+    logger.remove()
+    data = resample(load_csv(args.input, EST), args.freq)
+    target_end = EST.localize(datetime.fromisoformat(args.target_end))
+
+    constraints = ([None] + [DtwConstraint('sakoe_chiba', radius=radius) for radius in args.radius]
+                   + [DtwConstraint('itakura', max_slope=slope) for slope in args.itakura])
+    baseline_time, baseline = run_search(data, target_end, args.days, None, args.repeat)
+    ends = sorted(baseline)
+    baseline_scores = np.array([baseline[end] for end in ends])
+    baseline_top = set(sorted(baseline, key=baseline.get)[:args.top])
+
+    print(f'{"constraint":<24}{"seconds":>10}{"speedup":>10}{"top overlap":>14}{"rank corr":>12}')
+    for constraint in constraints:
+        if constraint is None:
+            elapsed, scores, name = baseline_time, baseline, 'none'
+        else:
+            elapsed, scores = run_search(data, target_end, args.days, constraint, args.repeat)
+            name = (f'sakoe_chiba r={constraint.radius}' if constraint.kind == 'sakoe_chiba'
+                    else f'itakura slope={constraint.max_slope:g}')
+        top = set(sorted(scores, key=scores.get)[:args.top])
+        shared = [end for end in ends if end in scores]
+        correlation = rank_correlation(baseline_scores[[ends.index(end) for end in shared]],
+                                       np.array([scores[end] for end in shared]))
+        print(f'{name:<24}{elapsed:>10.3f}{baseline_time / elapsed:>10.2f}'
+              f'{len(top & baseline_top):>10}/{args.top:<3}{correlation:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
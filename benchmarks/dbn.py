@@ -0,0 +1,51 @@
+"""Compare loading the same bars from a zipped csv with load_csv and from a DBN file with load_dbn.
+
+Each dataset of the suite is converted once to an uncompressed DBN file, and a zstd compressed one if zstandard is
+installed, in data/benchmarks. Every load is checked to return the same frame as load_csv. Times are the best of
+--repeat runs, and the peak memory is traced while each runs once more.
+
+Run from the project root:
+    python -m benchmarks.dbn --years 1 3
+"""
+import argparse
+
+from loguru import logger
+
+from benchmarks.suite import SYNTHETIC_DIR, dataset_files, measure
+from benchmarks.synthetic import write_dbn
+from market_sim_search.config import EST
+from market_sim_search.data import _read_csv, load_csv, load_dbn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='*', default=[1, 3], help='Sizes of synthetic datasets')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    try:
+        import zstandard  # noqa: F401
+        suffixes = ['.dbn', '.dbn.zst']
+    except ImportError:
+        logger.warning('zstandard is not installed, only uncompressed DBN files are benchmarked')
+        suffixes = ['.dbn']
+
+    logger.remove()
+    print(f'{"dataset":<16}{"format":<10}{"MB":>8}{"seconds":>10}{"peak MB":>10}{"speedup":>9}')
+    for name, file in dataset_files(args.years).items():
+        csv_seconds, csv_peak, expected = measure(lambda: load_csv(file, EST), args.repeat, True)
+        print(f'{name:<16}{"csv.zip":<10}{file.stat().st_size / 2 ** 20:>8.1f}{csv_seconds:>10.3f}{csv_peak:>10.1f}'
+              f'{1:>9.1f}')
+        for suffix in suffixes:
+            dbn_file = SYNTHETIC_DIR / f'{name}.ohlcv-1m{suffix}'
+            if not dbn_file.exists() or dbn_file.stat().st_mtime < file.stat().st_mtime:
+                write_dbn(_read_csv(file), dbn_file)
+            seconds, peak, bars = measure(lambda: load_dbn(dbn_file, EST), args.repeat, True)
+            if not bars.equals(expected):
+                raise AssertionError(f'load_dbn({dbn_file}) differs from load_csv({file})')
+            print(f'{name:<16}{suffix[1:]:<10}{dbn_file.stat().st_size / 2 ** 20:>8.1f}{seconds:>10.3f}'
+                  f'{peak:>10.1f}{csv_seconds / seconds:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
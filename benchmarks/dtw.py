@@ -0,0 +1,88 @@
+"""Check the compiled DTW kernel against tslearn, and compare their speed.
+
+Runs random series of varied lengths through market_sim_search.dtw.dtw and tslearn.metrics.dtw, with and without
+constraints, and fails if any distance differs. Then times one target against a batch of windows.
+
+Run from the project root:
+    python -m benchmarks.dtw --windows 5000 --length 78
+"""
+import argparse
+import time as timer
+
+import numpy as np
+from tslearn.metrics import dtw as tslearn_dtw
+
+from market_sim_search.constraints import DtwConstraint, dtw_kwargs
+from market_sim_search.dtw import dtw, dtw_batch
+
+
+def check_against_tslearn(n_pairs: int, seed: int = 0) -> int:
+    """Return the number of random pairs whose distance, or failure, differs from tslearn"""
+    rng = np.random.default_rng(seed)
+    mismatches = 0
+    for _ in range(n_pairs):
+        n, m, n_features = rng.integers(1, 60), rng.integers(1, 60), rng.integers(1, 4)
+        s1 = rng.normal(size=(n, n_features)).cumsum(axis=0)
+        s2 = rng.normal(size=(m, n_features)).cumsum(axis=0)
+        for constraint in [None, DtwConstraint('sakoe_chiba', radius=int(rng.integers(0, 10))),
+                           DtwConstraint('itakura', max_slope=float(rng.uniform(1, 4)))]:
+            try:
+                expected = tslearn_dtw(s1, s2, **dtw_kwargs(constraint))
+            except ValueError:
+                expected = None
+            try:
+                actual = dtw(s1, s2, constraint)
+            except ValueError:
+                actual = None
+            if expected != actual:
+                mismatches += 1
+                print(f'Mismatch n={n} m={m} features={n_features} {constraint}: tslearn {expected}, kernel {actual}')
+    return mismatches
+
+
+def best_time(function, repeat: int) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        start = timer.perf_counter()
+        function()
+        elapsed.append(timer.perf_counter() - start)
+    return min(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=300, help='Random pairs checked against tslearn')
+    parser.add_argument('--windows', type=int, default=5000)
+    parser.add_argument('--length', type=int, default=78, help='Bars per window, 78 is one session of 5min bars')
+    parser.add_argument('--radius', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3, help='Take the best of n runs, so JIT warmup is excluded')
+    args = parser.parse_args()
+
+    mismatches = check_against_tslearn(args.pairs)
+    print(f'{args.pairs * 3} distances checked against tslearn, {mismatches} mismatches')
+
+    rng = np.random.default_rng(1)
+    target = rng.normal(size=args.length).cumsum()
+    windows = rng.normal(size=(args.windows, args.length)).cumsum(axis=1)
+    band = DtwConstraint('sakoe_chiba', radius=args.radius)
+    threshold = np.sort(dtw_batch(target, windows))[10]
+
+    runs = {
+        'tslearn, per pair': lambda: [tslearn_dtw(target, window) for window in windows],
+        'kernel, per pair': lambda: [dtw(target, window) for window in windows],
+        'kernel, batch': lambda: dtw_batch(target, windows),
+        'kernel, batch float32': lambda: dtw_batch(target.astype(np.float32), windows.astype(np.float32)),
+        'kernel, batch abandoning': lambda: dtw_batch(target, windows, threshold),
+        f'kernel, batch r={args.radius}': lambda: dtw_batch(target, windows, constraint=band),
+    }
+    times = {name: best_time(run, args.repeat) for name, run in runs.items()}
+    baseline = times['tslearn, per pair']
+    print(f'{"run":<28}{"seconds":>10}{"windows/s":>14}{"speedup":>10}')
+    for name, elapsed in times.items():
+        print(f'{name:<28}{elapsed:>10.3f}{args.windows / elapsed:>14.0f}{baseline / elapsed:>10.1f}')
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
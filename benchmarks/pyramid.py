@@ -0,0 +1,66 @@
+"""Measure the recall and speed of coarse-to-fine searches against exhaustive pruned searches of the 1 minute bars.
+
+For each target, the exact top N is found by a pruned search over every candidate at the finest resolution, then
+again by a ResolutionPyramid search with each survivor fraction. recall@N is the fraction of the exact top N found
+by the coarse-to-fine search.
+
+Run from the project root:
+    python -m benchmarks.pyramid --years 3 --survivors 0.1 0.2 --targets 10
+"""
+import argparse
+import time as timer
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.suite import WINDOW_TIME_START, TARGET_TIME, dataset_files
+from market_sim_search.ann import recall_at_n
+from market_sim_search.config import EST
+from market_sim_search.data import load_csv
+from market_sim_search.pyramid import DEFAULT_FREQS, ResolutionPyramid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='*', default=[1])
+    parser.add_argument('--freqs', nargs='*', default=list(DEFAULT_FREQS), help='Resolutions, coarse to fine')
+    parser.add_argument('--days', type=int, default=1, help='Window size in days')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--targets', type=int, default=10, help='Number of targets, spread over the history')
+    parser.add_argument('--survivors', type=float, nargs='*', default=[0.1, 0.2, 0.4],
+                        help='Survivor fractions to try, the same at every level')
+    args = parser.parse_args()
+
+    logger.remove()
+    print(f'{"dataset":<16}{"survivors":>10}{"recall@N":>10}{"min recall":>12}{"seconds":>10}{"exact s":>10}'
+          f'{"speedup":>9}  candidates per level')
+    for name, file in dataset_files(args.years).items():
+        pyramid = ResolutionPyramid(load_csv(file, EST), WINDOW_TIME_START, args.days, tuple(args.freqs),
+                                    cache_size=0)
+        finest = pyramid.levels[args.freqs[-1]]
+        window_index = finest.window_index(TARGET_TIME)
+        ends = window_index.index[window_index.ends[window_index.valid]]
+        targets = ends[np.linspace(len(ends) // 2, len(ends) - 1, args.targets).astype(int)]
+        # Warm up the caches and the JIT, so only the searches are timed
+        pyramid.search(targets[0], args.top)
+
+        exact = {}
+        start = timer.perf_counter()
+        for target in targets:
+            exact[target] = finest.search(target, args.top)
+        exact_seconds = (timer.perf_counter() - start) / len(targets)
+
+        for fraction in args.survivors:
+            survivors = (fraction,) * (len(args.freqs) - 1)
+            recalls = []
+            start = timer.perf_counter()
+            for target in targets:
+                recalls.append(recall_at_n(pyramid.search(target, args.top, survivors=survivors), exact[target]))
+            seconds = (timer.perf_counter() - start) / len(targets)
+            levels = ' > '.join(f'{stats.freq} {stats.candidates}' for stats in pyramid.level_stats)
+            print(f'{name:<16}{fraction:>10}{np.mean(recalls):>10.3f}{min(recalls):>12.3f}{seconds:>10.4f}'
+                  f'{exact_seconds:>10.4f}{exact_seconds / seconds:>9.1f}  {levels}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Time each stage of the search pipeline on the bundled example and on synthetic multi-year data.
+
+Stages are loading, resampling, window extraction, each find_similar_* strategy and an end to end top N search.
+Each stage reports its best time of --repeat runs, candidates/sec where it scores candidates, and the peak memory
+traced while it runs once more. Results are written as JSON, and compared with --compare against an earlier run.
+
+Stages using APIs missing from the tree being measured are skipped, so the suite also runs on older commits, e.g.
+to record benchmarks/baseline.json on the baseline tree, see the README.
+
+Run from the project root, or with `make bench`:
+    python -m benchmarks.suite --years 1 3 --output benchmarks/results/latest.json --compare benchmarks/baseline.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time as timer
+import tracemalloc
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime, time
+from inspect import signature
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from market_sim_search.config import DATA_DIR, EST, PROJ_ROOT
+from market_sim_search.data import load_csv, resample
+from market_sim_search.matches import StrategyRunner, get_window
+from market_sim_search.plotting import get_window_matches
+
+try:
+    from market_sim_search.windows import WindowIndex
+except ImportError:
+    # Trees before the window index, such as the baseline
+    WindowIndex = None
+
+EXAMPLE_FILE = DATA_DIR / 'examples' / 'qqq-20240701-20241004.ohlcv-1m.csv.zip'
+SYNTHETIC_DIR = DATA_DIR / 'benchmarks'
+
+WINDOW_TIME_START = time(9, 30)
+TARGET_TIME = time(10)
+STRATEGIES = ['find_similar_dtw_hlc4', 'find_similar_dtw_high_low_1', 'find_similar_dtw_high_low_2',
+              'find_similar_dtw_high_low_close_4']
+
+
+@dataclass
+class StageResult:
+    dataset: str
+    stage: str
+    seconds: float
+    rows: int
+    candidates: int | None = None
+    candidates_per_sec: float | None = None
+    peak_memory_mb: float | None = None
+
+
+def measure(function: Callable[[], object], repeat: int, memory: bool) -> tuple[float, float | None, object]:
+    """Return the best time of repeat calls, the peak memory of a traced call in MB, and the last result"""
+    elapsed = []
+    for _ in range(repeat):
+        start = timer.perf_counter()
+        result = function()
+        elapsed.append(timer.perf_counter() - start)
+    peak = None
+    if memory:
+        # Traced separately, since tracing slows down the timed runs
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return min(elapsed), peak, result
+
+
+def dataset_files(years: list[int]) -> dict[str, Path]:
+    """Return the csv file of each dataset, generating synthetic files on first use"""
+    files = {'example': EXAMPLE_FILE}
+    for n_years in years:
+        file = SYNTHETIC_DIR / f'synthetic-{n_years}y.ohlcv-1m.csv.zip'
+        if not file.exists():
+            # Imported here, as generating needs modules newer than some of the trees the suite measures
+            from benchmarks.synthetic import synthetic_bars, write_zipped_csv
+
+            logger.info(f'Generating {file}')
+            write_zipped_csv(synthetic_bars(252 * n_years), file)
+        files[f'synthetic-{n_years}y'] = file
+    return files
+
+
+def run_dataset(name: str, file: Path, freq: str, window_size_days: int, top: int, repeat: int,
+                memory: bool) -> list[StageResult]:
+    results = []
+
+    def stage(stage_name: str, function: Callable[[], object], rows: int, candidates: int | None = None):
+        seconds, peak, result = measure(function, repeat, memory)
+        results.append(StageResult(name, stage_name, seconds, rows, candidates,
+                                   candidates / seconds if candidates else None, peak))
+        print(f'{name:<16}{stage_name:<44}{seconds:>10.3f}'
+              f'{results[-1].candidates_per_sec or 0:>14.0f}{peak or 0:>12.1f}')
+        return result
+
+    bars = stage('load_csv', lambda: load_csv(file, EST), 0)
+    results[-1].rows = len(bars)
+    data = stage('resample', lambda: resample(bars, freq), len(bars))
+
+    ends = data.index[data.index.indexer_at_time(TARGET_TIME)]
+    n_candidates = len(ends)
+    if WindowIndex:
+        window_index = stage('WindowIndex.build', lambda: WindowIndex.build(data, WINDOW_TIME_START,
+                                                                           window_size_days, TARGET_TIME), len(data))
+        # A copy of the built index has no cached windows, so only their extraction is timed
+        stage('WindowIndex.windows', lambda: replace(window_index).windows, len(data), n_candidates)
+    # get_window rescans the index on every call, so time it on a sample of windows
+    sample = ends[np.linspace(0, len(ends) - 1, min(len(ends), 50)).astype(int)]
+    stage(f'get_window x{len(sample)}', lambda: [get_window(data, WINDOW_TIME_START, window_size_days, end)
+                                                 for end in sample], len(data), len(sample))
+
+    target_end = ends[-1]
+    for strategy in STRATEGIES:
+        stage(strategy, lambda: getattr(StrategyRunner(), strategy)(data, WINDOW_TIME_START, window_size_days,
+                                                                    target_end), len(data), n_candidates)
+
+    # Pruned where the tree supports it
+    search = StrategyRunner.find_similar_dtw_high_low_close_4
+    options = {'prune': True} if 'prune' in signature(search).parameters else {}
+
+    def top_n_search():
+        runner = StrategyRunner()
+        matches = runner.find_similar_dtw_high_low_close_4(data, WINDOW_TIME_START, window_size_days, target_end,
+                                                           top, **options)
+        return get_window_matches(data, matches)
+
+    stage(f'top {top} search', top_n_search, len(data), n_candidates)
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJ_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[StageResult], baseline_file: Path):
+    """Print the time of each stage relative to a baseline run"""
+    baseline = {(result['dataset'], result['stage']): result
+                for result in json.loads(Path(baseline_file).read_text())['results']}
+    print(f'\nCompared with {baseline_file}')
+    print(f'{"dataset":<16}{"stage":<44}{"baseline":>10}{"seconds":>10}{"ratio":>8}')
+    for result in results:
+        previous = baseline.get((result.dataset, result.stage))
+        if previous is None:
+            continue
+        ratio = result.seconds / previous['seconds']
+        flag = '  slower' if ratio > 1.2 else ''
+        print(f'{result.dataset:<16}{result.stage:<44}{previous["seconds"]:>10.3f}{result.seconds:>10.3f}'
+              f'{ratio:>8.2f}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='*', default=[1, 3], help='Sizes of synthetic datasets')
+    parser.add_argument('--freq', default='5min')
+    parser.add_argument('--days', type=int, default=1, help='Window size in days')
+    parser.add_argument('--top', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=3, help='Take the best of n runs, so JIT warmup is excluded')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced run of each stage')
+    parser.add_argument('--output', type=Path, help='Write results as JSON')
+    parser.add_argument('--compare', type=Path, help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    logger.remove()
+    print(f'{"dataset":<16}{"stage":<44}{"seconds":>10}{"candidates/s":>14}{"peak MB":>12}')
+    results = []
+    for name, file in dataset_files(args.years).items():
+        results += run_dataset(name, file, args.freq, args.days, args.top, args.repeat, not args.no_memory)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            'commit': git_commit(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'args': {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+            'results': [asdict(result) for result in results],
+        }, indent=1))
+        print(f'\nWrote {args.output}')
+    if args.compare and args.compare.exists():
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
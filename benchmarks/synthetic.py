@@ -0,0 +1,99 @@
+"""Synthetic OHLCV bars in the layout of the bundled Databento files, for benchmarks at sizes beyond the examples."""
+import struct
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from market_sim_search.config import EST
+from market_sim_search.data import SESSION_END, SESSION_START
+from market_sim_search.dbn import FIXED_PRICE_SCALE, MAGIC, OHLCV_DTYPE
+
+
+def synthetic_bars(days: int, start: str = '2015-01-02', symbol: str = 'SYN', price: float = 100.,
+                   seed: int = 0) -> pd.DataFrame:
+    """Return days business days of 1 minute bars covering the session, indexed by a UTC ts_event.
+
+    Closes follow a geometric random walk with more volatility around the open, so windows aren't all alike.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=days)
+    minutes = pd.timedelta_range(SESSION_START + ':00', SESSION_END + ':00', freq='1min', closed='left')
+    local = (dates.values[:, None] + minutes.values[None, :]).ravel()
+    index = pd.DatetimeIndex(local).tz_localize(EST, ambiguous=False, nonexistent='shift_forward').tz_convert('UTC')
+
+    minute_of_day = np.tile(np.arange(len(minutes)), days)
+    regular_open = minutes.get_loc(pd.Timedelta(hours=9, minutes=30))
+    volatility = np.where(minute_of_day >= regular_open, 4e-4, 1.5e-4)
+    volatility = volatility * (1 + 2 * np.exp(-np.abs(minute_of_day - regular_open) / 30))
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility)))
+    open_ = np.concatenate([[price], close[:-1]])
+    spread = close * volatility * np.abs(rng.normal(1, .5, len(close)))
+    high = np.maximum(open_, close) + spread * rng.random(len(close))
+    low = np.minimum(open_, close) - spread * rng.random(len(close))
+    volume = rng.lognormal(6, 1, len(close)).astype(np.int64)
+
+    df = pd.DataFrame({
+        'rtype': 33,
+        'publisher_id': 2,
+        'instrument_id': 1,
+        'open': open_.round(2),
+        'high': high.round(2),
+        'low': low.round(2),
+        'close': close.round(2),
+        'volume': volume,
+        'symbol': symbol,
+    }, index=pd.Index(index, name='ts_event'))
+    return df
+
+
+def write_zipped_csv(df: pd.DataFrame, path: Path) -> Path:
+    """Write bars as a zipped csv that load_csv can read"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    csv = df.to_csv(date_format='%Y-%m-%dT%H:%M:%S.%fZ')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(path.stem, csv)
+    return path
+
+
+def write_dbn(df: pd.DataFrame, path: Path, dataset: str = 'XNAS.ITCH', symbol_length: int = 71) -> Path:
+    """Write bars as a version 2 DBN file of OHLCV-1m records that load_dbn can read, zstd compressed if path ends
+    with .zst. The symbol column is written as the symbology mappings of each instrument id."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    records = np.zeros(len(df), dtype=OHLCV_DTYPE)
+    records['length'] = OHLCV_DTYPE.itemsize // 4
+    for column in ['rtype', 'publisher_id', 'instrument_id', 'volume']:
+        records[column] = df[column].to_numpy()
+    records['ts_event'] = df.index.as_unit('ns').asi8
+    for column in ['open', 'high', 'low', 'close']:
+        records[column] = np.round(df[column].to_numpy() * FIXED_PRICE_SCALE).astype(np.int64)
+
+    def cstr(value: str) -> bytes:
+        return value.encode().ljust(symbol_length, b'\0')
+
+    start, end = (int(df.index[0].value), int(df.index[-1].value) + 60_000_000_000) if len(df) else (0, 0)
+    ids = df.groupby('symbol', sort=True)['instrument_id'].unique()
+    # Mapping intervals end the day after the last bar, as their end date is exclusive
+    dates = [int(df.index[0].strftime('%Y%m%d')), int((df.index[-1] + pd.Timedelta(days=1)).strftime('%Y%m%d'))
+             ] if len(df) else [0, 0]
+    # Requested symbols, then no partial or unresolved symbols, then the mappings
+    symbols = struct.pack('<I', len(ids)) + b''.join(cstr(symbol) for symbol in ids.index) + struct.pack('<II', 0, 0)
+    mappings = struct.pack('<I', len(ids)) + b''.join(
+        cstr(symbol) + struct.pack('<I', len(instrument_ids))
+        + b''.join(struct.pack('<II', *dates) + cstr(str(instrument_id)) for instrument_id in instrument_ids)
+        for symbol, instrument_ids in ids.items())
+    # Dataset, schema ohlcv-1m, start, end, limit, stype_in raw_symbol, stype_out instrument_id, ts_out, the symbol
+    # length, reserved padding and an empty schema definition
+    metadata = (struct.pack('<16sHQQQBBBH53xI', dataset.encode(), 6, start, end, 0, 1, 0, 0, symbol_length, 0)
+                + symbols + mappings)
+    metadata += b'\0' * (-len(metadata) % 8)
+    content = MAGIC + bytes([2]) + struct.pack('<I', len(metadata)) + metadata + records.tobytes()
+    if path.suffix == '.zst':
+        import zstandard
+
+        content = zstandard.ZstdCompressor().compress(content)
+    path.write_bytes(content)
+    return path
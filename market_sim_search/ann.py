@@ -0,0 +1,126 @@
+import json
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from market_sim_search.matches import normalize_features
+from market_sim_search.models import MatchModel
+from market_sim_search.windows import CLOSE, WindowIndex, windows_digest
+
+# Bumped when the saved layout or the embedding changes, so older index files are rebuilt
+FORMAT_VERSION = 2
+
+# Segments each window is averaged into by paa
+default_segments = 16
+
+
+def paa(norm_windows: np.ndarray, lengths: np.ndarray, segments: int) -> np.ndarray:
+    """Piecewise aggregate approximation of NaN padded (n_windows, max_length, n_features) windows.
+
+    Each window is split over its own length into segments parts of near equal size, and each part is replaced by
+    its mean. Windows shorter than segments repeat their bars. Returns a (n_windows, segments, n_features) array.
+    """
+    n_windows, max_length, n_features = norm_windows.shape
+    filled = np.nan_to_num(norm_windows)
+    cumulative = np.concatenate([np.zeros((n_windows, 1, n_features)), np.cumsum(filled, axis=1)], axis=1)
+    bounds = np.arange(segments + 1)[None, :] * lengths[:, None] // segments
+    sums = np.diff(np.take_along_axis(cumulative, bounds[..., None], axis=1), axis=1)
+    counts = np.diff(bounds, axis=1)[..., None]
+    bars = np.take_along_axis(filled, np.clip(bounds[:, :-1], 0, max(max_length - 1, 0))[..., None], axis=1)
+    return np.where(counts > 0, sums / np.maximum(counts, 1), bars)
+
+
+def embed_windows(norm_windows: np.ndarray, lengths: np.ndarray, weights: dict[str, float],
+                  segments: int) -> np.ndarray:
+    """Return the flat paa of normalized windows, each feature scaled by the square root of its share of the weights,
+    so squared Euclidean distances weigh features like dtw_features"""
+    weight_array = np.array(list(weights.values()), dtype=np.float64)
+    scale = np.sqrt(weight_array / weight_array.sum())
+    return (paa(norm_windows, lengths, segments) * scale).reshape(len(norm_windows), -1)
+
+
+def recall_at_n(approximate: list[MatchModel], exact: list[MatchModel]) -> float:
+    """Return the fraction of the exact top matches found by an approximate search"""
+    if not exact:
+        return 1.
+    return len({match.end for match in approximate} & {match.end for match in exact}) / len(exact)
+
+
+@dataclass(eq=False)
+class ApproximateIndex:
+    """A KD-tree over PAA embeddings of the candidate windows of a WindowIndex, to shortlist candidates for DTW.
+
+    Windows are normalized like the exact search, then embedded with embed_windows. The Euclidean distance of
+    embeddings approximates the DTW score, so the nearest embeddings are a shortlist of likely top matches, to re-rank
+    with exact DTW. Check recall_at_n against an exhaustive search to size the shortlist. digest is the
+    windows_digest of the WindowIndex it was built from, so an index loaded from disk is only used for the same bars.
+    """
+    weights: dict[str, float]
+    segments: int
+    candidates: np.ndarray
+    embeddings: np.ndarray
+    end_ns: np.ndarray
+    digest: str
+
+    @classmethod
+    def build(cls, window_index: WindowIndex, weights: dict[str, float], segments: int = default_segments,
+              norm_windows: np.ndarray | None = None) -> 'ApproximateIndex':
+        """Embed the valid candidates of window_index. norm_windows may hold their normalize_features for weights."""
+        candidates = np.flatnonzero(window_index.valid)
+        if norm_windows is None:
+            norm_windows = normalize_features(window_index.windows, window_index.values[window_index.ends, CLOSE],
+                                              list(weights))
+        embeddings = embed_windows(norm_windows[candidates], window_index.lengths[candidates], weights, segments)
+        index = cls(dict(weights), segments, candidates, embeddings, window_index.index.asi8[window_index.ends],
+                    windows_digest(window_index))
+        logger.info(f'Built an approximate index of {len(candidates)} windows, {index.embeddings.shape[1]} dimensions')
+        return index
+
+    @cached_property
+    def tree(self):
+        """A scipy cKDTree of the embeddings. scipy is imported on first use, as it's slow to import."""
+        from scipy.spatial import cKDTree
+
+        return cKDTree(self.embeddings)
+
+    def shortlist(self, target_window: np.ndarray, size: int) -> np.ndarray:
+        """Return the positions in the WindowIndex of the size candidates nearest to the bars of target_window, in
+        index order"""
+        size = min(size, len(self.candidates))
+        if size == 0:
+            return np.empty(0, dtype=np.int64)
+        norm_target = normalize_features(target_window, target_window[-1, CLOSE], list(self.weights))
+        embedding = embed_windows(norm_target[None], np.array([len(target_window)]), self.weights, self.segments)[0]
+        _, nearest = self.tree.query(embedding, k=size)
+        return np.sort(self.candidates[np.atleast_1d(nearest)])
+
+    def matches(self, window_index: WindowIndex) -> bool:
+        """Whether this index was built from the bars and candidates of window_index, e.g. after loading it from
+        disk. Another symbol's bars on the same calendar, or corrected bars, have the same ends but another digest."""
+        return (np.array_equal(self.end_ns, window_index.index.asi8[window_index.ends])
+                and self.digest == windows_digest(window_index))
+
+    def save(self, path: Path):
+        """Save the embeddings to a .npz file. The tree is rebuilt when loaded."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {'version': FORMAT_VERSION, 'weights': self.weights, 'segments': self.segments}
+        with open(path, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), candidates=self.candidates, embeddings=self.embeddings,
+                     end_ns=self.end_ns, digest=np.array(self.digest))
+
+    @classmethod
+    def load(cls, path: Path) -> 'ApproximateIndex | None':
+        """Load an index saved with save, or return None if there is no readable index of this version at path"""
+        try:
+            with np.load(path) as saved:
+                meta = json.loads(str(saved['meta']))
+                if meta.get('version') != FORMAT_VERSION:
+                    return None
+                return cls(meta['weights'], meta['segments'], saved['candidates'], saved['embeddings'],
+                           saved['end_ns'], str(saved['digest']))
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
@@ -2,7 +2,9 @@ import numpy as np
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta, time
+from typing import Callable
 import pytz
+import uuid
 
 import sys
 from pathlib import Path
@@ -10,31 +12,118 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 # st.set_page_config(layout="wide")
 
-from market_sim_search.config import EST, PROJ_ROOT
-from market_sim_search.data import load_csv, resample
-from market_sim_search.matches import StrategyRunner
-from market_sim_search.models import WindowMatch
-from market_sim_search.plotting import get_window_matches, create_streamlit_chart
+from market_sim_search.config import EST, PROJ_ROOT, configure
+from market_sim_search.constraints import DtwConstraint
+from market_sim_search.data import load_processed
+from market_sim_search.jobs import CANCELLED, DONE, FAILED, JobRunner, SearchJob
+from market_sim_search.models import MatchModel, WindowMatch
+from market_sim_search.plotting import get_window_matches, create_streamlit_chart, create_streamlit_projection_chart
+from market_sim_search.projections import build_projections, projection_offsets
+from market_sim_search.search_index import SearchIndex
+
+configure()
 
 
 @st.cache_data
 def load_data(uploaded_file):
     """Load and cache data from uploaded file"""
     if uploaded_file is not None:
-        df = load_csv(uploaded_file, EST)
-        df = resample(df, '5min')
+        df = load_processed(uploaded_file, EST, freq='5min')
         df.dropna(inplace=True)
         return df
     return None
 
 
-@st.cache_data(show_spinner=False)
-def run_search(data: pd.DataFrame, window_time_start: time, window_size_days: int, target_end: datetime,
-               top: int = None) -> list[WindowMatch]:
-    progress_bar = st.progress(0, 'Searching for similar time ranges...')
-    runner = StrategyRunner(lambda x: progress_bar.progress(x))
-    matches = runner.find_similar_dtw_high_low_close_4(data, window_time_start, window_size_days, target_end, top)
-    return get_window_matches(data, matches)
+# Constraint options of the search form, mapped to DtwConstraint kinds
+CONSTRAINT_OPTIONS = {'None': None, 'Sakoe-Chiba': 'sakoe_chiba', 'Itakura': 'itakura'}
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_index(_data: pd.DataFrame, data_key: str, window_time_start: time,
+                     window_size_days: int) -> SearchIndex:
+    """Return the search index of the loaded data, shared across reruns.
+
+    data_key identifies _data, which Streamlit doesn't hash.
+    """
+    return SearchIndex(_data, window_time_start, window_size_days)
+
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    """Return the runner of background searches, shared by all sessions.
+
+    Sessions submitting the same search share its job, so each subscribes with its session_id, and only
+    unsubscribes when it moves on or cancels.
+    """
+    return JobRunner()
+
+
+def run_search(search_index: SearchIndex, target_end: datetime, top: int = None,
+               constraint: DtwConstraint | None = None) -> Callable[[SearchJob], list[WindowMatch]]:
+    """Return a search to run as a background job. It reports progress and the best matches so far to the job."""
+    def search(job: SearchJob) -> list[WindowMatch]:
+        def report_progress(progress: float):
+            job.progress = progress
+
+        matches = []
+        for matches in search_index.stream(target_end, top, 'dtw_high_low_close_4', constraint=constraint,
+                                           progress_reporter=report_progress, should_cancel=job.cancelled):
+            job.provisional = matches
+        return get_window_matches(search_index.data, matches)
+    return search
+
+
+@st.fragment(run_every=0.5)
+def show_search_job():
+    """Poll the session's search job, and show its results once it completes"""
+    jobs = get_job_runner()
+    job = jobs.get(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        st.rerun()
+    elif job.state == DONE:
+        st.session_state.search_results = job.result()
+        st.session_state.job_id = None
+        st.rerun()
+    elif job.state == FAILED:
+        st.error(f'Search failed: {job.error()}')
+    elif job.state == CANCELLED:
+        st.info('Search cancelled')
+    else:
+        st.progress(job.progress, 'Searching for similar time ranges...')
+        if job.provisional:
+            # Best matches found so far
+            st.dataframe(pd.DataFrame(job.provisional, columns=MatchModel._fields), hide_index=True)
+        if st.button('Cancel search'):
+            # The job keeps running if another session submitted the same search
+            jobs.cancel(job.id, st.session_state.session_id)
+            st.session_state.job_id = None
+            st.session_state.search_cancelled = True
+            st.rerun()
+
+
+def show_projection(search_index: SearchIndex, target_end: datetime, results: list[WindowMatch], weighted: bool):
+    """Plot the target window with the mean and 20/80 quantile bands of what followed its matches.
+
+    The target is located in the search's WindowIndex, and it and the matches are views of the shared bars.
+    """
+    data = search_index.data
+    located = search_index.window_index(target_end.time()).locate(target_end)
+    if located is None:
+        st.warning("Can't load the target window")
+        return
+    start, end = located
+    # Include the bars that followed the target until the end of its day, if it isn't the latest
+    _, (following,) = projection_offsets(data.index, [data.index[end]])
+    target = WindowMatch(None, target_end, target_end, source=data, bounds=(start, end + 1 + int(following)))
+    matches = [MatchModel(match.start, match.match_end, match.score) for match in results
+               if match.match_end != target_end]
+    bands = build_projections(data, matches, target_end).bands(weighted=weighted)
+    if bands.empty:
+        st.info('No bars followed the matches to project from')
+        return
+    chart = create_streamlit_projection_chart(target, bands, width=1200)
+    chart.load()
 
 
 def main():
@@ -57,6 +146,10 @@ def main():
         st.session_state.counter = 0
         st.session_state.df = None
         st.session_state.search_results = None
+        st.session_state.search_target = None
+        st.session_state.job_id = None
+        st.session_state.session_id = uuid.uuid4().hex
+        st.session_state.search_cancelled = False
 
         # Initialize default form values
         st.session_state.search_start_date = now.date()
@@ -72,8 +165,8 @@ def main():
     # File uploader
     uploaded_file = st.file_uploader(
         "Choose a CSV file",
-        type=['csv', 'zip'],
-        help="Upload a CSV file with OHLCV data or a zipped CSV file"
+        type=['csv', 'zip', 'dbn', 'zst'],
+        help="Upload a CSV file with OHLCV data, a zipped CSV file or a Databento DBN file"
     )
 
     # Load data if file is uploaded
@@ -94,6 +187,9 @@ def main():
             st.session_state.target_end_time = time(10)
             st.session_state.lookback_days = 1
             st.session_state.top_n = 7
+            st.session_state.setdefault('constraint', 'None')
+            st.session_state.setdefault('sakoe_chiba_radius', 12)
+            st.session_state.setdefault('itakura_max_slope', 2.)
 
             # Only render the form if data is loaded
             form_container = st.container(key='form_container')
@@ -131,15 +227,58 @@ def main():
                         max_value=10,
                         key='top_n'
                     )
+                col5, col8, col9 = st.columns(3)
+                with col5:
+                    constraint_option = st.selectbox(
+                        "DTW Constraint",
+                        options=list(CONSTRAINT_OPTIONS),
+                        key='constraint',
+                        help="Restrict the DTW warping path. Narrower constraints are faster, but less flexible."
+                    )
+                with col8:
+                    sakoe_chiba_radius = st.number_input(
+                        "Sakoe-Chiba radius (bars)",
+                        min_value=0,
+                        max_value=500,
+                        key='sakoe_chiba_radius'
+                    )
+                with col9:
+                    itakura_max_slope = st.number_input(
+                        "Itakura max slope",
+                        min_value=1.,
+                        max_value=10.,
+                        key='itakura_max_slope'
+                    )
                 submitted = st.form_submit_button("Find Matches")
                 if submitted:
                     target_end_dt = EST.localize(datetime.combine(target_end, target_end_time))
-                    st.session_state.search_results = run_search(st.session_state.df, time(9, 30),
-                                                                target_lookback_days,
-                                                                target_end_dt, top_n)
+                    constraint_kind = CONSTRAINT_OPTIONS[constraint_option]
+                    constraint = DtwConstraint(constraint_kind, sakoe_chiba_radius,
+                                               itakura_max_slope) if constraint_kind else None
+                    search_index = get_search_index(st.session_state.df, uploaded_file.file_id, time(9, 30),
+                                                    target_lookback_days)
+                    jobs = get_job_runner()
+                    key = (uploaded_file.file_id, target_lookback_days, target_end_dt, top_n, constraint)
+                    session_id = st.session_state.session_id
+                    job = jobs.submit(key, run_search(search_index, target_end_dt, top_n, constraint), session_id)
+                    # A new search supersedes the session's previous one, unless another session holds it
+                    if st.session_state.job_id != job.id:
+                        jobs.cancel(st.session_state.job_id, session_id)
+                    st.session_state.job_id = job.id
+                    st.session_state.search_cancelled = False
+                    st.session_state.search_results = None
+                    st.session_state.search_target = (search_index, target_end_dt)
+
+    if st.session_state.job_id is not None:
+        show_search_job()
+    elif st.session_state.search_cancelled:
+        st.info('Search cancelled')
 
     # Display target if we have results
     if st.session_state.search_results is not None:
+        st.subheader("Projection")
+        weighted = st.checkbox('Weight projections by match score', key='weighted_projection')
+        show_projection(*st.session_state.search_target, st.session_state.search_results, weighted)
         st.subheader("Matches")
         with st.container(key='matches-container'):
             col6, col7 = st.columns(2)
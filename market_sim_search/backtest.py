@@ -0,0 +1,245 @@
+import hashlib
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from market_sim_search.constraints import DtwConstraint
+from market_sim_search.matches import STRATEGY_WEIGHTS, dtw_features_batch
+from market_sim_search.models import MatchModel
+from market_sim_search.parallel import SharedArray
+from market_sim_search.projections import DEFAULT_QUANTILES, build_projections, projection_offsets
+from market_sim_search.search_index import SearchIndex
+from market_sim_search.types import ProgressReporter
+from market_sim_search.windows import WindowIndex, bars_digest
+
+# Targets per block of the distance triangle. Each block is one task of the worker pool.
+block_size = 64
+
+
+def packed_row(i: int) -> slice:
+    """Return the slice of a packed distance triangle holding row i, the scores of windows 0 to i - 1 against i.
+
+    Rows are stored one after another, so entry [i, j] for j < i is at i * (i - 1) // 2 + j, and the triangle of a
+    prefix of the windows is a prefix of the triangle.
+    """
+    start = i * (i - 1) // 2
+    return slice(start, start + i)
+
+
+def distance_matrix(norm_windows: np.ndarray, lengths: np.ndarray, weights: dict[str, float],
+                    multivariate: bool = False, constraint: DtwConstraint | None = None, n_jobs: int = 1,
+                    previous: np.ndarray | None = None,
+                    progress_reporter: ProgressReporter | None = None) -> np.ndarray:
+    """Return the lower triangle of the matrix of the dtw_features score of each window against each earlier one.
+
+    The triangle is packed into a 1-D array, see packed_row: entry [i, j] for j < i is the score of candidate j
+    against target i, as a search for target i would score it. Entries of windows of length 0 are NaN. Rows are
+    computed in blocks of block_size targets, in a pool of n_jobs processes if n_jobs > 1. The windows are shared with
+    the workers through shared memory, and each writes its rows into a shared triangle, so only block bounds are
+    pickled. previous may hold the triangle of a prefix of the windows, e.g. the cached triangle before new days
+    were appended, so only the rows of the new windows are computed.
+    """
+    n_windows = len(norm_windows)
+    weight_array = np.array(list(weights.values()), dtype=np.float64)
+    # Number of windows of the previous triangle, whose rows are kept
+    first = (1 + math.isqrt(1 + 8 * len(previous))) // 2 if previous is not None else 0
+    blocks = [(start, min(start + block_size, n_windows)) for start in range(first, n_windows, block_size)]
+    logger.info(f'Computing {n_windows - first} rows of the distance triangle of {n_windows} windows in '
+                f'{len(blocks)} blocks')
+
+    def done(n: int):
+        if progress_reporter:
+            progress_reporter(n / len(blocks))
+
+    if n_jobs > 1 and len(blocks) > 1:
+        triangle_shm, triangle_ref = SharedArray.create(_empty_triangle(n_windows, previous))
+        windows_shm, windows_ref = SharedArray.create(norm_windows)
+        lengths_shm, lengths_ref = SharedArray.create(lengths)
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = [executor.submit(_score_shared_block, windows_ref, lengths_ref, triangle_ref, start, stop,
+                                           weight_array, multivariate, constraint)
+                           for start, stop in blocks]
+                for n, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    done(n)
+            triangle = np.ndarray(triangle_ref.shape, triangle_ref.dtype, buffer=triangle_shm.buf).copy()
+        finally:
+            for shm in (triangle_shm, windows_shm, lengths_shm):
+                shm.close()
+                shm.unlink()
+    else:
+        triangle = _empty_triangle(n_windows, previous)
+        for n, (start, stop) in enumerate(blocks, 1):
+            _score_block(norm_windows, lengths, start, stop, weight_array, multivariate, constraint, triangle)
+            done(n)
+    return triangle
+
+
+def _empty_triangle(n_windows: int, previous: np.ndarray | None) -> np.ndarray:
+    """Return a NaN triangle of n_windows, starting with the previous triangle of a prefix of them"""
+    triangle = np.full(n_windows * (n_windows - 1) // 2, np.nan)
+    if previous is not None:
+        triangle[:len(previous)] = previous
+    return triangle
+
+
+def _score_block(norm_windows: np.ndarray, lengths: np.ndarray, start: int, stop: int, weights: np.ndarray,
+                 multivariate: bool, constraint: DtwConstraint | None, triangle: np.ndarray):
+    """Score targets start to stop against every earlier window, writing their rows into the packed triangle"""
+    for i in range(start, stop):
+        if not lengths[i]:
+            continue
+        row = triangle[packed_row(i)]
+        earlier = np.arange(i)
+        # Windows of one length are scored by a single dtw_batch call
+        for length in np.unique(lengths[:i][lengths[:i] > 0]):
+            group = earlier[lengths[:i] == length]
+            try:
+                row[group] = dtw_features_batch(norm_windows[i, :lengths[i]], norm_windows[group, :length], weights,
+                                                multivariate, constraint)
+            except Exception:
+                logger.exception(f'Error calculating scores of target {i}')
+
+
+def _score_shared_block(norm_windows: SharedArray, lengths: SharedArray, triangle: SharedArray, start: int,
+                        stop: int, weights: np.ndarray, multivariate: bool, constraint: DtwConstraint | None):
+    """Worker side of distance_matrix: attach the shared arrays and score a block into the shared triangle"""
+    attached = [shared.attach() for shared in (norm_windows, lengths, triangle)]
+    try:
+        (_, windows_array), (_, lengths_array), (_, triangle_array) = attached
+        _score_block(windows_array, lengths_array, start, stop, weights, multivariate, constraint, triangle_array)
+    finally:
+        for shm, _ in attached:
+            shm.close()
+
+
+@dataclass
+class Backtest:
+    """The walk-forward replay of a search over every day of a history.
+
+    triangle holds the score of each candidate window against each later target window, packed as distance_matrix
+    returns it. results has a row per target with at least min_history earlier candidates, scoring the projection
+    bands of its top matches against the bars that actually followed the target:
+    band_hit_rate is the fraction of those bars within the outer quantile bands, direction_hit whether the mean
+    projection and the actual close moved the same way by the end of the day, and final_error the actual minus the
+    mean projected close at the end of the day, as a fraction of the target close.
+    """
+    ends: pd.DatetimeIndex
+    starts: pd.DatetimeIndex
+    triangle: np.ndarray
+    top: int
+    results: pd.DataFrame
+
+    def matches(self, target: int) -> list[MatchModel]:
+        """Return the top matches of target, the position of its end in ends, among the earlier windows"""
+        scores = self.triangle[packed_row(target)]
+        candidates = np.flatnonzero(~np.isnan(scores))
+        # Ties are broken by index order, like least_distance
+        order = candidates[np.argsort(scores[candidates], kind='stable')][:self.top]
+        return [MatchModel(self.starts[j], self.ends[j], float(scores[j])) for j in order]
+
+    def summary(self) -> dict:
+        """Return the hit rates averaged over every target"""
+        return {
+            'targets': len(self.results),
+            'band_hit_rate': float(self.results['band_hit_rate'].mean()),
+            'direction_hit_rate': float(self.results['direction_hit'].mean()),
+            'mean_abs_final_error': float(self.results['final_error'].abs().mean()),
+        }
+
+
+def walk_forward(data: pd.DataFrame, window_time_start: time, window_size_days: int, end_time: time, top: int = 7,
+                 strategy: str | dict[str, float] = 'dtw_high_low_close_4', multivariate: bool = False,
+                 constraint: DtwConstraint | None = None, min_history: int = 20,
+                 quantiles: tuple[float, float] = DEFAULT_QUANTILES, n_jobs: int = 1, cache_dir: Path | None = None,
+                 progress_reporter: ProgressReporter | None = None) -> Backtest:
+    """Replay the search for the window ending at end_time on every day of data, using only earlier windows as
+    candidates, and score the projections of each day's top matches against what followed.
+
+    Every pair of windows is scored once, in the distance_matrix, rather than rescanning the history for each day.
+    With cache_dir the triangle is saved there with a digest of the bars it was computed from, and a later backtest
+    over the same bars with more days appended only computes the rows of the new days.
+    """
+    weights = STRATEGY_WEIGHTS[strategy] if isinstance(strategy, str) else strategy
+    search_index = SearchIndex(data, window_time_start, window_size_days)
+    window_index = search_index.window_index(end_time)
+    norm_windows = search_index.normalized(end_time, tuple(weights))
+    ends = data.index[window_index.ends]
+    starts = data.index[np.where(window_index.valid, window_index.starts, window_index.ends)]
+
+    cache_file = None
+    previous = None
+    if cache_dir:
+        # The bar spacing, so frames of another frequency with windows ending at the same times don't share a cache
+        freq = str(pd.Timedelta(np.median(np.diff(data.index.asi8)))) if len(data) > 1 else None
+        key = json.dumps([str(window_time_start), window_size_days, str(end_time), list(weights.items()),
+                          multivariate, repr(constraint), str(data.index.tz), freq,
+                          int(ends[0].value) if len(ends) else 0])
+        cache_file = Path(cache_dir) / f'distances-{hashlib.sha256(key.encode()).hexdigest()[:16]}.npz'
+        previous = _load_triangle(cache_file, window_index)
+    triangle = distance_matrix(norm_windows, window_index.lengths, weights, multivariate, constraint, n_jobs,
+                               previous, progress_reporter)
+    if cache_file:
+        n_bars = int(window_index.ends.max()) + 1 if len(ends) else 0
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            np.savez(f, triangle=triangle, end_ns=ends.asi8, lengths=window_index.lengths, n_bars=n_bars,
+                     digest=bars_digest(window_index, n_bars))
+
+    backtest = Backtest(ends, starts, triangle, top, pd.DataFrame())
+    close = data['close'].to_numpy()
+    rows = []
+    for target in range(len(ends)):
+        if not window_index.lengths[target] or np.count_nonzero(~np.isnan(triangle[packed_row(target)])) < min_history:
+            continue
+        projections = build_projections(data, backtest.matches(target), ends[target])
+        # The bars that followed the target until the end of its day
+        (actual_start,), (actual_length,) = projection_offsets(data.index, [ends[target]])
+        actual = close[actual_start:actual_start + actual_length]
+        if not len(actual):
+            continue
+        mean = projections.mean()[:len(actual)]
+        low, high = projections.quantiles([quantiles[0], quantiles[-1]])[:, :len(actual)]
+        known = ~np.isnan(mean)
+        if not known.any():
+            continue
+        last = np.flatnonzero(known)[-1]
+        rows.append({
+            'target_end': ends[target],
+            'matches': len(projections.values),
+            'band_hit_rate': float(np.mean((actual[known] >= low[known]) & (actual[known] <= high[known]))),
+            'direction_hit': bool(np.sign(mean[last] - projections.base) == np.sign(actual[last] - projections.base)),
+            'final_error': float((actual[last] - mean[last]) / projections.base),
+        })
+    backtest.results = pd.DataFrame(rows, columns=['target_end', 'matches', 'band_hit_rate', 'direction_hit',
+                                                   'final_error'])
+    logger.info(f'Backtest of {len(backtest.results)} targets: {backtest.summary()}')
+    return backtest
+
+
+def _load_triangle(cache_file: Path, window_index: WindowIndex) -> np.ndarray | None:
+    """Return the cached triangle if its windows are a prefix of the current ones, computed from the same bars, else
+    None"""
+    try:
+        with np.load(cache_file) as cached:
+            triangle, cached_ends, cached_lengths = cached['triangle'], cached['end_ns'], cached['lengths']
+            n_bars, digest = int(cached['n_bars']), str(cached['digest'])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+    end_ns = window_index.index.asi8[window_index.ends]
+    n = len(cached_ends)
+    if (n > len(end_ns) or not np.array_equal(cached_ends, end_ns[:n])
+            or not np.array_equal(cached_lengths, window_index.lengths[:n])
+            or n_bars > len(window_index.values) or bars_digest(window_index, n_bars) != digest):
+        logger.info(f'Ignoring stale distance triangle {cache_file}')
+        return None
+    logger.info(f'Reusing {n} rows of the distance triangle from {cache_file}')
+    return triangle
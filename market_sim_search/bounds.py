@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from market_sim_search.constraints import DtwConstraint
+
+# Relative slack applied before pruning, so a lower bound that rounds above the exact DTW distance can't drop a match
+prune_tolerance = 1e-9
+
+
+@dataclass
+class PruneStats:
+    """Counts of where each candidate of a pruned top N search was resolved"""
+    candidates: int = 0
+    pruned_kim: int = 0
+    pruned_keogh: int = 0
+    abandoned: int = 0
+    full_dtw: int = 0
+
+    @property
+    def pruned(self) -> int:
+        return self.pruned_kim + self.pruned_keogh + self.abandoned
+
+
+def lb_kim(norm_target: np.ndarray, norm_windows: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Return the squared LB_Kim lower bound of each feature, as a (n_windows, n_features) array.
+
+    Every warping path aligns the first points and the last points of both series, so their squared differences
+    bound the squared DTW distance from below.
+    """
+    last = np.maximum(lengths - 1, 0)
+    first_windows = norm_windows[:, 0]
+    last_windows = norm_windows[np.arange(len(norm_windows)), last]
+    bound = (norm_target[0] - first_windows) ** 2
+    # A single cell path only has one point to align
+    has_last = (lengths > 1) | (len(norm_target) > 1)
+    bound += np.where(has_last[:, None], (norm_target[-1] - last_windows) ** 2, 0)
+    return bound
+
+
+def target_envelope(norm_target: np.ndarray, lengths: np.ndarray,
+                    constraint: DtwConstraint | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Return the lower and upper envelope of the target that each window point can be aligned to.
+
+    Without a constraint any target point can be aligned, so the envelope is the target's min and max per feature.
+    With a constraint the envelope is taken over the target points the constraint allows for each window position,
+    as a NaN padded (n_windows, max_length, n_features) array matching the window tensor.
+    """
+    if constraint is None:
+        return norm_target.min(axis=0), norm_target.max(axis=0)
+
+    n_features = norm_target.shape[1]
+    max_length = int(lengths.max()) if len(lengths) else 0
+    lower = np.full((len(lengths), max_length, n_features), np.nan)
+    upper = np.full((len(lengths), max_length, n_features), np.nan)
+    for length in np.unique(lengths[lengths > 0]):
+        same_length = lengths == length
+        lower[same_length, :length], upper[same_length, :length] = _constrained_envelope(norm_target, length,
+                                                                                         constraint)
+    return lower, upper
+
+
+def _constrained_envelope(norm_target: np.ndarray, length: int,
+                          constraint: DtwConstraint) -> tuple[np.ndarray, np.ndarray]:
+    """Return the (length, n_features) envelope of the target for windows of one length"""
+    try:
+        allowed = constraint.mask(len(norm_target), length)
+    except ValueError:
+        # An infeasible constraint has no usable envelope. DTW fails on these windows too.
+        return np.full((length, norm_target.shape[1]), -np.inf), np.full((length, norm_target.shape[1]), np.inf)
+
+    # The allowed target points of each window position are a contiguous run, so the envelope is a min/max over
+    # [first, last] of each column. Append a row so reduceat can index one past the end of the target.
+    has_any = allowed.any(axis=0)
+    first = allowed.argmax(axis=0)
+    last = len(allowed) - 1 - allowed[::-1].argmax(axis=0)
+    ranges = np.stack([first, last + 1], axis=1).ravel()
+    padded = np.vstack([norm_target, norm_target[-1:]])
+    lower = np.minimum.reduceat(padded, ranges, axis=0)[::2]
+    upper = np.maximum.reduceat(padded, ranges, axis=0)[::2]
+    lower[~has_any] = -np.inf
+    upper[~has_any] = np.inf
+    return lower, upper
+
+
+def lb_keogh(lower: np.ndarray, upper: np.ndarray, norm_windows: np.ndarray) -> np.ndarray:
+    """Return the squared LB_Keogh lower bound of each feature, as a (n_windows, n_features) array.
+
+    Every point of a window is aligned to at least one target point within the envelope, so its distance to the
+    envelope bounds its contribution from below. Padding past a window's length is NaN and contributes nothing.
+    """
+    distance = norm_windows - np.clip(norm_windows, lower, upper)
+    return np.nansum(distance ** 2, axis=1)
+
+
+def combine_bounds(squared: np.ndarray, weights: np.ndarray, multivariate: bool = False) -> np.ndarray:
+    """Combine squared per-feature bounds into a bound of the dtw_features score"""
+    if multivariate:
+        return np.sqrt(squared @ (weights / weights.sum()))
+    return np.sqrt(squared) @ weights / weights.sum()
+
+
+def can_prune(bound: float, threshold: float) -> bool:
+    """Return True if a candidate with this lower bound can't score below threshold"""
+    return bound * (1 - prune_tolerance) > threshold
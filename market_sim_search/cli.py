@@ -0,0 +1,121 @@
+"""Run a search from cached data and write the ranked matches and projection bands, e.g. from a cron job.
+
+The source is a ProcessedStore directory, or a zipped csv or DBN file, which load_processed processes once and
+caches in data/processed. The target is the window ending at --target-end, the last bar by default.
+
+Output is JSON, on stdout by default, or Parquet if --output ends with .parquet. Parquet writes the matches to
+--output and the bands next to it as <name>-bands.parquet.
+
+Example:
+    market-sim-search data/examples/qqq-20240701-20241004.ohlcv-1m.csv.zip --target-end "2024-10-04 10:00"
+"""
+import argparse
+import json
+import math
+import sys
+from pathlib import Path
+
+# Only the standard library is imported above, the search modules are imported once the arguments are parsed, so
+# --help and argument errors are instant. Nothing here imports the plotting or UI modules.
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='market-sim-search', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', type=Path, help='ProcessedStore directory, or zipped csv or DBN file')
+    parser.add_argument('--freq', default='5min', help='Frame of the store, or resampling of the file')
+    parser.add_argument('--target-end', help='End of the target window, in the time zone of the data')
+    parser.add_argument('--window-start', default='09:30', help='Time of day windows start at')
+    parser.add_argument('--days', type=int, default=1, help='Window size in days')
+    parser.add_argument('--top', type=int, default=7)
+    parser.add_argument('--strategy', default='dtw_high_low_close_4', help='A name from STRATEGY_WEIGHTS')
+    parser.add_argument('--multivariate', action='store_true')
+    parser.add_argument('--shortlist', type=int, help='Only score this many candidates shortlisted approximately')
+    parser.add_argument('--quantiles', type=float, nargs='*', help='Quantiles of the projection bands')
+    parser.add_argument('--weighted', action='store_true', help='Weight projections by their match score')
+    parser.add_argument('--output', '-o', default='-', help='.json or .parquet file, or - for stdout')
+    parser.add_argument('--log-level', default='WARNING', help='Level of the logs written to stderr')
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level.upper())
+
+    import pandas as pd
+
+    from market_sim_search.matches import STRATEGY_WEIGHTS
+    from market_sim_search.projections import DEFAULT_QUANTILES, build_projections
+    from market_sim_search.search_index import SearchIndex
+
+    if args.strategy not in STRATEGY_WEIGHTS:
+        parser.error(f'Unknown strategy {args.strategy}, expected one of {list(STRATEGY_WEIGHTS)}')
+    data = load_source(args.source, args.freq)
+    if data.empty:
+        parser.error(f'No bars in {args.source}')
+    target_end = pd.Timestamp(args.target_end) if args.target_end else data.index[-1]
+    if target_end.tzinfo is None and data.index.tz is not None:
+        target_end = target_end.tz_localize(data.index.tz)
+
+    search_index = SearchIndex(data, pd.Timestamp(args.window_start).time(), args.days, cache_size=0)
+    # One more match, as the target's own window is among the candidates, then it is dropped so its actual future
+    # isn't projected
+    matches = search_index.search(target_end, args.top + 1, args.strategy, args.multivariate, shortlist=args.shortlist)
+    matches = [match for match in matches if match.end != target_end][:args.top]
+    bands = build_projections(data, matches, target_end).bands(args.quantiles or DEFAULT_QUANTILES, args.weighted)
+    results = pd.DataFrame({
+        'rank': range(1, len(matches) + 1),
+        'start': [match.start for match in matches],
+        'end': [match.end for match in matches],
+        'score': [match.score for match in matches],
+    })
+    write_output(args.output, target_end, args.strategy, results, bands)
+
+
+def load_source(source: Path, freq: str):
+    """Return the bars of a ProcessedStore at freq, or of a csv or DBN file resampled to freq and cached"""
+    if source.is_dir():
+        from market_sim_search.ingest import ProcessedStore
+
+        return ProcessedStore(source).frame(freq)
+    from market_sim_search.config import EST
+    from market_sim_search.data import load_processed
+
+    return load_processed(source, EST, freq=freq)
+
+
+def write_output(output: str, target_end, strategy: str, results, bands):
+    """Write the matches and bands as JSON to output, or stdout if it is -, or as Parquet if output ends with
+    .parquet"""
+    if output.endswith('.parquet'):
+        path = Path(output)
+        results.assign(target_end=target_end).to_parquet(path)
+        bands.rename_axis('time').reset_index().to_parquet(path.with_name(f'{path.stem}-bands.parquet'))
+        return
+
+    def records(frame) -> list[dict]:
+        # Timestamps keep their time zone, and NaN is null
+        return [{column: value.isoformat() if hasattr(value, 'isoformat')
+                 else None if isinstance(value, float) and math.isnan(value) else value
+                 for column, value in row.items()}
+                for row in frame.to_dict(orient='records')]
+
+    document = json.dumps({
+        'target_end': target_end.isoformat(),
+        'strategy': strategy,
+        'matches': records(results),
+        'bands': records(bands.rename_axis('time').reset_index()),
+    }, indent=1)
+    if output == '-':
+        print(document)
+    else:
+        Path(output).write_text(document + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+CONSTRAINT_KINDS = ['sakoe_chiba', 'itakura']
+
+
+@dataclass(frozen=True)
+class DtwConstraint:
+    """A global constraint on the DTW warping path.
+
+    'sakoe_chiba' limits the path to a band of radius bars around the diagonal. 'itakura' limits it to a
+    parallelogram whose sides have max_slope. Either way DTW cost scales with the size of the allowed region rather
+    than with the full n x m cost matrix.
+    """
+    kind: str = 'sakoe_chiba'
+    radius: int = 1
+    max_slope: float = 2.
+
+    def __post_init__(self):
+        if self.kind not in CONSTRAINT_KINDS:
+            raise ValueError(f'Unknown DTW constraint {self.kind}, expected one of {CONSTRAINT_KINDS}')
+        if self.radius < 0:
+            raise ValueError(f'Sakoe-Chiba radius must not be negative, got {self.radius}')
+        if self.max_slope < 1:
+            raise ValueError(f'Itakura max slope must be at least 1, got {self.max_slope}')
+
+    def dtw_kwargs(self) -> dict:
+        """Return the keyword arguments applying this constraint to tslearn.metrics.dtw"""
+        if self.kind == 'sakoe_chiba':
+            return {'global_constraint': 'sakoe_chiba', 'sakoe_chiba_radius': self.radius}
+        return {'global_constraint': 'itakura', 'itakura_max_slope': self.max_slope}
+
+    def mask(self, target_length: int, window_length: int) -> np.ndarray:
+        """Return the (target_length, window_length) boolean mask of cells the warping path may visit.
+
+        tslearn is imported on first use, as it's slow to import.
+        """
+        from tslearn.metrics.dtw_variants import GLOBAL_CONSTRAINT_CODE, compute_mask
+
+        kwargs = self.dtw_kwargs()
+        code = GLOBAL_CONSTRAINT_CODE[kwargs.pop('global_constraint')]
+        return compute_mask(int(target_length), int(window_length), code, **kwargs) == 0
+
+
+def dtw_kwargs(constraint: DtwConstraint | None) -> dict:
+    """Return the keyword arguments applying an optional constraint to tslearn.metrics.dtw"""
+    return constraint.dtw_kwargs() if constraint else {}
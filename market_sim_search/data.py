@@ -1,9 +1,29 @@
+import hashlib
+import json
+import shutil
 from pathlib import Path
+from typing import BinaryIO, Iterator
 
 from loguru import logger
 import pandas as pd
 
-from market_sim_search.config import EST
+from market_sim_search.config import EST, PROCESSED_DATA_DIR
+from market_sim_search.dbn import is_dbn, read_dbn
+from market_sim_search.store import read_frame, read_meta, write_frame
+
+DIGESTS_FILE = 'digests.json'
+
+
+# Column of the instrument symbol in Databento csv files
+SYMBOL = 'symbol'
+
+# Dtypes of the OHLCV columns read by read_csv_chunks. Prices need no more than float32 precision, and a bar's
+# volume fits in uint32.
+COMPACT_DTYPES = {'open': 'float32', 'high': 'float32', 'low': 'float32', 'close': 'float32', 'volume': 'uint32'}
+
+# Bars outside of this time of day range are dropped when loading
+SESSION_START = '04:00'
+SESSION_END = '17:00'
 
 
 def load_csv(input_file: Path, tz=EST, dedupe: bool = True) -> pd.DataFrame:
@@ -12,19 +32,90 @@ def load_csv(input_file: Path, tz=EST, dedupe: bool = True) -> pd.DataFrame:
     This was created to load data from Databento.
     It expects a datetimetz column named ts_event which is converted to New York time.
     """
+    df = _read_csv(input_file)
+    _warn_mixed_symbols(df, input_file)
+    return clean_bars(df, tz, dedupe)
+
+
+def load_dbn(input_file: Path | BinaryIO, tz=EST, dedupe: bool = True) -> pd.DataFrame:
+    """Load OHLCV data from a Databento DBN file, optionally zstd compressed, into the frame load_csv returns.
+
+    The fixed width records are read straight into arrays by dbn.read_dbn, skipping csv and timestamp parsing.
+    """
+    df = read_dbn(input_file)
+    logger.info(f'Loaded {len(df)} rows from {input_file}')
+    _warn_mixed_symbols(df, input_file)
+    return clean_bars(df, tz, dedupe)
+
+
+def load_bars(input_file: Path | BinaryIO, tz=EST, dedupe: bool = True) -> pd.DataFrame:
+    """Load OHLCV data with load_dbn if input_file is named like a DBN file, else with load_csv"""
+    return load_dbn(input_file, tz, dedupe) if is_dbn(input_file) else load_csv(input_file, tz, dedupe)
+
+
+def _warn_mixed_symbols(df: pd.DataFrame, input_file: Path | BinaryIO):
+    if SYMBOL in df and df[SYMBOL].nunique() > 1:
+        logger.warning(f'{input_file} holds {df[SYMBOL].nunique()} symbols, their bars will be mixed. '
+                       f'Use load_symbols to load each separately.')
+
+
+def load_symbols(input_file: Path | BinaryIO, tz=EST, dedupe: bool = True,
+                 freq: str | None = None) -> dict[str, pd.DataFrame]:
+    """Load a multi-symbol zipped csv, such as a Databento export of several instruments, into one frame per symbol.
+
+    Bars are grouped by the symbol column, then cleaned like load_csv and optionally resampled to freq. A file
+    without a symbol column is loaded as the single symbol named after the file.
+    """
+    df = _read_csv(input_file)
+    if SYMBOL not in df:
+        source = input_file if isinstance(input_file, (str, Path)) else getattr(input_file, 'name', 'upload')
+        df[SYMBOL] = Path(source).name.split('.')[0]
+    universe = {}
+    for symbol, bars in df.groupby(SYMBOL, sort=True):
+        bars = clean_bars(bars.drop(columns=SYMBOL), tz, dedupe)
+        universe[str(symbol)] = resample(bars, freq) if freq else bars
+    logger.info(f'Loaded {len(universe)} symbols from {input_file}')
+    return universe
+
+
+def _read_csv(input_file: Path | BinaryIO) -> pd.DataFrame:
     df = pd.read_csv(input_file, compression='zip', parse_dates=['ts_event'], index_col='ts_event',
                      date_format='ISO8601')
+    logger.info(f"Loaded {len(df)} rows from {input_file}")
+    return df
+
+
+def read_csv_chunks(input_file: Path | BinaryIO, chunk_size: int = 1_000_000,
+                    symbol: str | None = None) -> Iterator[pd.DataFrame]:
+    """Read a zipped csv chunk_size rows at a time, keeping only the OHLCV columns as COMPACT_DTYPES.
+
+    Chunks are indexed by the UTC ts_event, uncleaned, so memory is bounded by the chunk size rather than the file
+    size. With symbol only the rows of that symbol are kept, from a multi-symbol file.
+    """
+    columns = ['ts_event', *COMPACT_DTYPES] + ([SYMBOL] if symbol else [])
+    with pd.read_csv(input_file, compression='zip', usecols=columns, dtype=COMPACT_DTYPES,
+                     chunksize=chunk_size) as reader:
+        for chunk in reader:
+            if symbol:
+                chunk = chunk[chunk[SYMBOL] == symbol].drop(columns=SYMBOL)
+            chunk.index = pd.DatetimeIndex(pd.to_datetime(chunk.pop('ts_event'), format='ISO8601', utc=True),
+                                           name='ts_event')
+            yield chunk
+
+
+def clean_bars(df: pd.DataFrame, tz=EST, dedupe: bool = True) -> pd.DataFrame:
+    """Convert raw bars indexed by a UTC timestamp to tz, drop duplicates and missing values and filter to the
+    session time range"""
     if tz:
         df.index = df.index.tz_convert(tz)
     df.index.rename('time', inplace=True)
-    logger.info(f"Loaded {len(df)} rows from {input_file}")
 
     if dedupe:
         logger.info(f'Found {df.index.duplicated().sum()} duplicates, dropping.')
         df = df[~df.index.duplicated()]
 
     df.dropna(inplace=True)
-    df = df.between_time('04:00', '17:00')
+    df = df.between_time(SESSION_START, SESSION_END)
     return df
 
 
@@ -33,3 +124,85 @@ def resample(df: pd.DataFrame, freq: str) -> pd.DataFrame:
     df = df.resample(freq).agg({'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'})
     df.dropna(inplace=True)
     return df
+
+
+def file_digest(input_file: Path | BinaryIO, cache_dir: Path | None = None) -> str:
+    """Return the sha256 of a file's contents.
+
+    input_file may be a path or a file-like object, such as a Streamlit upload. Digests of paths are remembered in
+    cache_dir by size and modification time, so an unchanged source isn't hashed again.
+    """
+    if not isinstance(input_file, (str, Path)):
+        content = input_file.getvalue() if hasattr(input_file, 'getvalue') else input_file.read()
+        if hasattr(input_file, 'seek'):
+            input_file.seek(0)
+        return hashlib.sha256(content).hexdigest()
+
+    input_file = Path(input_file).resolve()
+    stat = input_file.stat()
+    digests_file = Path(cache_dir) / DIGESTS_FILE if cache_dir else None
+    digests = {}
+    if digests_file and digests_file.exists():
+        try:
+            digests = json.loads(digests_file.read_text())
+        except json.JSONDecodeError:
+            pass
+    known = digests.get(str(input_file))
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['digest']
+
+    digest = hashlib.sha256()
+    with open(input_file, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    if digests_file:
+        digests[str(input_file)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest.hexdigest()}
+        digests_file.parent.mkdir(parents=True, exist_ok=True)
+        digests_file.write_text(json.dumps(digests, indent=1))
+    return digest.hexdigest()
+
+
+def cache_key(digest: str, tz=EST, dedupe: bool = True, freq: str | None = None) -> str:
+    """Return the cache key of a source file processed with the given load_csv and resample arguments"""
+    params = f'{digest}|{tz}|{dedupe}|{freq}'
+    return hashlib.sha256(params.encode()).hexdigest()[:16]
+
+
+def load_processed(input_file: Path | BinaryIO, tz=EST, dedupe: bool = True, freq: str | None = None,
+                   cache_dir: Path = PROCESSED_DATA_DIR) -> pd.DataFrame:
+    """Load OHLCV data with load_bars and optionally resample it, caching the processed frame.
+
+    The processed frame is stored in cache_dir as memory mapped columns, keyed on the source's content hash, the
+    timezone, dedupe and freq. Later loads with the same arguments reopen it instead of parsing the source again.
+    When the source changes its hash does too, so the stale entry is replaced.
+    """
+    cache_dir = Path(cache_dir)
+    source = str(input_file) if isinstance(input_file, (str, Path)) else getattr(input_file, 'name', 'upload')
+    key = cache_key(file_digest(input_file, cache_dir), tz, dedupe, freq)
+    path = cache_dir / f'{Path(source).name.split(".")[0]}-{key}'
+    if read_meta(path) is not None:
+        df = read_frame(path)
+        logger.info(f'Loaded {len(df)} rows of {source} from cache {path}')
+        return df
+
+    df = load_bars(input_file, tz, dedupe)
+    if freq:
+        df = resample(df, freq)
+    _remove_stale_entries(cache_dir, source, path, tz, dedupe, freq)
+    write_frame(df, path, source=source, key=key, tz=str(tz), dedupe=dedupe, freq=freq)
+    logger.info(f'Cached {len(df)} rows of {source} in {path}')
+    return df
+
+
+def _remove_stale_entries(cache_dir: Path, source: str, keep: Path, tz, dedupe: bool, freq: str | None):
+    """Remove frames cached from an older version of source with the same tz, dedupe and freq.
+
+    Entries cached before the tz was stored in their metadata are never matched, so they are left in place.
+    """
+    for path in cache_dir.glob(f'{Path(source).name.split(".")[0]}-*'):
+        meta = read_meta(path)
+        if (path == keep or meta is None or meta.get('source') != source or meta.get('tz') != str(tz)
+                or meta.get('dedupe') != dedupe or meta.get('freq') != freq):
+            continue
+        logger.info(f'Removing stale cache {path}')
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,145 @@
+"""Read Databento DBN files of OHLCV bars straight into NumPy arrays, without the databento client.
+
+A DBN file is a metadata header followed by fixed width little-endian records. The records of an OHLCV file are
+memory mapped as a structured array, or decompressed in one pass if the file is zstd compressed, and their
+fixed-point prices are converted with vectorized operations.
+"""
+import io
+import struct
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'DBN'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Record types of OHLCV bars: 1 second, 1 minute, 1 hour, 1 day and end of day
+OHLCV_RTYPES = (0x20, 0x21, 0x22, 0x23, 0x24)
+
+# Prices are signed integers in units of 1e-9, with the maximum meaning no price
+FIXED_PRICE_SCALE = 1_000_000_000
+UNDEF_PRICE = np.iinfo(np.int64).max
+
+# Header of every record, followed by the OHLCV body. Files encoded with ts_out have 8 more bytes per record.
+OHLCV_FIELDS = [('length', '<u1'), ('rtype', '<u1'), ('publisher_id', '<u2'), ('instrument_id', '<u4'),
+                ('ts_event', '<u8'), ('open', '<i8'), ('high', '<i8'), ('low', '<i8'), ('close', '<i8'),
+                ('volume', '<u8')]
+OHLCV_DTYPE = np.dtype(OHLCV_FIELDS)
+
+# Length of the fixed part of the metadata, after the 8 byte prefix, and of symbols in version 1 files
+FIXED_METADATA_LENGTH = 100
+SYMBOL_CSTR_LEN_V1 = 22
+
+
+def is_dbn(input_file: Path | BinaryIO) -> bool:
+    """Whether input_file is named like a DBN file, e.g. qqq.ohlcv-1m.dbn or qqq.ohlcv-1m.dbn.zst"""
+    name = str(input_file) if isinstance(input_file, (str, Path)) else getattr(input_file, 'name', '')
+    return name.endswith(('.dbn', '.dbn.zst'))
+
+
+def read_dbn(input_file: Path | BinaryIO) -> pd.DataFrame:
+    """Read the OHLCV records of a DBN file, optionally zstd compressed, into a frame indexed by the UTC ts_event.
+
+    The columns are those of a Databento csv export: rtype, publisher_id, instrument_id, open, high, low, close,
+    volume and symbol, the raw symbol of each instrument in the file's symbology mappings. Prices are floats and
+    undefined prices are NaN. Uncompressed files on disk are memory mapped, so only the columns are copied.
+    """
+    buffer = _read_buffer(input_file)
+    if bytes(buffer[:3]) != MAGIC:
+        raise ValueError(f'{input_file} is not a DBN file')
+    version = int(buffer[3])
+    (metadata_length,) = struct.unpack_from('<I', buffer, 4)
+    symbols = _symbol_mappings(bytes(buffer[8:8 + metadata_length]), version)
+
+    records = buffer[8 + metadata_length:]
+    record_length = int(records[0]) * 4 if len(records) else OHLCV_DTYPE.itemsize
+    if record_length < OHLCV_DTYPE.itemsize or len(records) % record_length:
+        raise ValueError(f'{input_file} does not hold OHLCV records')
+    dtype = np.dtype({'names': OHLCV_DTYPE.names, 'formats': [OHLCV_DTYPE[name] for name in OHLCV_DTYPE.names],
+                      'offsets': [OHLCV_DTYPE.fields[name][1] for name in OHLCV_DTYPE.names],
+                      'itemsize': record_length})
+    array = np.frombuffer(records, dtype=dtype)
+    if len(array) and ((array['length'] != record_length // 4).any() or ~np.isin(array['rtype'], OHLCV_RTYPES).any()):
+        raise ValueError(f'{input_file} holds records other than OHLCV bars')
+
+    df = pd.DataFrame({
+        'rtype': array['rtype'].astype(np.int64),
+        'publisher_id': array['publisher_id'].astype(np.int64),
+        'instrument_id': array['instrument_id'].astype(np.int64),
+        **{column: _prices(array[column]) for column in ['open', 'high', 'low', 'close']},
+        'volume': array['volume'].astype(np.int64),
+    }, index=pd.DatetimeIndex(array['ts_event'].astype(np.int64).view('M8[ns]'), name='ts_event').tz_localize('UTC'))
+    # Instruments missing from the mappings are named by their id, as they would be in a csv of ids
+    names = {instrument_id: symbols.get(instrument_id, str(instrument_id))
+             for instrument_id in np.unique(array['instrument_id']).tolist()}
+    df['symbol'] = df['instrument_id'].map(names)
+    return df
+
+
+def _read_buffer(input_file: Path | BinaryIO) -> memoryview | np.memmap:
+    """Return the bytes of a DBN file, memory mapped if it is an uncompressed file on disk"""
+    if isinstance(input_file, (str, Path)):
+        with open(input_file, 'rb') as f:
+            compressed = f.read(4) == ZSTD_MAGIC
+        if not compressed:
+            return np.memmap(input_file, dtype=np.uint8, mode='r')
+        with open(input_file, 'rb') as f:
+            return memoryview(_decompress(f))
+    content = input_file.getvalue() if hasattr(input_file, 'getvalue') else input_file.read()
+    if content[:4] != ZSTD_MAGIC:
+        return memoryview(content)
+    return memoryview(_decompress(io.BytesIO(content)))
+
+
+def _decompress(f: BinaryIO) -> bytes:
+    """Decompress a zstd stream. zstandard is imported on first use, as only compressed files need it."""
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('Reading zstd compressed DBN files requires zstandard: pip install zstandard') from e
+    with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+        return reader.read()
+
+
+def _prices(fixed: np.ndarray) -> np.ndarray:
+    """Convert fixed-point prices to floats. Division is correctly rounded, so prices match those parsed from csv."""
+    return np.where(fixed == UNDEF_PRICE, np.nan, fixed / FIXED_PRICE_SCALE)
+
+
+def _symbol_mappings(metadata: bytes, version: int) -> dict[int, str]:
+    """Return the raw symbol of each instrument id in the symbology mappings of the metadata"""
+    if version == 1:
+        symbol_length = SYMBOL_CSTR_LEN_V1
+    else:
+        (symbol_length,) = struct.unpack_from('<H', metadata, 45)
+    (schema_definition_length,) = struct.unpack_from('<I', metadata, FIXED_METADATA_LENGTH)
+    offset = FIXED_METADATA_LENGTH + 4 + schema_definition_length
+
+    def symbol() -> str:
+        nonlocal offset
+        value = metadata[offset:offset + symbol_length].split(b'\0', 1)[0].decode()
+        offset += symbol_length
+        return value
+
+    def count() -> int:
+        nonlocal offset
+        (value,) = struct.unpack_from('<I', metadata, offset)
+        offset += 4
+        return value
+
+    # Requested symbols, partially resolved and unresolved ones
+    for _ in range(3):
+        n_symbols = count()
+        offset += n_symbols * symbol_length
+    mappings = {}
+    for _ in range(count()):
+        raw_symbol = symbol()
+        for _ in range(count()):
+            # Start and end dates of the interval, then the instrument id as text
+            offset += 8
+            mapped = symbol()
+            if mapped.isdigit():
+                mappings[int(mapped)] = raw_symbol
+    return mappings
@@ -0,0 +1,121 @@
+import numpy as np
+
+from market_sim_search.constraints import DtwConstraint
+
+# The fewest targets dtw_cross pads to a block of kernels.LANES
+MIN_CROSS_TARGETS = 3
+
+
+def _kernels():
+    """Return the compiled kernels module, imported on first use so numba is only imported when DTW runs"""
+    from market_sim_search import kernels
+
+    return kernels
+
+
+def band(target_length: int, window_length: int,
+         constraint: DtwConstraint | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Return the first and last window position each target point may be aligned to.
+
+    Raises ValueError if the constraint allows no path between series of these lengths.
+    """
+    if constraint is None:
+        return np.zeros(target_length, dtype=np.int64), np.full(target_length, window_length - 1, dtype=np.int64)
+    allowed = constraint.mask(target_length, window_length)
+    has_any = allowed.any(axis=1)
+    lo = np.where(has_any, allowed.argmax(axis=1), 1)
+    hi = np.where(has_any, window_length - 1 - allowed[:, ::-1].argmax(axis=1), 0)
+    return lo.astype(np.int64), hi.astype(np.int64)
+
+
+def _as_features(series: np.ndarray) -> np.ndarray:
+    """Return series with a trailing feature axis, as the kernel expects"""
+    series = np.asarray(series)
+    if not np.issubdtype(series.dtype, np.floating):
+        series = series.astype(np.float64)
+    return series[..., None] if series.ndim == 1 else series
+
+
+def dtw_batch(target: np.ndarray, windows: np.ndarray, threshold: float | np.ndarray = np.inf,
+              constraint: DtwConstraint | None = None) -> np.ndarray:
+    """Return the DTW distance between target and each window of an equal length batch, in a single compiled call.
+
+    target is a (n,) series or (n, n_features) array, and windows a (n_windows, m) or (n_windows, m, n_features)
+    batch. float32 inputs are read as is, costs are accumulated in float64. Distances match tslearn.metrics.dtw.
+    A window is abandoned as soon as its distance must exceed threshold, which may be given per window, and inf is
+    returned for it.
+    """
+    target = _as_features(target)
+    windows = np.asarray(windows)
+    windows = _as_features(windows[..., None] if windows.ndim == 2 else windows)
+    if windows.ndim != 3 or windows.shape[2] != target.shape[1]:
+        raise ValueError(f'Expected windows of shape (n_windows, m, {target.shape[1]}), got {windows.shape}')
+    lo, hi = band(len(target), windows.shape[1], constraint)
+    limits = np.broadcast_to(np.square(np.asarray(threshold, dtype=np.float64)), len(windows))
+    return np.sqrt(_kernels().batch_cost(np.ascontiguousarray(target), np.ascontiguousarray(windows), lo, hi,
+                                         np.ascontiguousarray(limits)))
+
+
+def dtw_cross(targets: list[np.ndarray] | np.ndarray, windows: np.ndarray,
+              constraint: DtwConstraint | None = None) -> np.ndarray:
+    """Return the DTW distance between each of several targets and each window of an equal length batch.
+
+    targets holds (n,) or (n, n_features) series of any lengths, and windows is a (n_windows, m) or
+    (n_windows, m, n_features) batch. Returns (n_targets, n_windows) distances, those of dtw_batch for each target.
+    Targets are aligned to a window kernels.LANES at a time by a vectorized kernel, batches of fewer than
+    MIN_CROSS_TARGETS one by one.
+    """
+    targets = [_as_features(target) for target in targets]
+    windows = np.asarray(windows)
+    windows = np.ascontiguousarray(_as_features(windows[..., None] if windows.ndim == 2 else windows))
+    if windows.ndim != 3 or any(target.ndim != 2 or target.shape[1] != windows.shape[2] for target in targets):
+        raise ValueError(f'Expected targets with the {windows.shape[-1]} features of the windows, got '
+                         f'{[target.shape for target in targets]} and {windows.shape}')
+    kernels = _kernels()
+    n_targets, (n_windows, m, n_features) = len(targets), windows.shape
+    bands = {n: band(n, m, constraint) for n in {len(target) for target in targets}}
+    if n_targets < MIN_CROSS_TARGETS:
+        no_limits = np.full(n_windows, np.inf)
+        return np.sqrt(np.array([kernels.batch_cost(np.ascontiguousarray(target), windows, *bands[len(target)],
+                                                    no_limits)
+                                 for target in targets]).reshape(n_targets, n_windows))
+
+    # Targets are blocked by length, so those of a block end on close rows. Padding lanes have empty bands.
+    order = np.argsort([len(target) for target in targets], kind='stable')
+    lanes = kernels.LANES
+    n_blocks = -(-n_targets // lanes)
+    n = max(bands)
+    blocks = np.zeros((n_blocks * lanes, n, n_features), dtype=np.result_type(*targets))
+    lo = np.full((n_blocks * lanes, n), m, dtype=np.int64)
+    hi = np.full((n_blocks * lanes, n), -1, dtype=np.int64)
+    last = np.full(n_blocks * lanes, -1, dtype=np.int64)
+    for lane, t in enumerate(order):
+        length = len(targets[t])
+        blocks[lane, :length] = targets[t]
+        lo[lane, :length], hi[lane, :length] = bands[length]
+        last[lane] = length - 1
+    # Lanes of a block are interleaved along the last axis
+    costs = kernels.cross_cost(
+        np.ascontiguousarray(blocks.reshape(n_blocks, lanes, n, n_features).transpose(0, 2, 3, 1)), windows,
+        np.ascontiguousarray(lo.reshape(n_blocks, lanes, n).transpose(0, 2, 1)),
+        np.ascontiguousarray(hi.reshape(n_blocks, lanes, n).transpose(0, 2, 1)), last.reshape(n_blocks, lanes),
+        constraint is not None)
+    distances = np.empty((n_targets, n_windows))
+    distances[order] = np.sqrt(costs.reshape(n_blocks * lanes, n_windows)[:n_targets])
+    return distances
+
+
+def dtw(s1: np.ndarray, s2: np.ndarray, constraint: DtwConstraint | None = None, threshold: float = np.inf) -> float:
+    """Return the DTW distance between two series, a compiled replacement for tslearn.metrics.dtw.
+
+    Like tslearn, trailing NaN rows are ignored. Returns inf if the distance must exceed threshold.
+    """
+    s1, s2 = _as_features(s1), _as_features(s2)
+    s1, s2 = s1[:_series_length(s1)], s2[:_series_length(s2)]
+    return float(dtw_batch(s1, s2[None], threshold, constraint)[0])
+
+
+def _series_length(series: np.ndarray) -> int:
+    """Return the length of a (n, n_features) series without its trailing NaN rows"""
+    has_value = ~np.isnan(series).all(axis=1)
+    return len(series) - int(has_value[::-1].argmax()) if has_value.any() else 0
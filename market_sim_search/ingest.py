@@ -0,0 +1,111 @@
+from pathlib import Path
+
+import pandas as pd
+from loguru import logger
+
+from market_sim_search.config import EST
+from market_sim_search.data import clean_bars, load_bars, read_csv_chunks, resample
+from market_sim_search.store import append_frame, read_frame, read_meta, search_index, truncate_frame, write_frame
+from market_sim_search.windows import OHLCV
+
+BARS = 'bars'
+
+
+class ProcessedStore:
+    """OHLCV bars on disk that can be extended with new bars.
+
+    The store holds the cleaned bars as returned by load_csv, plus one resampled frame per frequency. Appending new
+    bars writes only the new rows, and resamples only the trailing buckets they touch. So a daily refresh costs time
+    proportional to the new data, not to the history.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        meta = read_meta(self.path / BARS)
+        if meta is None:
+            raise FileNotFoundError(f'No processed store at {self.path}')
+        self.tz = meta['store_tz']
+        self.dedupe = meta['dedupe']
+        self.freqs: list[str] = meta['freqs']
+
+    @classmethod
+    def create(cls, path: Path, bars: pd.DataFrame | Path, freqs: list[str], tz=EST,
+               dedupe: bool = True) -> 'ProcessedStore':
+        """Create a store from a zipped csv or DBN file, or from bars already cleaned by load_csv"""
+        path = Path(path)
+        if isinstance(bars, (str, Path)):
+            bars = load_bars(bars, tz, dedupe)
+        bars = bars[OHLCV]
+        write_frame(bars, path / BARS, store_tz=str(tz) if tz else None, dedupe=dedupe, freqs=list(freqs))
+        for freq in freqs:
+            write_frame(resample(bars, freq), path / freq)
+        logger.info(f'Created processed store {path} with {len(bars)} bars, resampled to {freqs}')
+        return cls(path)
+
+    @classmethod
+    def create_chunked(cls, path: Path, input_file: Path, freqs: list[str], tz=EST, dedupe: bool = True,
+                       chunk_size: int = 1_000_000, symbol: str | None = None) -> 'ProcessedStore':
+        """Create a store from a zipped csv too large to load at once, chunk_size rows at a time.
+
+        Only the OHLCV columns are read, as COMPACT_DTYPES, see read_csv_chunks. The first chunk creates the store and
+        each later one is appended, so dedupe, the session filter and resampling run on the fly, and peak memory is
+        bounded by the chunk size. The file must be sorted by time, as Databento files are, since appended bars at or
+        before the last stored bar are ignored.
+        """
+        store = None
+        for chunk in read_csv_chunks(input_file, chunk_size, symbol):
+            if store is not None:
+                store.append(chunk)
+                continue
+            bars = clean_bars(chunk, tz, dedupe)
+            if not bars.empty:
+                store = cls.create(path, bars, freqs, tz, dedupe)
+        if store is None:
+            raise ValueError(f'No bars in {input_file}')
+        return store
+
+    def bars(self) -> pd.DataFrame:
+        return read_frame(self.path / BARS)
+
+    def frame(self, freq: str) -> pd.DataFrame:
+        """Return the bars resampled to freq"""
+        if freq not in self.freqs:
+            raise KeyError(f'Frequency {freq} is not stored, expected one of {self.freqs}')
+        return read_frame(self.path / freq)
+
+    def append(self, new_bars: pd.DataFrame | Path) -> dict[str, int]:
+        """Append new bars from a zipped csv or DBN delta, or a DataFrame indexed by UTC timestamp.
+
+        Bars at or before the last stored bar are ignored. Returns the position of the first changed row of the bars
+        (key 'bars') and of each resampled frame, e.g. to pass to WindowIndex.update. Nothing is returned if there
+        were no new bars.
+        """
+        if isinstance(new_bars, (str, Path)):
+            new_bars = load_bars(new_bars, self.tz, self.dedupe)
+        else:
+            new_bars = clean_bars(new_bars.copy(), self.tz, self.dedupe)
+        new_bars = new_bars[OHLCV].sort_index()
+
+        bars_path = self.path / BARS
+        length = read_meta(bars_path)['length']
+        if length:
+            last = read_frame(bars_path, start=length - 1).index[-1]
+            skipped = int((new_bars.index <= last).sum())
+            if skipped:
+                logger.info(f'Ignoring {skipped} bars at or before the last stored bar {last}')
+                new_bars = new_bars[new_bars.index > last]
+        if new_bars.empty:
+            return {}
+
+        changed = {BARS: length}
+        append_frame(new_bars, bars_path)
+        for freq in self.freqs:
+            # Buckets from the one holding the first new bar on are resampled again from the stored bars
+            bucket_start = new_bars.index[0].floor(freq)
+            keep = search_index(self.path / freq, bucket_start)
+            truncate_frame(self.path / freq, keep)
+            tail = read_frame(bars_path, start=search_index(bars_path, bucket_start))
+            append_frame(resample(tail, freq), self.path / freq)
+            changed[freq] = keep
+        logger.info(f'Appended {len(new_bars)} bars to {self.path}')
+        return changed
@@ -0,0 +1,159 @@
+import os
+import threading
+import time as timer
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable
+
+from loguru import logger
+
+from market_sim_search.matches import SearchCancelled
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+@dataclass(eq=False)
+class SearchJob:
+    """A search running in the background of a JobRunner.
+
+    The search function reports through the job: it sets progress and provisional results, and should pass
+    cancelled as the should_cancel hook of its StrategyRunner. subscribers holds the callers, such as app sessions,
+    that submitted the job, so it is only cancelled once none of them wants it.
+    """
+    id: str
+    key: Hashable
+    submitted: float = field(default_factory=timer.time)
+    progress: float = 0.
+    provisional: Any = None
+    future: Future | None = field(default=None, repr=False)
+    subscribers: set[Hashable] = field(default_factory=set, repr=False)
+    _cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def state(self) -> str:
+        if self.future is None or not (self.future.running() or self.future.done()):
+            return CANCELLED if self._cancel_event.is_set() else PENDING
+        if not self.future.done():
+            return RUNNING
+        if self.future.cancelled() or isinstance(self.future.exception(), SearchCancelled):
+            return CANCELLED
+        return FAILED if self.future.exception() else DONE
+
+    @property
+    def done(self) -> bool:
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def cancelled(self) -> bool:
+        """The cancellation hook of the search, see StrategyRunner"""
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Ask the search to stop. A pending search never starts, a running one stops at its next check."""
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def result(self, timeout: float | None = None) -> Any:
+        """Return the result of the search, waiting for it if necessary. Raises if it failed or was cancelled."""
+        return self.future.result(timeout)
+
+    def error(self) -> BaseException | None:
+        return self.future.exception() if self.state == FAILED else None
+
+
+class JobRunner:
+    """Runs searches in background threads, so the caller can poll, cancel and reuse them by job id.
+
+    Jobs are keyed by their search parameters. Submitting a key that is pending, running or done returns the
+    existing job, so completed results are reused, and the submitter is added to its subscribers. Up to max_jobs
+    finished jobs are kept, least recently submitted first out. The DTW kernel releases the GIL, so searches don't
+    block the submitting thread, and up to max_workers of them run at once, by default one per core up to 4, so a
+    long search doesn't queue every other caller's.
+    """
+
+    def __init__(self, max_workers: int | None = None, max_jobs: int = 32):
+        max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='search')
+        self._jobs: OrderedDict[str, SearchJob] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, search: Callable[[SearchJob], Any],
+               subscriber: Hashable | None = None) -> SearchJob:
+        """Run search(job) in the background, unless a live or completed job with key exists.
+
+        subscriber, e.g. a session id, is added to the job's subscribers, see cancel.
+        """
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.key == key and job.state in (PENDING, RUNNING, DONE) and not job.cancelled():
+                    self._jobs.move_to_end(job.id)
+                    if subscriber is not None:
+                        job.subscribers.add(subscriber)
+                    logger.info(f'Reusing {job.state} job {job.id}')
+                    return job
+
+            job = SearchJob(uuid.uuid4().hex, key)
+            if subscriber is not None:
+                job.subscribers.add(subscriber)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job, search)
+            self._evict()
+        logger.info(f'Submitted job {job.id}')
+        return job
+
+    def get(self, job_id: str | None) -> SearchJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str | None, subscriber: Hashable | None = None):
+        """Cancel a job. Given a subscriber, unsubscribe it instead, and only cancel the job if no other holds it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return
+            if subscriber is not None:
+                job.subscribers.discard(subscriber)
+                if job.subscribers:
+                    logger.info(f'Keeping job {job_id}, held by {len(job.subscribers)} other subscribers')
+                    return
+            logger.info(f'Cancelling job {job_id}')
+            job.cancel()
+
+    def cancel_all(self, keep: str | None = None):
+        """Cancel every unfinished job except keep, e.g. searches superseded by a new one"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.id != keep and not job.done]
+        for job in jobs:
+            self.cancel(job.id)
+
+    def shutdown(self):
+        self.cancel_all()
+        self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _run(job: SearchJob, search: Callable[[SearchJob], Any]) -> Any:
+        if job.cancelled():
+            raise SearchCancelled('Search was cancelled before it started')
+        try:
+            result = search(job)
+        except SearchCancelled:
+            logger.info(f'Job {job.id} was cancelled')
+            raise
+        except Exception:
+            logger.exception(f'Job {job.id} failed')
+            raise
+        job.progress = 1.
+        return result
+
+    def _evict(self):
+        """Drop the oldest finished jobs past max_jobs"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
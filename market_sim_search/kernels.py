@@ -0,0 +1,112 @@
+"""The compiled DTW kernels of the dtw module.
+
+They are kept apart so importing numba, which takes about a second, is deferred until the first DTW is computed.
+"""
+import numpy as np
+from numba import njit
+
+# Targets aligned together by cross_cost, one float64 SIMD register on AVX-512
+LANES = 8
+
+
+@njit(cache=True, nogil=True)
+def accumulated_cost(target: np.ndarray, window: np.ndarray, lo: np.ndarray, hi: np.ndarray, limit: float) -> float:
+    """Return the accumulated squared cost of the DTW path between (n, f) and (m, f) arrays, or inf if abandoned.
+
+    Only cells lo[i] <= j <= hi[i] of each target row are visited. Once every visited cell of a row costs more than
+    limit the final cost can't come in under limit either, and inf is returned. The cost of a cell and the
+    accumulation follow tslearn, so both give the same result.
+    """
+    n, n_features = target.shape
+    m = window.shape[0]
+    # Rows of the accumulated cost matrix, offset by one column so column 0 is the boundary
+    prev = np.full(m + 1, np.inf)
+    cur = np.full(m + 1, np.inf)
+    prev[0] = 0.
+    prev_lo, prev_hi = 0, 0
+    cur_lo, cur_hi = 1, 0
+    for i in range(n):
+        # Reset only the cells written two rows ago, so a row costs the width of its band rather than m
+        for j in range(cur_lo, cur_hi + 1):
+            cur[j] = np.inf
+        row_min = np.inf
+        for j in range(lo[i], hi[i] + 1):
+            dist = 0.
+            for k in range(n_features):
+                diff = target[i, k] - window[j, k]
+                dist += diff * diff
+            cost = dist + min(prev[j + 1], cur[j], prev[j])
+            cur[j + 1] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return np.inf
+        prev, cur = cur, prev
+        prev_lo, prev_hi, cur_lo, cur_hi = lo[i] + 1, hi[i] + 1, prev_lo, prev_hi
+    return prev[m]
+
+
+@njit(cache=True, nogil=True)
+def batch_cost(target: np.ndarray, windows: np.ndarray, lo: np.ndarray, hi: np.ndarray,
+                limits: np.ndarray) -> np.ndarray:
+    """Run accumulated_cost against each (m, f) window of a (n_windows, m, f) batch"""
+    costs = np.empty(windows.shape[0])
+    for w in range(windows.shape[0]):
+        costs[w] = accumulated_cost(target, windows[w], lo, hi, limits[w])
+    return costs
+
+
+@njit(cache=True, nogil=True)
+def cross_cost(targets: np.ndarray, windows: np.ndarray, lo: np.ndarray, hi: np.ndarray, last: np.ndarray,
+                masked: bool) -> np.ndarray:
+    """Run accumulated_cost for each target of a (n_blocks, n, f, LANES) batch against each (m, f) window of a
+    (n_windows, m, f) batch. Returns (n_blocks, LANES, n_windows) costs.
+
+    The LANES targets of a block are aligned to a window together, their cells updated by the same instructions, so
+    the innermost loops run over the block and compile to SIMD. Targets of a block may differ in length: lo and hi
+    hold the band of each (n_blocks, n, LANES) row and lane, empty past its end, and last the row each lane ends on,
+    -1 for padding. Unless masked, every lane's band is the whole window, and cells past a lane's end are computed
+    but never read. Each cell is computed like accumulated_cost, so the costs are the same, but without abandoning.
+    """
+    n_blocks, n, n_features, _ = targets.shape
+    m = windows.shape[1]
+    costs = np.full((n_blocks, LANES, windows.shape[0]), np.inf)
+    prev = np.empty((m + 1, LANES))
+    cur = np.empty((m + 1, LANES))
+    dist = np.empty(LANES)
+    for b in range(n_blocks):
+        block, block_lo, block_hi = targets[b], lo[b], hi[b]
+        n_rows = last[b].max() + 1
+        for w in range(windows.shape[0]):
+            window = windows[w]
+            prev[:] = np.inf
+            cur[:] = np.inf
+            prev[0] = 0.
+            prev_lo, prev_hi = 0, 0
+            cur_lo, cur_hi = 1, 0
+            for i in range(n_rows):
+                for j in range(cur_lo, cur_hi + 1):
+                    cur[j] = np.inf
+                # Every cell of the union of the lanes' bands is visited, those outside a lane's own band are inf
+                row_lo, row_hi = block_lo[i].min(), block_hi[i].max()
+                for j in range(row_lo, row_hi + 1):
+                    for s in range(LANES):
+                        dist[s] = 0.
+                    for k in range(n_features):
+                        value = window[j, k]
+                        for s in range(LANES):
+                            diff = block[i, k, s] - value
+                            dist[s] += diff * diff
+                    if masked:
+                        for s in range(LANES):
+                            cost = dist[s] + min(min(prev[j + 1, s], cur[j, s]), prev[j, s])
+                            cur[j + 1, s] = cost if block_lo[i, s] <= j <= block_hi[i, s] else np.inf
+                    else:
+                        for s in range(LANES):
+                            cur[j + 1, s] = dist[s] + min(min(prev[j + 1, s], cur[j, s]), prev[j, s])
+                for s in range(LANES):
+                    if last[b, s] == i:
+                        costs[b, s, w] = cur[m, s]
+                prev, cur = cur, prev
+                prev_lo, prev_hi, cur_lo, cur_hi = row_lo + 1, row_hi + 1, prev_lo, prev_hi
+    return costs
@@ -1,21 +1,29 @@
+from dataclasses import dataclass, fields, replace
 from datetime import timedelta, time, datetime
-from typing import Callable
+from functools import partial
+from heapq import heappush, heapreplace
+from typing import Callable, Iterable, Iterator
 
 import pandas as pd
 import numpy as np
-from tslearn.metrics import dtw
 from loguru import logger
 
+from market_sim_search.bounds import (PruneStats, can_prune, combine_bounds, lb_keogh, lb_kim, prune_tolerance,
+                                      target_envelope)
 from market_sim_search.config import EST
+from market_sim_search.constraints import DtwConstraint
+from market_sim_search.dtw import dtw, dtw_batch, dtw_cross
 from market_sim_search.models import MatchModel
+from market_sim_search.profiling import NULL_PROFILER, Profiler
 from market_sim_search.types import ProgressReporter
+from market_sim_search.windows import WindowIndex, OPEN, HIGH, LOW, CLOSE, window_boundary_tolerance
 
-Strategy = Callable[[pd.DataFrame, pd.DataFrame], float]
-window_boundary_tolerance = timedelta(minutes=5)
+# A strategy scores a candidate window against the target window. Both are (n_bars, 5) OHLCV arrays.
+Strategy = Callable[[np.ndarray, np.ndarray], float]
 
 
-def hlc4(data: pd.DataFrame):
-    return (data.high + data.low + data.close + data.close) / 4
+def hlc4(data: np.ndarray):
+    return (data[..., HIGH] + data[..., LOW] + data[..., CLOSE] + data[..., CLOSE]) / 4
 
 
 # def normalize_window(data: pd.DataFrame, feature: pd.Series):
@@ -24,37 +32,135 @@ def hlc4(data: pd.DataFrame):
 #       norm = norm * 100/data.low.min()
 #     return norm
 
-def normalize_window(feature: pd.Series, base: float):
+def normalize_window(feature: pd.Series | np.ndarray, base: float):
     """Normalize data as percent change from base"""
     return (feature - base) / base
 
 
-def dtw_hlc4(target: pd.DataFrame, window: pd.DataFrame):
+# Features that can be scored by the multi feature search, extracted from (..., n_bars, 5) arrays.
+FEATURES: dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'open': lambda bars: bars[..., OPEN],
+    'high': lambda bars: bars[..., HIGH],
+    'low': lambda bars: bars[..., LOW],
+    'close': lambda bars: bars[..., CLOSE],
+    'hlc4': hlc4,
+}
+
+# Candidates scored per dtw_batch call by exhaustive searches. Progress is reported after each batch.
+score_batch_size = 256
+
+# Feature weights of find_similar_dtw_high_low_close_4
+HIGH_LOW_CLOSE_4_WEIGHTS = {'high': 1, 'low': 1, 'close': 2}
+
+# Feature weights of the find_similar_* methods that run on find_similar_features, by strategy name
+STRATEGY_WEIGHTS = {
+    'dtw_hlc4': {'hlc4': 1},
+    'dtw_high_low_2': {'high': 1, 'low': 1},
+    'dtw_high_low_close_4': HIGH_LOW_CLOSE_4_WEIGHTS,
+}
+
+
+def normalize_features(bars: np.ndarray, base: float | np.ndarray, features: list[str]) -> np.ndarray:
+    """Stack the named features of bars into the last axis, each normalized as percent change from base.
+
+    bars may be a single (n_bars, 5) window with a scalar base, or a (n_windows, n_bars, 5) tensor with one base per
+    window.
+    """
+    base = np.asarray(base)[..., None]
+    return np.stack([normalize_window(FEATURES[feature](bars), base) for feature in features], axis=-1)
+
+
+def dtw_features(norm_target: np.ndarray, norm_window: np.ndarray, weights: np.ndarray,
+                 multivariate: bool = False, constraint: DtwConstraint | None = None) -> float:
+    """Run DTW on normalized (n_bars, n_features) arrays.
+
+    By default DTW runs separately on each feature and the weighted average distance is returned. If multivariate,
+    a single DTW runs over all features, with each feature scaled so it contributes in proportion to its weight.
+    An optional constraint restricts the warping path.
+    """
+    return float(dtw_features_batch(norm_target, norm_window[None], weights, multivariate, constraint)[0])
+
+
+def dtw_features_batch(norm_target: np.ndarray, norm_windows: np.ndarray, weights: np.ndarray,
+                       multivariate: bool = False, constraint: DtwConstraint | None = None) -> np.ndarray:
+    """Run dtw_features against each window of an equal length (n_windows, n_bars, n_features) batch"""
+    if multivariate:
+        scale = np.sqrt(weights / weights.sum())
+        return dtw_batch(norm_target * scale, norm_windows * scale, constraint=constraint)
+    scores = np.zeros(len(norm_windows))
+    for k, weight in enumerate(weights):
+        scores += weight * dtw_batch(norm_target[:, k], norm_windows[..., k], constraint=constraint)
+    return scores / weights.sum()
+
+
+def dtw_features_cross(norm_targets: list[np.ndarray], norm_windows: np.ndarray, weights: np.ndarray,
+                       multivariate: bool = False, constraint: DtwConstraint | None = None) -> np.ndarray:
+    """Run dtw_features for each (n_bars, n_features) target, of any length, against each window of an equal length
+    batch. Returns (n_targets, n_windows) scores."""
+    if multivariate:
+        scale = np.sqrt(weights / weights.sum())
+        return dtw_cross([norm_target * scale for norm_target in norm_targets], norm_windows * scale, constraint)
+    scores = np.zeros((len(norm_targets), len(norm_windows)))
+    for k, weight in enumerate(weights):
+        scores += weight * dtw_cross([norm_target[:, k] for norm_target in norm_targets], norm_windows[..., k],
+                                     constraint)
+    return scores / weights.sum()
+
+
+def dtw_features_abandoning(norm_target: np.ndarray, norm_window: np.ndarray, weights: np.ndarray,
+                            feature_bounds: np.ndarray, threshold: float, multivariate: bool = False,
+                            constraint: DtwConstraint | None = None) -> float | None:
+    """Run dtw_features, but return None as soon as the score can't come in under threshold.
+
+    feature_bounds holds a lower bound of each feature's weighted contribution to the score. After each feature's
+    DTW, the exact distances so far plus the bounds of the remaining features bound the final score. Each DTW is
+    also abandoned by the kernel as soon as its partial distance pushes that bound over threshold.
+    """
+    # Largest score that can't be pruned, see can_prune
+    limit = threshold / (1 - prune_tolerance)
+    if multivariate:
+        scale = np.sqrt(weights / weights.sum())
+        score = dtw(norm_target * scale, norm_window * scale, constraint, limit)
+        return None if np.isinf(score) else score
+    total_weight = weights.sum()
+    remaining = feature_bounds.sum()
+    score = 0.
+    for k, weight in enumerate(weights):
+        remaining -= feature_bounds[k]
+        distance = dtw(norm_target[:, k], norm_window[:, k], constraint,
+                       ((limit - remaining) * total_weight - score) / weight)
+        if np.isinf(distance):
+            return None
+        score += weight * distance
+    return float(score / total_weight)
+
+
+def dtw_hlc4(target: np.ndarray, window: np.ndarray, constraint: DtwConstraint | None = None):
     """Run DTW using hlc4"""
-    norm_target = normalize_window(hlc4(target), target.close.iloc[-1])
-    norm_window = normalize_window(hlc4(window), window.close.iloc[-1])
-    return dtw(norm_target, norm_window)
+    norm_target = normalize_window(hlc4(target), target[-1, CLOSE])
+    norm_window = normalize_window(hlc4(window), window[-1, CLOSE])
+    return dtw(norm_target, norm_window, constraint)
 
 
-def dtw_close(target: pd.DataFrame, window: pd.DataFrame):
+def dtw_close(target: np.ndarray, window: np.ndarray, constraint: DtwConstraint | None = None):
     """Run DTW using close price"""
-    norm_target = normalize_window(target.close, target.close.iloc[-1])
-    norm_window = normalize_window(window.close, window.close.iloc[-1])
-    return dtw(norm_target, norm_window)
+    norm_target = normalize_window(target[:, CLOSE], target[-1, CLOSE])
+    norm_window = normalize_window(window[:, CLOSE], window[-1, CLOSE])
+    return dtw(norm_target, norm_window, constraint)
 
 
-def dtw_high(target: pd.DataFrame, window: pd.DataFrame):
+def dtw_high(target: np.ndarray, window: np.ndarray, constraint: DtwConstraint | None = None):
     """Run DTW using high price"""
-    norm_target = normalize_window(target.high, target.close.iloc[-1])
-    norm_window = normalize_window(window.high, window.close.iloc[-1])
-    return dtw(norm_target, norm_window)
+    norm_target = normalize_window(target[:, HIGH], target[-1, CLOSE])
+    norm_window = normalize_window(window[:, HIGH], window[-1, CLOSE])
+    return dtw(norm_target, norm_window, constraint)
 
 
-def dtw_low(target: pd.DataFrame, window: pd.DataFrame):
+def dtw_low(target: np.ndarray, window: np.ndarray, constraint: DtwConstraint | None = None):
     """Run DTW using low price"""
-    norm_target = normalize_window(target.low, target.close.iloc[-1])
-    norm_window = normalize_window(window.low, window.close.iloc[-1])
-    return dtw(norm_target, norm_window)
+    norm_target = normalize_window(target[:, LOW], target[-1, CLOSE])
+    norm_window = normalize_window(window[:, LOW], window[-1, CLOSE])
+    return dtw(norm_target, norm_window, constraint)
 
 
 def get_window(data: pd.DataFrame, window_start_time: time, window_size_days: int,
@@ -92,34 +198,641 @@ def least_distance(matches: list[MatchModel], top: int = 0):
         return sorted(matches, key=lambda match: match.score)[:top]
 
 
+@dataclass
+class ScoredCandidates:
+    """Scores of candidates of a WindowIndex.
+
+    candidates are positions in the index. They are in index order for an exhaustive search, or ranked for a
+    pruned top N search.
+    """
+    candidates: np.ndarray
+    scores: np.ndarray
+    failures: int
+    prune_stats: PruneStats | None = None
+
+
+class TopN:
+    """The top items with the lowest scores, held in a heap of at most top entries.
+
+    Ties on score are broken by a numeric order key, lowest first.
+    """
+
+    def __init__(self, top: int):
+        if top < 1:
+            raise ValueError(f'top must be at least 1, got {top}')
+        self.top = top
+        # Max heap of (score, order, item), stored with score and order negated
+        self._heap: list[tuple[float, int, object]] = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def threshold(self) -> float:
+        """The score an item must beat to enter a full top, or inf until it is full"""
+        return -self._heap[0][0] if len(self._heap) == self.top else np.inf
+
+    def push(self, score: float, order: int, item=None) -> bool:
+        """Offer an item, and return True if it entered the top"""
+        if len(self._heap) < self.top:
+            heappush(self._heap, (-score, -order, item))
+            return True
+        if (score, order) < (-self._heap[0][0], -self._heap[0][1]):
+            heapreplace(self._heap, (-score, -order, item))
+            return True
+        return False
+
+    def ranked(self) -> list[tuple[float, int, object]]:
+        """Return the (score, order, item) entries, best first"""
+        return sorted((-score, -order, item) for score, order, item in self._heap)
+
+    def items(self) -> list:
+        return [item for _, _, item in self.ranked()]
+
+
+def iter_strategy_scores(window_index: WindowIndex, target_window: np.ndarray, strategy: Strategy,
+                         on_candidate: Callable[[], None] | None = None,
+                         profiler: Profiler = NULL_PROFILER) -> Iterator[tuple[int, float | None]]:
+    """Yield (candidate, score) for each candidate of window_index in index order, scored against target_window with
+    strategy. The score is None if the candidate couldn't be scored.
+
+    on_candidate is called before each candidate, to report progress. Each strategy call is timed as the dtw stage.
+    """
+    for i in range(len(window_index)):
+        if on_candidate:
+            on_candidate()
+
+        if not window_index.valid[i]:
+            logger.warning(f"Can't load window ending at {window_index.index[window_index.ends[i]]}.")
+            yield i, None
+            continue
+        try:
+            with profiler.stage('dtw'):
+                score = strategy(target_window, window_index.window(i))
+        except Exception as e:
+            logger.exception(f'Error calculating score')
+            yield i, None
+            continue
+        yield i, score
+
+
+def iter_feature_scores(window_index: WindowIndex, norm_target: np.ndarray, norm_windows: np.ndarray,
+                        weights: np.ndarray, multivariate: bool = False, constraint: DtwConstraint | None = None,
+                        on_candidate: Callable[[], None] | None = None,
+                        profiler: Profiler = NULL_PROFILER) -> Iterator[tuple[int, float | None]]:
+    """Yield (candidate, score) for each candidate of window_index in index order, scored with dtw_features. The
+    score is None if the candidate couldn't be scored.
+
+    norm_windows are the normalized features of the window tensor, see normalize_features. Candidates are scored
+    score_batch_size at a time, and yielded once their batch is done. on_candidate is called for each candidate, to
+    report progress. Each dtw_batch call is timed as the dtw stage.
+    """
+    lengths = window_index.lengths
+    valid = window_index.valid
+    for start in range(0, len(window_index), score_batch_size):
+        batch = np.arange(start, min(start + score_batch_size, len(window_index)))
+        scores = np.full(len(batch), np.nan)
+        scored = np.zeros(len(batch), dtype=bool)
+        for i in batch[~valid[batch]]:
+            logger.warning(f"Can't load window ending at {window_index.index[window_index.ends[i]]}.")
+        # Windows of one length are scored by a single dtw_batch call
+        for length in np.unique(lengths[batch[valid[batch]]]):
+            group = batch[valid[batch] & (lengths[batch] == length)]
+            try:
+                with profiler.stage('dtw'):
+                    scores[group - start] = dtw_features_batch(norm_target, norm_windows[group, :length], weights,
+                                                               multivariate, constraint)
+            except Exception as e:
+                logger.exception(f'Error calculating score')
+                continue
+            scored[group - start] = True
+
+        for i in range(len(batch)):
+            if on_candidate:
+                on_candidate()
+            yield start + i, scores[i] if scored[i] else None
+
+
+def iter_feature_scores_pruned(window_index: WindowIndex, norm_target: np.ndarray, norm_windows: np.ndarray,
+                               weights: np.ndarray, best: TopN, stats: PruneStats, multivariate: bool = False,
+                               constraint: DtwConstraint | None = None,
+                               on_candidate: Callable[[], None] | None = None,
+                               profiler: Profiler = NULL_PROFILER) -> Iterator[tuple[int, float | None]]:
+    """Yield (candidate, score) for each candidate that can make the top by dtw_features, skipping full DTW for
+    candidates whose lower bound exceeds the current top'th score. The score is None if the candidate couldn't be
+    scored.
+
+    Candidates are visited in order of their LB_Keogh bound so the threshold tightens quickly. Each is checked
+    against LB_Kim, then LB_Keogh, then scored with per-feature early abandoning. Scored candidates are pushed to
+    best, ordered by candidate, and where each candidate was resolved is counted in stats.
+    """
+    lengths = window_index.lengths
+    with profiler.stage('lower_bounds'):
+        kim = lb_kim(norm_target, norm_windows, lengths)
+        keogh = np.maximum(kim, lb_keogh(*target_envelope(norm_target, lengths, constraint), norm_windows))
+        kim_bounds = combine_bounds(kim, weights, multivariate)
+        keogh_bounds = combine_bounds(keogh, weights, multivariate)
+        feature_bounds = np.sqrt(keogh) * weights / weights.sum()
+
+    for i in np.argsort(keogh_bounds, kind='stable'):
+        if on_candidate:
+            on_candidate()
+
+        if not window_index.valid[i]:
+            logger.warning(f"Can't load window ending at {window_index.index[window_index.ends[i]]}.")
+            yield int(i), None
+            continue
+        if can_prune(kim_bounds[i], best.threshold):
+            stats.pruned_kim += 1
+            continue
+        if can_prune(keogh_bounds[i], best.threshold):
+            stats.pruned_keogh += 1
+            continue
+        try:
+            with profiler.stage('dtw'):
+                score = dtw_features_abandoning(norm_target, norm_windows[i, :lengths[i]], weights,
+                                                feature_bounds[i], best.threshold, multivariate, constraint)
+        except Exception as e:
+            logger.exception(f'Error calculating score')
+            yield int(i), None
+            continue
+        if score is None:
+            stats.abandoned += 1
+            continue
+
+        stats.full_dtw += 1
+        best.push(score, int(i), int(i))
+        yield int(i), score
+
+
+def _collect_scores(n_candidates: int, scores: Iterator[tuple[int, float | None]]) -> ScoredCandidates:
+    """Collect the yielded scores of an exhaustive search in index order"""
+    values = np.full(n_candidates, np.nan)
+    scored = np.zeros(n_candidates, dtype=bool)
+    for i, score in scores:
+        if score is not None:
+            values[i] = score
+            scored[i] = True
+    return ScoredCandidates(np.flatnonzero(scored), values[scored], int((~scored).sum()))
+
+
+def score_strategy(window_index: WindowIndex, target_window: np.ndarray, strategy: Strategy,
+                   on_candidate: Callable[[], None] | None = None,
+                   profiler: Profiler = NULL_PROFILER) -> ScoredCandidates:
+    """Score every candidate of window_index against target_window with strategy, see iter_strategy_scores"""
+    return _collect_scores(len(window_index), iter_strategy_scores(window_index, target_window, strategy,
+                                                                   on_candidate, profiler))
+
+
+def score_features(window_index: WindowIndex, norm_target: np.ndarray, norm_windows: np.ndarray, weights: np.ndarray,
+                   multivariate: bool = False, constraint: DtwConstraint | None = None,
+                   on_candidate: Callable[[], None] | None = None,
+                   profiler: Profiler = NULL_PROFILER) -> ScoredCandidates:
+    """Score every candidate of window_index with dtw_features, see iter_feature_scores"""
+    return _collect_scores(len(window_index), iter_feature_scores(window_index, norm_target, norm_windows, weights,
+                                                                  multivariate, constraint, on_candidate, profiler))
+
+
+def score_features_cross(window_index: WindowIndex, norm_targets: list[np.ndarray], norm_windows: np.ndarray,
+                         weights: np.ndarray, multivariate: bool = False, constraint: DtwConstraint | None = None,
+                         on_candidates: Callable[[int], None] | None = None,
+                         profiler: Profiler = NULL_PROFILER) -> list[ScoredCandidates]:
+    """Score every candidate of window_index against each of several normalized targets, like score_features.
+
+    Every target is scored against the windows of one length by a single dtw_features_cross call, which aligns
+    several targets to a window at once. on_candidates is called with the number of (target, candidate) pairs after
+    each call, to report progress. Returns the ScoredCandidates of each target.
+    """
+    lengths = window_index.lengths
+    valid = window_index.valid
+    scores = np.full((len(norm_targets), len(window_index)), np.nan)
+    scored = np.zeros(scores.shape, dtype=bool)
+    for i in np.flatnonzero(~valid):
+        logger.warning(f"Can't load window ending at {window_index.index[window_index.ends[i]]}.")
+    for length in np.unique(lengths[valid]):
+        group = np.flatnonzero(valid & (lengths == length))
+        try:
+            with profiler.stage('dtw'):
+                scores[:, group] = dtw_features_cross(norm_targets, norm_windows[group, :length], weights,
+                                                      multivariate, constraint)
+            scored[:, group] = True
+        except Exception:
+            logger.exception(f'Error calculating score')
+        if on_candidates:
+            on_candidates(len(norm_targets) * len(group))
+    return [ScoredCandidates(np.flatnonzero(scored[t]), scores[t, scored[t]], int((~scored[t]).sum()))
+            for t in range(len(norm_targets))]
+
+
+def score_features_pruned(window_index: WindowIndex, norm_target: np.ndarray, norm_windows: np.ndarray,
+                          weights: np.ndarray, top: int, multivariate: bool = False,
+                          constraint: DtwConstraint | None = None,
+                          on_candidate: Callable[[], None] | None = None,
+                          profiler: Profiler = NULL_PROFILER) -> ScoredCandidates:
+    """Find the top candidates by dtw_features, pruning candidates that can't make the top, see
+    iter_feature_scores_pruned.
+
+    Ties are broken by candidate order, like the stable sort in least_distance, so the result is identical to an
+    exhaustive search.
+    """
+    best = TopN(top)
+    stats = PruneStats(candidates=len(window_index))
+    fail = 0
+    for _, score in iter_feature_scores_pruned(window_index, norm_target, norm_windows, weights, best, stats,
+                                               multivariate, constraint, on_candidate, profiler):
+        fail += score is None
+    ranked = best.ranked()
+    return ScoredCandidates(np.array([i for _, i, _ in ranked], dtype=np.int64),
+                            np.array([score for score, _, _ in ranked]), fail, stats)
+
+
+@dataclass
+class StrategyTask:
+    """Scores candidates with a strategy. The strategy must be picklable to run in a worker process."""
+    strategy: Strategy
+
+    def __call__(self, window_index: WindowIndex, target_window: np.ndarray,
+                 on_candidate: Callable[[], None] | None = None,
+                 profiler: Profiler = NULL_PROFILER) -> ScoredCandidates:
+        return _collect_scores(len(window_index), self.iter_scores(window_index, target_window, on_candidate,
+                                                                   profiler))
+
+    def iter_scores(self, window_index: WindowIndex, target_window: np.ndarray,
+                    on_candidate: Callable[[], None] | None = None, profiler: Profiler = NULL_PROFILER,
+                    prune_stats: PruneStats | None = None) -> Iterator[tuple[int, float | None]]:
+        """Yield (candidate, score) as candidates are scored, see iter_strategy_scores"""
+        with profiler.stage('window_extraction'):
+            window_index.windows
+        return iter_strategy_scores(window_index, target_window, self.strategy, on_candidate, profiler)
+
+
+@dataclass
+class FeatureTask:
+    """Scores candidates with dtw_features, optionally pruned to the top candidates.
+
+    norm_windows may hold the normalized features of the whole window tensor, precomputed with normalize_features.
+    """
+    weights: dict[str, float]
+    multivariate: bool = False
+    constraint: DtwConstraint | None = None
+    top: int | None = None
+    prune: bool = False
+    norm_windows: np.ndarray | None = None
+
+    @property
+    def pruned(self) -> bool:
+        return self.prune and bool(self.top)
+
+    def __call__(self, window_index: WindowIndex, target_window: np.ndarray,
+                 on_candidate: Callable[[], None] | None = None,
+                 profiler: Profiler = NULL_PROFILER) -> ScoredCandidates:
+        norm_target, norm_windows, weights = self._normalize(window_index, target_window, profiler)
+        if self.pruned:
+            return score_features_pruned(window_index, norm_target, norm_windows, weights, self.top,
+                                         self.multivariate, self.constraint, on_candidate, profiler)
+        return score_features(window_index, norm_target, norm_windows, weights, self.multivariate, self.constraint,
+                              on_candidate, profiler)
+
+    def score_targets(self, window_index: WindowIndex, target_windows: list[np.ndarray],
+                      on_candidates: Callable[[int], None] | None = None,
+                      profiler: Profiler = NULL_PROFILER) -> list[ScoredCandidates]:
+        """Score every candidate against each of several target windows in one pass, see score_features_cross.
+        Searches of many targets aren't pruned."""
+        normalized = [self._normalize(window_index, target_window, profiler) for target_window in target_windows]
+        if not normalized:
+            return []
+        _, norm_windows, weights = normalized[0]
+        return score_features_cross(window_index, [norm_target for norm_target, _, _ in normalized], norm_windows,
+                                    weights, self.multivariate, self.constraint, on_candidates, profiler)
+
+    def iter_scores(self, window_index: WindowIndex, target_window: np.ndarray,
+                    on_candidate: Callable[[], None] | None = None, profiler: Profiler = NULL_PROFILER,
+                    prune_stats: PruneStats | None = None) -> Iterator[tuple[int, float | None]]:
+        """Yield (candidate, score) as candidates are scored, see iter_feature_scores and iter_feature_scores_pruned.
+
+        A pruned search only yields the candidates it scored, and counts the rest in prune_stats.
+        """
+        norm_target, norm_windows, weights = self._normalize(window_index, target_window, profiler)
+        if self.pruned:
+            stats = prune_stats if prune_stats is not None else PruneStats(candidates=len(window_index))
+            return iter_feature_scores_pruned(window_index, norm_target, norm_windows, weights, TopN(self.top),
+                                              stats, self.multivariate, self.constraint, on_candidate, profiler)
+        return iter_feature_scores(window_index, norm_target, norm_windows, weights, self.multivariate,
+                                   self.constraint, on_candidate, profiler)
+
+    def _normalize(self, window_index: WindowIndex, target_window: np.ndarray,
+                   profiler: Profiler) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the normalized target and windows, and the weights as an array in feature order"""
+        features = list(self.weights)
+        weights = np.array([self.weights[feature] for feature in features], dtype=np.float64)
+        if (weights <= 0).any():
+            raise ValueError(f'Feature weights must be positive, got {self.weights}')
+        norm_windows = self.norm_windows
+        if norm_windows is None:
+            with profiler.stage('window_extraction'):
+                window_index.windows
+        with profiler.stage('normalization'):
+            norm_target = normalize_features(target_window, target_window[-1, CLOSE], features)
+            if norm_windows is None:
+                norm_windows = normalize_features(window_index.windows,
+                                                  window_index.values[window_index.ends, CLOSE], features)
+        return norm_target, norm_windows, weights
+
+
+def stream_top(matches: Iterable[MatchModel], top: int, every: int = 1) -> Iterator[list[MatchModel]]:
+    """Yield the provisional top matches of a stream of scored matches whenever they change, then the final top.
+
+    Only the top matches are held, so memory doesn't grow with the stream. Changes are checked after every every
+    matches. Ties are broken by the match end, like least_distance on matches in index order.
+    """
+    best = TopN(top)
+    changed = False
+    for n, match in enumerate(matches, 1):
+        changed |= best.push(match.score, match.end.value, match)
+        if changed and n % every == 0:
+            changed = False
+            yield best.items()
+    yield best.items()
+
+
+def merge_scored(shards: list[tuple[np.ndarray, ScoredCandidates]], top: int | None = None,
+                 ranked: bool = False) -> ScoredCandidates:
+    """Merge the results of disjoint shards of a WindowIndex, given with the index positions of each shard.
+
+    Exhaustive results stay in index order. Ranked results are re-ranked and cut to the top.
+    """
+    candidates = np.concatenate([shard[result.candidates] for shard, result in shards]).astype(np.int64)
+    scores = np.concatenate([result.scores for _, result in shards])
+    failures = sum(result.failures for _, result in shards)
+    stats = None
+    if ranked:
+        stats = PruneStats()
+        for _, result in shards:
+            for field in fields(PruneStats):
+                setattr(stats, field.name, getattr(stats, field.name) + getattr(result.prune_stats, field.name))
+        order = np.lexsort((candidates, scores))[:top]
+        candidates, scores = candidates[order], scores[order]
+    return ScoredCandidates(candidates, scores, failures, stats)
+
+
+class SearchCancelled(Exception):
+    """Raised by a StrategyRunner when its should_cancel hook asks it to stop"""
+
+
 class StrategyRunner:
-    def __init__(self, progress_reporter: ProgressReporter | None = None):
+    def __init__(self, progress_reporter: ProgressReporter | None = None, n_jobs: int = 1,
+                 profiler: Profiler | None = None, should_cancel: Callable[[], bool] | None = None):
+        """Run similarity searches.
+
+        With n_jobs > 1 the candidates of each search are split across a pool of worker processes, see
+        parallel.run_sharded. Strategies must then be picklable, e.g. module level functions or partials of them.
+
+        Pass a Profiler to time each stage of the searches, see profiling.STAGES, and count candidates. Its results
+        can be exported with to_dict, to_json or to_prometheus. In worker processes only the whole shard run is
+        timed, as the dtw stage.
+
+        should_cancel is polled before each candidate, or after each shard with n_jobs > 1. Once it returns True the
+        search stops and raises SearchCancelled.
+        """
         self.progress_reporter = progress_reporter
         self.progress_count = 0
         self.max_progress_count = np.nan
         self.outer_loop_count = 0
         self.max_outer_loop_count = np.nan
+        self.n_jobs = n_jobs
+        self.prune_stats: PruneStats | None = None
+        self.worker_failures: dict[int, int] = {}
+        self.profiler = profiler or NULL_PROFILER
+        self.should_cancel = should_cancel
 
     def find_similar_windows(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
                              target_end: datetime,
-                             strategy: Strategy) -> list[MatchModel]:
+                             strategy: Strategy, window_index: WindowIndex | None = None) -> list[MatchModel]:
         """Find similar windows to the last using the provided strategy.
 
         Each window is size window_size_days and begins at the same time of day.
         Using the window ending at target_end, find all similar windows occurring before.
+        The candidate windows are read from window_index, which is built from data if it isn't provided.
         """
-        target_window: pd.DataFrame = get_window(data, window_time_start, window_size_days, target_end)
-        if target_window is None:
-            raise Exception('Can''t load target window')
-
-        logger.info(f'Using target window {target_window.index[0]}-{target_window.index[-1]}')
-        logger.info(f'Searching for windows of length {window_size_days} days ending at time {target_end.time()}')
-        idxs = data.index.indexer_at_time(target_end.time())
-
-        matches = []
-        success = 0
-        fail = 0
-        num_indices = len(idxs)
+        if window_index is None:
+            window_index = self._build_window_index(data, window_time_start, window_size_days, target_end)
+        result = self._run(window_index, target_end, StrategyTask(strategy))
+        return self._to_matches(window_index, result)
+
+    def find_similar_features(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
+                              target_end: datetime, weights: dict[str, float], multivariate: bool = False,
+                              top: int = None, window_index: WindowIndex | None = None, prune: bool = False,
+                              constraint: DtwConstraint | None = None,
+                              norm_windows: np.ndarray | None = None) -> list[MatchModel]:
+        """Find similar windows using DTW on several features in one pass.
+
+        weights maps feature names from FEATURES to their weight. Every window is normalized once for all features,
+        then scored with dtw_features, so the match score is the combined score.
+        If prune and top are set, candidates that can't make the top are skipped using lower bounds, see
+        score_features_pruned. The result is the same as without pruning.
+        An optional constraint restricts the DTW warping path, trading accuracy for speed.
+        norm_windows may hold the normalize_features of window_index.windows for the features of weights, as cached
+        by a SearchIndex.
+        """
+        if window_index is None:
+            window_index = self._build_window_index(data, window_time_start, window_size_days, target_end)
+        task = FeatureTask(weights, multivariate, constraint, top, prune, norm_windows)
+        result = self._run(window_index, target_end, task)
+        return self._rank(window_index, result, top)
+
+    def find_similar_to(self, window_index: WindowIndex, target_window: np.ndarray, weights: dict[str, float],
+                        multivariate: bool = False, top: int = None, prune: bool = False,
+                        constraint: DtwConstraint | None = None,
+                        norm_windows: np.ndarray | None = None) -> list[MatchModel]:
+        """Find the candidates of window_index most similar to target_window, like find_similar_features.
+
+        target_window holds the (n_bars, 5) OHLCV bars of the target, which needn't come from the data of
+        window_index, e.g. the window of another symbol. The search runs in this process, regardless of n_jobs.
+        """
+        self._init_progress(len(window_index))
+        self.profiler.count('searches')
+        self.profiler.count('candidates', len(window_index))
+        task = FeatureTask(weights, multivariate, constraint, top, prune, norm_windows)
+        result = task(window_index, target_window, self._report_progress, self.profiler)
+        self._count_result(result)
+        return self._rank(window_index, result, top)
+
+    def find_similar_batch(self, data: pd.DataFrame, window_time_start: time, queries: list[tuple[datetime, int]],
+                           weights: dict[str, float], multivariate: bool = False, top: int = None,
+                           prune: bool = False, constraint: DtwConstraint | None = None) -> list[list[MatchModel]]:
+        """Run find_similar_features for many (target_end, window_size_days) queries, sharing their candidate scans.
+
+        Queries with the same window size and target time of day search the same candidate windows. Each such group
+        is indexed and normalized once. Without pruning every target of a group is scored in the same pass over the
+        candidates, see FeatureTask.score_targets. With prune and top each target runs a pruned search of the shared
+        windows. Returns the matches of each query, in query order, as find_similar_features ranks them. The search
+        runs in this process, regardless of n_jobs.
+        """
+        groups: dict[tuple[time, int], list[int]] = {}
+        for n, (target_end, window_size_days) in enumerate(queries):
+            groups.setdefault((target_end.time(), window_size_days), []).append(n)
+        logger.info(f'Searching {len(queries)} targets in {len(groups)} groups of shared candidates')
+
+        scans = []
+        with self.profiler.stage('window_extraction'):
+            for (end_time, window_size_days), members in groups.items():
+                window_index = WindowIndex.build(data, window_time_start, window_size_days, end_time)
+                target_windows = [window_index.bars(*self._load_target(window_index, queries[n][0]))
+                                  for n in members]
+                window_index.windows
+                scans.append((members, window_index, target_windows))
+        self._init_progress(sum(len(window_index) * len(members) for members, window_index, _ in scans))
+
+        results: list[list[MatchModel] | None] = [None] * len(queries)
+        for members, window_index, target_windows in scans:
+            self.profiler.count('searches', len(members))
+            self.profiler.count('candidates', len(window_index) * len(members))
+            with self.profiler.stage('normalization'):
+                norm_windows = normalize_features(window_index.windows, window_index.values[window_index.ends, CLOSE],
+                                                  list(weights))
+            task = FeatureTask(weights, multivariate, constraint, top, prune, norm_windows)
+            if task.pruned:
+                scored = [task(window_index, target_window, self._report_progress, self.profiler)
+                          for target_window in target_windows]
+            else:
+                scored = task.score_targets(window_index, target_windows, self._advance_progress, self.profiler)
+            for n, result in zip(members, scored):
+                self._count_result(result)
+                results[n] = self._rank(window_index, result, top)
+        return results
+
+    def _rank(self, window_index: WindowIndex, result: ScoredCandidates, top: int | None) -> list[MatchModel]:
+        """Return the top matches of a FeatureTask result. Pruned results are already ranked."""
+        if result.prune_stats:
+            stats = result.prune_stats
+            self.prune_stats = stats
+            logger.info(f'Pruned {stats.pruned_kim} candidates with LB_Kim, {stats.pruned_keogh} with LB_Keogh and '
+                        f'abandoned {stats.abandoned}. Ran full DTW on {stats.full_dtw} of {stats.candidates}.')
+            for name in ['pruned_kim', 'pruned_keogh', 'abandoned']:
+                self.profiler.count(name, getattr(stats, name))
+            return self._to_matches(window_index, result)
+        matches = self._to_matches(window_index, result)
+        with self.profiler.stage('ranking'):
+            return least_distance(matches, top)
+
+    def iter_similar_windows(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
+                             target_end: datetime, strategy: Strategy,
+                             window_index: WindowIndex | None = None) -> Iterator[MatchModel]:
+        """Yield a match for each candidate as it is scored with strategy, in index order.
+
+        This is the streaming form of find_similar_windows. Candidates that can't be scored are skipped. Feed the
+        matches to stream_top to follow the top matches in bounded memory. The search runs in this process,
+        regardless of n_jobs.
+        """
+        if window_index is None:
+            window_index = self._build_window_index(data, window_time_start, window_size_days, target_end)
+        return self._iter_matches(window_index, target_end, StrategyTask(strategy))
+
+    def iter_similar_features(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
+                              target_end: datetime, weights: dict[str, float], multivariate: bool = False,
+                              top: int = None, window_index: WindowIndex | None = None, prune: bool = False,
+                              constraint: DtwConstraint | None = None,
+                              norm_windows: np.ndarray | None = None) -> Iterator[MatchModel]:
+        """Yield a match for each candidate as it is scored, the streaming form of find_similar_features.
+
+        Without pruning, every candidate that can be scored is yielded in index order. With prune and top,
+        candidates are visited in lower bound order and only those that were fully scored are yielded, while
+        prune_stats counts the rest as the search runs. Either way stream_top of the matches ends with the top of
+        find_similar_features. The search runs in this process, regardless of n_jobs.
+        """
+        if window_index is None:
+            window_index = self._build_window_index(data, window_time_start, window_size_days, target_end)
+        task = FeatureTask(weights, multivariate, constraint, top, prune, norm_windows)
+        return self._iter_matches(window_index, target_end, task)
+
+    def _iter_matches(self, window_index: WindowIndex, target_end: datetime,
+                      task: StrategyTask | FeatureTask) -> Iterator[MatchModel]:
+        with self.profiler.stage('window_extraction'):
+            target_bounds = self._load_target(window_index, target_end)
+        self._init_progress(len(window_index))
+        self.profiler.count('searches')
+        self.profiler.count('candidates', len(window_index))
+        stats = None
+        if isinstance(task, FeatureTask) and task.pruned:
+            stats = self.prune_stats = PruneStats(candidates=len(window_index))
+        scores = task.iter_scores(window_index, window_index.bars(*target_bounds), self._report_progress,
+                                  self.profiler, stats)
+        return self._stream_matches(window_index, scores)
+
+    def _stream_matches(self, window_index: WindowIndex,
+                        scores: Iterator[tuple[int, float | None]]) -> Iterator[MatchModel]:
+        index = window_index.index
+        scored = failures = 0
+        for i, score in scores:
+            if score is None:
+                failures += 1
+                continue
+            scored += 1
+            yield MatchModel(index[window_index.starts[i]], index[window_index.ends[i]], float(score))
+        self.profiler.count('scored', scored)
+        self.profiler.count('failures', failures)
+        logger.info(f'Successfully processed {scored} matches, with {failures} failures.')
+
+    def _build_window_index(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
+                            target_end: datetime) -> WindowIndex:
+        with self.profiler.stage('window_extraction'):
+            return WindowIndex.build(data, window_time_start, window_size_days, target_end.time())
+
+    def _run(self, window_index: WindowIndex, target_end: datetime,
+             task: StrategyTask | FeatureTask) -> ScoredCandidates:
+        """Score the candidates of window_index against the target window with task, in parallel if n_jobs > 1"""
+        with self.profiler.stage('window_extraction'):
+            target_bounds = self._load_target(window_index, target_end)
+        self._init_progress(len(window_index))
+        self.profiler.count('searches')
+        self.profiler.count('candidates', len(window_index))
+
+        if self.n_jobs > 1:
+            from market_sim_search.parallel import run_sharded
+
+            if isinstance(task, FeatureTask) and task.norm_windows is not None:
+                # Workers normalize their own shard, rather than receiving a pickled copy of the whole tensor
+                task = replace(task, norm_windows=None)
+            with self.profiler.stage('dtw'):
+                shards = run_sharded(window_index, target_bounds, task, self.n_jobs, self._advance_progress)
+            for _, _, pid, failures in shards:
+                self.worker_failures[pid] = self.worker_failures.get(pid, 0) + failures
+            logger.info(f'Failures per worker: {self.worker_failures}')
+            ranked = isinstance(task, FeatureTask) and task.prune and bool(task.top)
+            with self.profiler.stage('ranking'):
+                result = merge_scored([(shard, result) for shard, result, _, _ in shards],
+                                      task.top if ranked else None, ranked)
+        else:
+            result = task(window_index, window_index.bars(*target_bounds), self._report_progress, self.profiler)
+
+        self._count_result(result)
+        return result
+
+    def _count_result(self, result: ScoredCandidates):
+        self.profiler.count('scored', len(result.candidates))
+        self.profiler.count('failures', result.failures)
+        logger.info(f'Successfully processed {len(result.candidates)} matches, with {result.failures} failures.')
+
+    def _to_matches(self, window_index: WindowIndex, result: ScoredCandidates) -> list[MatchModel]:
+        with self.profiler.stage('materialization'):
+            index = window_index.index
+            starts = index[window_index.starts[result.candidates]]
+            ends = index[window_index.ends[result.candidates]]
+            return [MatchModel(start, end, float(score)) for start, end, score in zip(starts, ends, result.scores)]
+
+    def _load_target(self, window_index: WindowIndex, target_end: datetime) -> tuple[int, int]:
+        """Return the bounds of the target window"""
+        target_bounds = window_index.locate(target_end)
+        if target_bounds is None:
+            raise Exception("Can't load target window")
+
+        index = window_index.index
+        logger.info(f'Using target window {index[target_bounds[0]]}-{index[target_bounds[1]]}')
+        logger.info(f'Searching for windows of length {window_index.window_size_days} days ending at time '
+                    f'{target_end.time()}')
+        return target_bounds
+
+    def _init_progress(self, num_indices: int):
         if self.progress_reporter and np.isnan(self.max_progress_count):
             if np.isnan(self.max_outer_loop_count):
                 raise ValueError("max_outer_loop_count wasn't initialized")
@@ -127,82 +840,69 @@ class StrategyRunner:
             # Assuming that num_indices is the same for each inner loop
             self.max_progress_count = num_indices * self.max_outer_loop_count
 
-        for idx in idxs:
-            if self.progress_reporter:
-                self.progress_reporter(self.progress_count / float(self.max_progress_count))
-                self.progress_count += 1
+    def _check_cancelled(self):
+        if self.should_cancel and self.should_cancel():
+            raise SearchCancelled('Search was cancelled')
 
-            window_end = data.index[idx]
-            window = get_window(data, window_time_start, window_size_days, window_end)
-            if window is None:
-                fail += 1
-                continue
-            try:
-                score = strategy(target_window, window)
-            except Exception as e:
-                logger.exception(f'Error calculating score')
-                fail += 1
-                continue
-            matches.append(MatchModel(window.index[0], window.index[-1], score))
-            success += 1
+    def _report_progress(self):
+        self._check_cancelled()
+        if self.progress_reporter:
+            self.progress_reporter(self.progress_count / float(self.max_progress_count))
+            self.progress_count += 1
 
-        logger.info(f'Successfully processed {success} matches, with {fail} failures.')
-        return matches
+    def _advance_progress(self, count: int):
+        """Report progress for a batch of count candidates, e.g. a completed shard"""
+        self._check_cancelled()
+        if self.progress_reporter:
+            self.progress_count += count
+            self.progress_reporter(self.progress_count / float(self.max_progress_count))
 
     def find_similar_dtw_hlc4(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
                               target_end: datetime,
-                              top: int = None) -> list[MatchModel]:
+                              top: int = None, prune: bool = False,
+                              constraint: DtwConstraint | None = None) -> list[MatchModel]:
         """Find similar windows using DTW on hlc4"""
-        matches = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_hlc4)
-        return least_distance(matches, top)
+        return self.find_similar_features(data, window_time_start, window_size_days, target_end, {'hlc4': 1},
+                                          top=top, prune=prune, constraint=constraint)
 
     def find_similar_dtw_high_low_1(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
-                                    target_end: datetime, top: int = None) -> list[MatchModel]:
+                                    target_end: datetime, top: int = None,
+                                    constraint: DtwConstraint | None = None) -> list[MatchModel]:
         """Find matches using average distance of DTW on high and low. Filter to results that are top matches for both."""
-        matches_high = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_high)
-        matches_low = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_low)
+        window_index = self._build_window_index(data, window_time_start, window_size_days, target_end)
+        matches_high = self.find_similar_windows(data, window_time_start, window_size_days, target_end,
+                                                 partial(dtw_high, constraint=constraint), window_index)
+        matches_low = self.find_similar_windows(data, window_time_start, window_size_days, target_end,
+                                                partial(dtw_low, constraint=constraint), window_index)
 
         # Select the top from the intermediate results, only use results that are in both top results.
-        intermediate_top_size = int(len(matches_high) / 5)
-        matches_high = least_distance(matches_high, intermediate_top_size)
-        matches_low = least_distance(matches_low, intermediate_top_size)
-
-        matches = []
-        for match_high in matches_high:
-            for match_low in matches_low:
-                if match_high.end.date() == match_low.end.date():
-                    score = (match_high.score + match_low.score) / 2
-                    matches.append(MatchModel(match_high.start, match_high.end, score))
-        return least_distance(matches, top)
+        with self.profiler.stage('ranking'):
+            intermediate_top_size = int(len(matches_high) / 5)
+            matches_high = least_distance(matches_high, intermediate_top_size)
+            matches_low = least_distance(matches_low, intermediate_top_size)
+
+            matches = []
+            for match_high in matches_high:
+                for match_low in matches_low:
+                    if match_high.end.date() == match_low.end.date():
+                        score = (match_high.score + match_low.score) / 2
+                        matches.append(MatchModel(match_high.start, match_high.end, score))
+            return least_distance(matches, top)
 
     def find_similar_dtw_high_low_2(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
-                                    target_end: datetime, top: int = None) -> list[MatchModel]:
+                                    target_end: datetime, top: int = None, prune: bool = False,
+                                    constraint: DtwConstraint | None = None) -> list[MatchModel]:
         """Find matches using average distance of DTW on high and low."""
-        matches_high = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_high)
-        matches_low = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_low)
-
-        lookup_low = {match.end: match for match in matches_low}
-        matches = []
-        for match_high in matches_high:
-            score = (match_high.score + lookup_low[match_high.end].score) / 2
-            matches.append(MatchModel(match_high.start, match_high.end, score))
-        return least_distance(matches, top)
+        return self.find_similar_features(data, window_time_start, window_size_days, target_end,
+                                          {'high': 1, 'low': 1}, top=top, prune=prune, constraint=constraint)
 
     def find_similar_dtw_high_low_close_4(self, data: pd.DataFrame, window_time_start: time, window_size_days: int,
-                                          target_end: datetime, top: int = None) -> list[MatchModel]:
+                                          target_end: datetime, top: int = None, prune: bool = False,
+                                          constraint: DtwConstraint | None = None) -> list[MatchModel]:
         """Find matches using average distance of DTW on high, low, and close. Assign 2x weight to close.
 
         The difference from this and find_similar_dtw_hlc4 is that this method runs DTW separately on each feature.
         """
-        self.max_outer_loop_count = 3
-        matches_high = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_high)
-        matches_low = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_low)
-        matches_close = self.find_similar_windows(data, window_time_start, window_size_days, target_end, dtw_close)
-
-        matches = []
-        lookup_high = {match.end: match for match in matches_high}
-        lookup_low = {match.end: match for match in matches_low}
-        for match_close in matches_close:
-            score = (lookup_high[match_close.end].score + lookup_low[match_close.end].score + match_close.score * 2) / 4
-            matches.append(MatchModel(match_close.start, match_close.end, score))
-        return least_distance(matches, top)
+        self.max_outer_loop_count = 1
+        return self.find_similar_features(data, window_time_start, window_size_days, target_end,
+                                          HIGH_LOW_CLOSE_4_WEIGHTS, top=top, prune=prune, constraint=constraint)
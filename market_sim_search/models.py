@@ -1,6 +1,6 @@
 from collections import namedtuple
-from dataclasses import dataclass
 from datetime import datetime
+from io import StringIO
 
 import pandas as pd
 from pandas import DataFrame
@@ -13,28 +13,85 @@ MatchModel = namedtuple('MatchModel', ['start', 'end', 'score'])
 # Contains the matched price data and the data immediately following. The data following the match may be historical
 # data, or it may be generated data (a real projection). But we refer to them both as projections. The projection start
 # should usually be immediately following the match_end.
-@dataclass
 class WindowMatch:
-    window: DataFrame
-    match_end: datetime
-    projection_start: datetime
-    score: float = -1
+    """A match, with its window and projection as a DataFrame.
+
+    A match may be a view of shared backing data: source with the bounds of the window and projection in it, as
+    built by get_window_matches. The window is then sliced from source on first access, without copying any bars.
+    """
+
+    def __init__(self, window: DataFrame | None, match_end: datetime, projection_start: datetime, score: float = -1,
+                 source: DataFrame | None = None, bounds: tuple[int, int] | None = None):
+        if window is None and (source is None or bounds is None):
+            raise ValueError('A WindowMatch needs a window, or a source and bounds to slice it from')
+        self._window = window
+        self.match_end = match_end
+        self.projection_start = projection_start
+        self.score = score
+        self.source = source
+        self.bounds = bounds
+        self._chart_data = None
+
+    @property
+    def window(self) -> DataFrame:
+        if self._window is None:
+            start, stop = self.bounds
+            self._window = self.source.iloc[start:stop]
+        return self._window
+
+    @window.setter
+    def window(self, window: DataFrame):
+        self._window = window
+        self.source = self.bounds = self._chart_data = None
+
+    @property
+    def start(self) -> datetime:
+        """The time of the window's first bar, read from source without slicing the window if it is a view"""
+        if self._window is None:
+            return self.source.index[self.bounds[0]]
+        return self._window.index[0]
+
+    def chart_data(self) -> DataFrame:
+        """Return the window with a tz-naive index, as charts expect. It shares the bars of the window and is cached."""
+        if self._chart_data is None:
+            window = self.window
+            index = window.index.tz_localize(None) if getattr(window.index, 'tz', None) else window.index
+            self._chart_data = window.set_axis(index, copy=False)
+        return self._chart_data
+
+    def __repr__(self):
+        return (f'WindowMatch(match_end={self.match_end!r}, projection_start={self.projection_start!r}, '
+                f'score={self.score!r}, bars={len(self.window)})')
 
     def __getstate__(self):
-        # Convert DataFrame to JSON string
+        # Store the window as arrays rather than JSON, so pickles are compact, fast and keep the tz-aware index
+        index = pd.DatetimeIndex(self.window.index)
         state = dict()
-        state['window'] = self.window.to_json()
-        state['match_end'] = self.match_end.isoformat()
-        state['projection_start'] = self.projection_start.isoformat()
-        state['score'] = self.score
+        state['index'] = (index.tz_convert('UTC') if index.tz else index).as_unit('ns').asi8
+        state['tz'] = str(index.tz) if index.tz else None
+        state['index_name'] = index.name
+        state['columns'] = {name: column.to_numpy() for name, column in self.window.items()}
+        state['match_end'] = self.match_end
+        state['projection_start'] = self.projection_start
+        state['score'] = float(self.score)
         return state
 
     def __setstate__(self, state):
-        # Convert JSON string back to DataFrame
-        self.window = pd.read_json(state['window'])
-        self.match_end = datetime.fromisoformat(state['match_end'])
-        self.projection_start = datetime.fromisoformat(state['projection_start'])
-        self.score = int(state['score'])
+        self.source = self.bounds = self._chart_data = None
+        if 'window' in state:
+            # Pickled by older versions, with the window as JSON and timestamps as ISO strings
+            self.window = pd.read_json(StringIO(state['window']))
+            self.match_end = datetime.fromisoformat(state['match_end'])
+            self.projection_start = datetime.fromisoformat(state['projection_start'])
+            self.score = float(state['score'])
+            return
+        index = pd.DatetimeIndex(state['index'].view('M8[ns]'), name=state['index_name'])
+        if state['tz']:
+            index = index.tz_localize('UTC').tz_convert(state['tz'])
+        self.window = pd.DataFrame(state['columns'], index=index, copy=False)
+        self.match_end = state['match_end']
+        self.projection_start = state['projection_start']
+        self.score = state['score']
 
     def __hash__(self):
         return hash((self.match_end, self.projection_start))
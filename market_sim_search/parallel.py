@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from market_sim_search.windows import WindowIndex
+
+# Shards per worker. More shards give finer progress updates and better load balancing, at some scheduling cost.
+shards_per_job = 4
+
+
+@dataclass
+class SharedArray:
+    """A picklable reference to an array in shared memory"""
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+    @classmethod
+    def create(cls, array: np.ndarray) -> tuple[SharedMemory, 'SharedArray']:
+        """Copy array into a new shared memory block. The caller owns the block and must unlink it."""
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        return shm, cls(shm.name, array.shape, array.dtype.str)
+
+    def attach(self) -> tuple[SharedMemory, np.ndarray]:
+        """Map the shared block into this process. The block stays owned by the process that created it."""
+        shm = SharedMemory(name=self.name)
+        return shm, np.ndarray(self.shape, np.dtype(self.dtype), buffer=shm.buf)
+
+
+def run_sharded(window_index: WindowIndex, target_bounds: tuple[int, int], task: Callable, n_jobs: int,
+                on_shard_done: Callable[[int], None] | None = None) -> list[tuple[np.ndarray, Any, int, int]]:
+    """Run task over shards of the candidates of window_index in a pool of n_jobs processes.
+
+    The bars and timestamps are shared with the workers through shared memory, only the candidate offsets of each
+    shard are pickled. task is called in the worker with a WindowIndex of the shard's candidates and the target bars.
+    on_shard_done is called in this process with the number of candidates of each completed shard, so progress is
+    monotonic. If it raises, shards that haven't started are cancelled. Returns (shard candidates, task result,
+    worker pid, failures) for each shard, in candidate order, so the merged result doesn't depend on scheduling.
+    """
+    n_shards = min(len(window_index), n_jobs * shards_per_job) or 1
+    shards = np.array_split(np.arange(len(window_index)), n_shards)
+    values_shm, values = SharedArray.create(window_index.values)
+    index_shm, index = SharedArray.create(window_index.index.asi8)
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {
+                executor.submit(_run_shard, values, index, str(window_index.index.tz or ''),
+                                replace(window_index, index=None, values=None, starts=window_index.starts[shard],
+                                        ends=window_index.ends[shard], valid=window_index.valid[shard]),
+                                target_bounds, task): n
+                for n, shard in enumerate(shards)
+            }
+            results = [None] * n_shards
+            try:
+                for future in as_completed(futures):
+                    n = futures[future]
+                    results[n] = future.result()
+                    if on_shard_done:
+                        on_shard_done(len(shards[n]))
+            except BaseException:
+                # Drop the shards that haven't started, e.g. when on_shard_done cancels the search
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+    finally:
+        for shm in (values_shm, index_shm):
+            shm.close()
+            shm.unlink()
+    return [(shard, result, pid, result.failures) for shard, (result, pid) in zip(shards, results)]
+
+
+def _run_shard(values: SharedArray, index: SharedArray, tz: str, shard_index: WindowIndex,
+               target_bounds: tuple[int, int], task: Callable) -> tuple[Any, int]:
+    """Worker side of run_sharded"""
+    values_shm, values_array = values.attach()
+    index_shm, index_array = index.attach()
+    try:
+        bar_index = pd.to_datetime(index_array, utc=True)
+        shard_index = replace(shard_index, index=bar_index.tz_convert(tz) if tz else bar_index.tz_localize(None),
+                              values=values_array)
+        return task(shard_index, shard_index.bars(*target_bounds)), os.getpid()
+    finally:
+        values_shm.close()
+        index_shm.close()
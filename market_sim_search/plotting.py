@@ -1,44 +1,52 @@
+from typing import TYPE_CHECKING
+
 import pandas as pd
-import traceback
-from lightweight_charts import JupyterChart, Chart, AbstractChart
-from lightweight_charts.widgets import StreamlitChart
-from plotly import graph_objects as go
+from loguru import logger
 
 from market_sim_search.models import MatchModel, WindowMatch
+from market_sim_search.profiling import NULL_PROFILER, Profiler
+from market_sim_search.projections import projection_offsets
+
+# lightweight_charts and plotly are slow to import, so they are imported by the functions that draw charts, and
+# get_window_matches stays cheap to import for headless use
+if TYPE_CHECKING:
+    from lightweight_charts import AbstractChart, JupyterChart
+    from lightweight_charts.widgets import StreamlitChart
 
 
 def get_window_match(data: pd.DataFrame, match: MatchModel):
     """Return the dataframe slice associated with the model"""
-    try:
-        project_start_idx = data.index.get_loc(match.end) + 1
-        project_start = data.index[project_start_idx]
-        project_end = data.index.asof(match.end.replace(hour=23, minute=59, second=59))
-        window = data.loc[match.start:match.end]
-        project = data.loc[project_start:project_end]
-        window = pd.concat([window, project])
-        return WindowMatch(window, match.end, project_start, match.score)
-    except Exception as e:
-        print(f'Error getting window_match: {e}')
-        traceback.print_exc()
-        return None
+    window_matches = get_window_matches(data, [match])
+    return window_matches[0] if window_matches else None
 
 
-def get_window_matches(data: pd.DataFrame, matches: list[MatchModel]):
-    """Return the dataframe slices associated with the models"""
+def get_window_matches(data: pd.DataFrame, matches: list[MatchModel], profiler: Profiler = NULL_PROFILER):
+    """Return the dataframe slices associated with the models. The profiler times this as the materialization stage.
+
+    Each WindowMatch is a view of data: the window from the match start, followed by the projection until the end of
+    the match's day. The bar offsets of all matches are found in one pass, and no bars are copied. Matches whose end
+    isn't a bar of data, or is its last bar, are skipped.
+    """
     window_matches = []
-    for match in matches:
-        window_match = get_window_match(data, match)
-        if window_match is None:
-            continue
-        else:
-            window_matches.append(window_match)
+    with profiler.stage('materialization'):
+        index = data.index
+        starts = index.searchsorted(pd.DatetimeIndex([match.start for match in matches]), side='left')
+        projection_starts, lengths = projection_offsets(index, [match.end for match in matches])
+        for match, start, projection_start, length in zip(matches, starts, projection_starts, lengths):
+            if projection_start >= len(index) or index[projection_start - 1] != match.end:
+                logger.warning(f'Error getting window_match: no bars after the match ending at {match.end}')
+                continue
+            window_matches.append(WindowMatch(None, match.end, index[projection_start], match.score, source=data,
+                                              bounds=(int(start), int(projection_start + length))))
     return window_matches
 
 
 def create_streamlit_chart(window_match: WindowMatch, show_projection: bool = True, width: int = 800,
-                           height: int = 600) -> StreamlitChart | None:
+                           height: int = 600) -> 'StreamlitChart | None':
     """Plot streamlit chart from a WindowMatch, with an optional projection"""
     if pd.notna(window_match.match_end):
+        from lightweight_charts.widgets import StreamlitChart
+
         chart = StreamlitChart(width=width, height=height)
         create_chart_impl(chart, window_match, show_projection)
         return chart
@@ -46,9 +54,8 @@ def create_streamlit_chart(window_match: WindowMatch, show_projection: bool = Tr
         return None
 
 
-def create_chart_impl(chart: AbstractChart, window_match: WindowMatch, show_projection: bool):
-    data = window_match.window.copy()
-    data.index = data.index.tz_localize(None)
+def create_chart_impl(chart: 'AbstractChart', window_match: WindowMatch, show_projection: bool):
+    data = window_match.chart_data()
     projection_start = window_match.projection_start.replace(tzinfo=None)
     if not show_projection:
         chart.set(data.loc[:projection_start])  # Little leakage, should be non inclusive
@@ -58,10 +65,35 @@ def create_chart_impl(chart: AbstractChart, window_match: WindowMatch, show_proj
     chart.vertical_span(projection_start, color='#E8F2FD')
 
 
+def create_projection_chart_impl(chart: 'AbstractChart', target: WindowMatch, bands: pd.DataFrame,
+                                 mean_color: str = '#FFA500', band_color: str = 'rgba(255, 255, 255, 0.6)'):
+    """Plot the target window extended over the index of its projection bands, with a line for each band.
+
+    bands is a frame like Projections.bands, with a mean column drawn solid and quantile columns drawn dashed. Bars
+    that followed the target, if any, are plotted too.
+    """
+    window = target.window
+    index = window.loc[:target.match_end].index.append(bands.index).drop_duplicates()
+    if not index.is_monotonic_increasing:
+        raise Exception('Extended target index is not monotonic increasing')
+    extended = WindowMatch(window.reindex(index), target.match_end, bands.index[0] if len(bands) else target.match_end,
+                           target.score)
+    create_chart_impl(chart, extended, show_projection=True)
+
+    bands = bands.copy()
+    bands.index = bands.index.tz_localize(None)
+    for column in bands:
+        line = chart.create_line(column, color=mean_color if column == 'mean' else band_color,
+                                 style='solid' if column == 'mean' else 'dashed', width=2 if column == 'mean' else 1)
+        line.set(bands[[column]])
+
+
 def create_jupyter_chart(window_match: WindowMatch, show_projection: bool = True, width: int = 1200,
-                         height: int = 600) -> JupyterChart | None:
+                         height: int = 600) -> 'JupyterChart | None':
     """Plot jupyter chart from a WindowMatch, with an optional projection"""
     if pd.notna(window_match.match_end):
+        from lightweight_charts import JupyterChart
+
         chart = JupyterChart(width=width, height=height)
         create_chart_impl(chart, window_match, show_projection)
         return chart
@@ -69,15 +101,37 @@ def create_jupyter_chart(window_match: WindowMatch, show_projection: bool = True
         return None
 
 
+def create_streamlit_projection_chart(target: WindowMatch, bands: pd.DataFrame, width: int = 800,
+                                      height: int = 600) -> 'StreamlitChart':
+    """Plot streamlit chart of the target window with its projection bands, see create_projection_chart_impl"""
+    from lightweight_charts.widgets import StreamlitChart
+
+    chart = StreamlitChart(width=width, height=height)
+    create_projection_chart_impl(chart, target, bands)
+    return chart
+
+
+def create_jupyter_projection_chart(target: WindowMatch, bands: pd.DataFrame, width: int = 1200,
+                                    height: int = 600) -> 'JupyterChart':
+    """Plot jupyter chart of the target window with its projection bands, see create_projection_chart_impl"""
+    from lightweight_charts import JupyterChart
+
+    chart = JupyterChart(width=width, height=height)
+    create_projection_chart_impl(chart, target, bands)
+    return chart
+
+
 def create_jupyter_chart_from_model(data: pd.DataFrame, match: MatchModel,
-                                    show_projection: bool = True) -> JupyterChart:
+                                    show_projection: bool = True) -> 'JupyterChart':
     """Plot candlestick chart a dataframe and a match, with an optional projection"""
     window_match = get_window_match(data, match)
     return create_jupyter_chart(window_match, show_projection)
 
 
-def create_jupyter_chart_from_df(data: pd.DataFrame, width: int = 1600, height: int = 700) -> JupyterChart:
+def create_jupyter_chart_from_df(data: pd.DataFrame, width: int = 1600, height: int = 700) -> 'JupyterChart':
     """Plot candlestick chart from a dataframe."""
+    from lightweight_charts import JupyterChart
+
     chart = JupyterChart(width=width, height=height)
     data = data.copy()
     data.index = data.index.tz_localize(None)
@@ -89,12 +143,16 @@ def create_jupyter_chart_from_df(data: pd.DataFrame, width: int = 1600, height:
 
 def create_candlestick_plotly_impl(match: WindowMatch, title=None):
     """Create a candlestick chart from OHLCV data"""
+    from plotly import graph_objects as go
+
     df = match.window
     return go.Candlestick(x=df.index, open=df['open'], high=df['high'], low=df['low'], close=df['close'], name=title)
 
 
 def create_candlestick_plotly(match: WindowMatch, title="Price Chart"):
     """Create a candlestick chart from OHLCV data"""
+    from plotly import graph_objects as go
+
     fig = go.Figure(data=[create_candlestick_plotly_impl(match)])
 
     fig.update_layout(
@@ -0,0 +1,110 @@
+import json
+import time as timer
+from bisect import bisect_left
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+
+# Stages of a search timed by StrategyRunner
+STAGES = ['window_extraction', 'normalization', 'dtw', 'ranking', 'materialization']
+
+# Upper bounds in seconds of the histogram buckets of each stage. The last bucket is unbounded.
+DEFAULT_BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1., 10.)
+
+
+@dataclass
+class StageStats:
+    """Observations of one stage, with a histogram of their durations"""
+    count: int = 0
+    seconds: float = 0.
+    max_seconds: float = 0.
+    bucket_counts: list[int] = field(default_factory=list)
+
+
+class _StageTimer:
+    def __init__(self, profiler: 'Profiler', stage: str):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = timer.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.observe(self.stage, timer.perf_counter() - self.start)
+
+
+class Profiler:
+    """Per stage timings and counters of searches.
+
+    Time a block with `with profiler.stage('dtw'):`, and count events with profiler.count. Stages are usually those
+    of STAGES, but any name is accepted.
+    """
+    enabled = True
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.stages: dict[str, StageStats] = {}
+        self.counters: dict[str, int] = {}
+
+    def stage(self, name: str) -> _StageTimer:
+        return _StageTimer(self, name)
+
+    def observe(self, name: str, seconds: float):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(bucket_counts=[0] * (len(self.buckets) + 1))
+        stats.count += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.bucket_counts[bisect_left(self.buckets, seconds)] += 1
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        self.stages.clear()
+        self.counters.clear()
+
+    def to_dict(self) -> dict:
+        return {
+            'buckets': list(self.buckets),
+            'stages': {name: asdict(stats) for name, stats in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix: str = 'market_sim_search') -> str:
+        """Return the stages as a histogram and the counters as counters, in the Prometheus text format"""
+        lines = [f'# HELP {prefix}_stage_seconds Time spent in each stage of a search',
+                 f'# TYPE {prefix}_stage_seconds histogram']
+        for name, stats in self.stages.items():
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, '+Inf'], stats.bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stats.seconds}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stats.count}')
+        for name, value in self.counters.items():
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class NullProfiler(Profiler):
+    """A profiler that records nothing, used when profiling is disabled"""
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name: str) -> nullcontext:
+        return self._context
+
+    def observe(self, name: str, seconds: float):
+        pass
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,160 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from market_sim_search.matches import normalize_window
+from market_sim_search.models import MatchModel
+from market_sim_search.windows import session_days
+
+# Quantiles of the default projection bands
+DEFAULT_QUANTILES = (0.2, 0.8)
+
+
+def projection_offsets(index: pd.DatetimeIndex, match_ends: list[datetime]) -> tuple[np.ndarray, np.ndarray]:
+    """Return the bar offsets each projection starts at, and its length.
+
+    The projection of a match is the bars after its end until the end of the same day, like get_window_match. Ends
+    that aren't bars of index get an empty projection.
+    """
+    ns = index.asi8
+    end_ns = pd.DatetimeIndex(match_ends).as_unit('ns').asi8
+    ends = np.searchsorted(ns, end_ns, side='left')
+    found = (ends < len(ns)) & (ns[np.minimum(ends, len(ns) - 1)] == end_ns)
+    days = session_days(index)
+    day_ends = np.searchsorted(days, days[np.minimum(ends, len(ns) - 1)], side='right') - 1
+    return ends + 1, np.where(found, day_ends - ends, 0)
+
+
+def score_weights(scores: np.ndarray) -> np.ndarray:
+    """Inverse distance weights of match scores, so closer matches weigh more.
+
+    Scores are floored at the smallest positive score, so an exact match such as the target itself doesn't take all
+    the weight.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    positive = scores[scores > 0]
+    floor = positive.min() if len(positive) else 1.
+    return 1 / np.maximum(scores, floor)
+
+
+def weighted_quantiles(values: np.ndarray, weights: np.ndarray, quantiles: list[float]) -> np.ndarray:
+    """Return the weighted quantiles of each column of a NaN padded (n_rows, n_columns) array.
+
+    Each row has a weight. Quantiles interpolate linearly between the midpoints of the sorted weights, so with equal
+    weights they are the usual quantiles up to the interpolation of the ends. Returns (len(quantiles), n_columns).
+    """
+    order = np.argsort(values, axis=0)
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    sorted_weights = np.where(np.isnan(sorted_values), 0., weights[order])
+    cumulative = np.cumsum(sorted_weights, axis=0)
+    total = cumulative[-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        midpoints = (cumulative - sorted_weights / 2) / total
+    midpoints = np.where(sorted_weights > 0, midpoints, np.inf)
+
+    result = np.full((len(quantiles), values.shape[1]), np.nan)
+    counts = (sorted_weights > 0).sum(axis=0)
+    columns = np.arange(values.shape[1])
+    for n, q in enumerate(quantiles):
+        upper = np.minimum((midpoints < q).sum(axis=0), np.maximum(counts - 1, 0))
+        lower = np.maximum(upper - 1, 0)
+        low_point, high_point = midpoints[lower, columns], midpoints[upper, columns]
+        low_value, high_value = sorted_values[lower, columns], sorted_values[upper, columns]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.clip((q - low_point) / (high_point - low_point), 0, 1)
+        interpolated = np.where(high_point > low_point, low_value + fraction * (high_value - low_value), high_value)
+        result[n] = np.where(counts > 0, interpolated, np.nan)
+    return result
+
+
+@dataclass
+class Projections:
+    """What followed each match, aligned by bar offset after the target end and rescaled to the target close.
+
+    values is a (n_matches, n_bars) array, NaN past the end of each projection. index holds the timestamps of the
+    bars following the target, at the bar frequency.
+    """
+    values: np.ndarray
+    scores: np.ndarray
+    index: pd.DatetimeIndex
+    base: float
+
+    def mean(self) -> np.ndarray:
+        """Return the mean of the projections at each bar, NaN at bars no projection reaches"""
+        if not len(self.values):
+            return np.full(len(self.index), np.nan)
+        # Only bars some projection reaches are reduced, as nanmean warns on all NaN columns
+        covered = self._covered()
+        mean = np.full(self.values.shape[1], np.nan)
+        mean[covered] = np.nanmean(self.values[:, covered], axis=0)
+        return mean
+
+    def quantiles(self, quantiles: list[float] = DEFAULT_QUANTILES) -> np.ndarray:
+        """Return a (len(quantiles), n_bars) array of the quantiles of the projections at each bar"""
+        if not len(self.values):
+            return np.full((len(quantiles), len(self.index)), np.nan)
+        covered = self._covered()
+        result = np.full((len(quantiles), self.values.shape[1]), np.nan)
+        result[:, covered] = np.nanquantile(self.values[:, covered], quantiles, axis=0)
+        return result
+
+    def _covered(self) -> np.ndarray:
+        """Return whether any projection reaches each bar"""
+        return ~np.isnan(self.values).all(axis=0)
+
+    def weighted_mean(self, weights: np.ndarray | None = None) -> np.ndarray:
+        """Return the mean of the projections weighted by score_weights, or the given weight of each match"""
+        weights = score_weights(self.scores) if weights is None else np.asarray(weights, dtype=np.float64)
+        present = ~np.isnan(self.values)
+        total = (weights[:, None] * present).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (weights[:, None] * np.nan_to_num(self.values)).sum(axis=0) / np.where(total > 0, total, np.nan)
+
+    def weighted_quantiles(self, quantiles: list[float] = DEFAULT_QUANTILES,
+                           weights: np.ndarray | None = None) -> np.ndarray:
+        """Return the quantiles of the projections weighted by score_weights, or the given weight of each match"""
+        weights = score_weights(self.scores) if weights is None else np.asarray(weights, dtype=np.float64)
+        return weighted_quantiles(self.values, weights, quantiles)
+
+    def bands(self, quantiles: list[float] = DEFAULT_QUANTILES, weighted: bool = False) -> pd.DataFrame:
+        """Return the mean and quantiles of the projections at each bar, in the columns mean and q<quantile>"""
+        mean = self.weighted_mean() if weighted else self.mean()
+        values = self.weighted_quantiles(quantiles) if weighted else self.quantiles(quantiles)
+        bands = pd.DataFrame({'mean': mean}, index=self.index)
+        for q, band in zip(quantiles, values):
+            bands[f'q{q:g}'] = band
+        return bands
+
+
+def build_projections(data: pd.DataFrame, matches: list[MatchModel], target_end: datetime, freq: str | None = None,
+                      feature: str = 'close') -> Projections:
+    """Build the projections of matches in one pass over precomputed bar offsets.
+
+    Each projection is the feature following a match until the end of its day. It is rescaled with normalize_window
+    from its first bar to the target's close at target_end, and aligned bar by bar to an index that starts one bar
+    after target_end at freq, the median bar spacing of data by default. The index spans the longest projection,
+    and the target's own following bars if there are any.
+    """
+    index = data.index
+    values = data[feature].to_numpy(dtype=np.float64)
+    starts, lengths = projection_offsets(index, [match.end for match in matches])
+    _, target_length = projection_offsets(index, [target_end])
+    target_position = int(np.searchsorted(index.asi8, pd.Timestamp(target_end).value, side='right')) - 1
+    if target_position < 0:
+        raise ValueError(f'No bars at or before the target end {target_end}')
+    base = float(data['close'].iat[target_position])
+
+    n_bars = int(max(lengths.max() if len(lengths) else 0, target_length[0]))
+    offsets = np.arange(n_bars)
+    in_projection = offsets < lengths[:, None]
+    positions = np.where(in_projection, starts[:, None] + offsets, 0)
+    projected = np.where(in_projection, values[positions], np.nan)
+    first = projected[:, :1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scaled = normalize_window(projected, first) * base + base
+
+    step = pd.Timedelta(freq) if freq else pd.Timedelta(np.median(np.diff(index.asi8)))
+    projection_index = pd.date_range(pd.Timestamp(target_end) + step, periods=n_bars, freq=step)
+    return Projections(scaled, np.array([match.score for match in matches], dtype=np.float64), projection_index, base)
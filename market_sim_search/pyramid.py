@@ -0,0 +1,104 @@
+import math
+import time as timer
+from dataclasses import dataclass
+from datetime import datetime, time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from market_sim_search.constraints import DtwConstraint
+from market_sim_search.data import resample
+from market_sim_search.matches import STRATEGY_WEIGHTS, StrategyRunner
+from market_sim_search.models import MatchModel
+from market_sim_search.profiling import Profiler
+from market_sim_search.search_index import SearchIndex
+from market_sim_search.types import ProgressReporter
+from market_sim_search.windows import session_days
+
+# Resolutions of the pyramid from coarse to fine, and the fraction of candidates each level but the last passes on
+DEFAULT_FREQS = ('30min', '5min', '1min')
+DEFAULT_SURVIVORS = (0.2, 0.25)
+
+
+@dataclass
+class LevelStats:
+    """What one level of a coarse-to-fine search scored, and how many candidates it passed to the next level"""
+    freq: str
+    candidates: int
+    survivors: int
+    seconds: float
+
+
+class ResolutionPyramid:
+    """SearchIndexes of the same bars resampled to several resolutions, for coarse-to-fine searches.
+
+    A search ranks every candidate at the coarsest resolution, then re-scores only the surviving fraction of them at
+    each finer one, so the top matches are those of the finest resolution for about the cost of a coarse scan.
+    Candidates are matched across levels by the day they end on.
+    """
+
+    def __init__(self, bars: pd.DataFrame, window_time_start: time, window_size_days: int,
+                 freqs: tuple[str, ...] = DEFAULT_FREQS, cache_size: int = 32, profiler: Profiler | None = None):
+        self.freqs = list(freqs)
+        self.levels = {freq: SearchIndex(resample(bars, freq), window_time_start, window_size_days, cache_size,
+                                         profiler)
+                       for freq in self.freqs}
+        self.level_stats: list[LevelStats] = []
+
+    def level_end(self, target_end: datetime, freq: str) -> pd.Timestamp:
+        """Return the end of the window at freq closest to target_end at the finest resolution.
+
+        Bars are labelled by their start, so this is the last bar at freq that ends by the end of the finest bar
+        at target_end, and a coarse window never sees bars after the target.
+        """
+        target_end = pd.Timestamp(target_end)
+        finest = pd.Timedelta(self.freqs[-1])
+        return (target_end + finest).floor(freq) - pd.Timedelta(freq)
+
+    def search(self, target_end: datetime, top: int = 10, strategy: str | dict[str, float] = 'dtw_high_low_close_4',
+               multivariate: bool = False, prune: bool = True, constraint: DtwConstraint | None = None,
+               survivors: tuple[float, ...] = DEFAULT_SURVIVORS, min_survivors: int | None = None,
+               progress_reporter: ProgressReporter | None = None,
+               should_cancel: Callable[[], bool] | None = None) -> list[MatchModel]:
+        """Find the windows most similar to the one ending at target_end, coarse to fine.
+
+        survivors holds the fraction of the candidates scored at each level but the last that are re-scored at the
+        next one, at least min_survivors of them, 5 * top by default. Survivors are the best of their level, so
+        fractions too small may drop some of the exact top at the finest resolution. level_stats reports what each
+        level scored.
+        """
+        if len(survivors) != len(self.freqs) - 1:
+            raise ValueError(f'Expected {len(self.freqs) - 1} survivor fractions for levels {self.freqs}')
+        weights = STRATEGY_WEIGHTS[strategy] if isinstance(strategy, str) else strategy
+        min_survivors = 5 * top if min_survivors is None else min_survivors
+        self.level_stats = []
+        days = None
+        matches = []
+        for level, freq in enumerate(self.freqs):
+            last = level == len(self.freqs) - 1
+            start = timer.perf_counter()
+            reporter = None
+            if progress_reporter:
+                def reporter(fraction: float, level: int = level):
+                    progress_reporter((level + fraction) / len(self.freqs))
+            search_index = self.levels[freq]
+            level_end = pd.Timestamp(target_end) if last else self.level_end(target_end, freq)
+            window_index = search_index.window_index(level_end.time())
+            candidates = np.flatnonzero(window_index.valid)
+            if days is not None:
+                end_days = session_days(window_index.index[window_index.ends[candidates]])
+                candidates = candidates[np.isin(end_days, days)]
+            keep = top if last else max(math.ceil(survivors[level] * len(candidates)), min_survivors)
+
+            runner = StrategyRunner(reporter, profiler=search_index.profiler, should_cancel=should_cancel)
+            runner.max_outer_loop_count = 1
+            norm_windows = search_index.normalized(level_end.time(), tuple(weights))[candidates]
+            matches = runner.find_similar_to(window_index.subset(candidates), search_index.target_window(level_end),
+                                             weights, multivariate, keep, prune, constraint, norm_windows)
+            days = session_days(pd.DatetimeIndex([match.end for match in matches]))
+            self.level_stats.append(LevelStats(freq, len(candidates), len(matches), timer.perf_counter() - start))
+            logger.info(f'Level {freq}: scored {len(candidates)} candidates ending at {level_end.time()}, '
+                        f'kept {len(matches)} in {self.level_stats[-1].seconds:.3f}s')
+        return matches
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from market_sim_search.models import MatchModel, WindowMatch
+from market_sim_search.store import read_frame, read_meta, write_frame
+
+# Frames of a stored list of WindowMatch: the bars of every window back to back, and one row per match
+BARS = 'bars'
+MATCHES = 'matches'
+
+
+def matches_frame(matches: list[MatchModel]) -> pd.DataFrame:
+    """Return matches as a frame indexed by match end, with the start as int64 nanoseconds and the score"""
+    ends = pd.DatetimeIndex([match.end for match in matches], name='end')
+    starts = pd.DatetimeIndex([match.start for match in matches])
+    return pd.DataFrame({'start': _ns(starts), 'score': np.array([match.score for match in matches], np.float64)},
+                        index=ends)
+
+
+def write_matches(matches: list[MatchModel], path: Path, **extra) -> Path:
+    """Write search results as raw binary columns with write_frame. extra is stored with the metadata, e.g. the
+    target and strategy of the search."""
+    return write_frame(matches_frame(matches), path, **extra)
+
+
+def read_matches(path: Path, mmap: bool = True) -> list[MatchModel]:
+    """Read search results written by write_matches"""
+    frame = read_frame(path, mmap)
+    starts = _to_timestamps(frame['start'].to_numpy(), frame.index.tz)
+    return [MatchModel(start, end, float(score)) for start, end, score in zip(starts, frame.index, frame['score'])]
+
+
+def write_window_matches(window_matches: list[WindowMatch], path: Path, **extra) -> Path:
+    """Write window matches as two frames with write_frame: the bars of all windows back to back, and the end,
+    projection start, score and bar offsets of each match. extra is stored with the metadata of the matches."""
+    path = Path(path)
+    windows = [window_match.window for window_match in window_matches]
+    lengths = np.array([len(window) for window in windows], dtype=np.int64)
+    bars = pd.concat(windows) if windows else pd.DataFrame(index=pd.DatetimeIndex([]))
+    info = pd.DataFrame({
+        'offset': np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64) if len(lengths) else lengths,
+        'length': lengths,
+        'projection_start': _ns(pd.DatetimeIndex([match.projection_start for match in window_matches])),
+        'score': np.array([match.score for match in window_matches], dtype=np.float64),
+    }, index=pd.DatetimeIndex([match.match_end for match in window_matches], name='match_end'))
+    write_frame(bars, path / BARS)
+    write_frame(info, path / MATCHES, **extra)
+    return path
+
+
+def read_window_matches(path: Path, mmap: bool = True) -> list[WindowMatch]:
+    """Read window matches written by write_window_matches.
+
+    With mmap the bars are memory mapped. Each WindowMatch is a view of them, see WindowMatch, so nothing is copied
+    until a window is modified.
+    """
+    path = Path(path)
+    bars = read_frame(path / BARS, mmap)
+    info = read_frame(path / MATCHES, mmap)
+    projection_starts = _to_timestamps(info['projection_start'].to_numpy(), info.index.tz)
+    return [WindowMatch(None, match_end, projection_start, float(score), source=bars,
+                        bounds=(int(offset), int(offset + length)))
+            for match_end, offset, length, projection_start, score
+            in zip(info.index, info['offset'], info['length'], projection_starts, info['score'])]
+
+
+def read_results_meta(path: Path) -> dict | None:
+    """Return the metadata stored with results, including the extra of write_matches or write_window_matches"""
+    path = Path(path)
+    return read_meta(path / MATCHES) if (path / MATCHES).is_dir() else read_meta(path)
+
+
+def _ns(index: pd.DatetimeIndex) -> np.ndarray:
+    """Return timestamps as int64 UTC nanoseconds, NaT as the minimum int64"""
+    if index.tz is not None:
+        index = index.tz_convert('UTC')
+    return index.as_unit('ns').asi8
+
+
+def _to_timestamps(ns: np.ndarray, tz) -> pd.DatetimeIndex:
+    index = pd.DatetimeIndex(np.asarray(ns).view('M8[ns]'))
+    return index.tz_localize('UTC').tz_convert(tz) if tz else index
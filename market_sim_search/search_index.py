@@ -0,0 +1,212 @@
+from collections import OrderedDict
+from datetime import datetime, time
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from market_sim_search.ann import ApproximateIndex
+from market_sim_search.constraints import DtwConstraint
+from market_sim_search.matches import STRATEGY_WEIGHTS, StrategyRunner, normalize_features, stream_top
+from market_sim_search.models import MatchModel
+from market_sim_search.profiling import NULL_PROFILER, Profiler
+from market_sim_search.types import ProgressReporter
+from market_sim_search.windows import CLOSE, WindowIndex
+
+
+class SearchIndex:
+    """Candidate windows of a dataset, indexed and normalized once for many searches.
+
+    Searches differing only in target_end, top or strategy reuse the WindowIndex of the target's time of day and its
+    normalized feature arrays. The results of the most recent cache_size searches are kept in an LRU cache.
+    An optional profiler times the stages of every search, see StrategyRunner.
+    Searches with a shortlist re-rank only the candidates shortlisted by an ApproximateIndex, which is saved in
+    ann_dir if it's set. ann_dir should be specific to the dataset, stale indexes in it are rebuilt.
+    """
+
+    def __init__(self, data: pd.DataFrame, window_time_start: time, window_size_days: int, cache_size: int = 32,
+                 profiler: Profiler | None = None, ann_dir: Path | None = None):
+        self.data = data
+        self.window_time_start = window_time_start
+        self.window_size_days = window_size_days
+        self.cache_size = cache_size
+        self.profiler = profiler or NULL_PROFILER
+        self.window_indexes: dict[time, WindowIndex] = {}
+        self._normalized: dict[tuple[time, tuple[str, ...]], np.ndarray] = {}
+        self._results: OrderedDict[tuple, list[MatchModel]] = OrderedDict()
+        self.ann_dir = Path(ann_dir) if ann_dir else None
+        self._approximate: dict[tuple[time, tuple], ApproximateIndex] = {}
+
+    def window_index(self, end_time: time) -> WindowIndex:
+        """Return the candidate windows ending at end_time, building them on first use"""
+        if end_time not in self.window_indexes:
+            with self.profiler.stage('window_extraction'):
+                self.window_indexes[end_time] = WindowIndex.build(self.data, self.window_time_start,
+                                                                  self.window_size_days, end_time)
+        return self.window_indexes[end_time]
+
+    def normalized(self, end_time: time, features: tuple[str, ...]) -> np.ndarray:
+        """Return the normalized features of the candidate windows ending at end_time, see normalize_features"""
+        key = (end_time, features)
+        if key not in self._normalized:
+            window_index = self.window_index(end_time)
+            with self.profiler.stage('window_extraction'):
+                window_index.windows
+            with self.profiler.stage('normalization'):
+                self._normalized[key] = normalize_features(window_index.windows,
+                                                           window_index.values[window_index.ends, CLOSE],
+                                                           list(features))
+        return self._normalized[key]
+
+    def approximate_index(self, end_time: time, weights: dict[str, float]) -> ApproximateIndex:
+        """Return the ApproximateIndex of the candidate windows ending at end_time, loading it from ann_dir or
+        building it on first use"""
+        key = (end_time, tuple(weights.items()))
+        if key not in self._approximate:
+            window_index = self.window_index(end_time)
+            path = None
+            if self.ann_dir:
+                features = '-'.join(f'{feature}{weight:g}' for feature, weight in weights.items())
+                path = (self.ann_dir / f'{self.window_time_start:%H%M}-{end_time:%H%M%S}-{self.window_size_days}d-'
+                                       f'{features}.npz')
+            approximate = ApproximateIndex.load(path) if path else None
+            if approximate is None or not approximate.matches(window_index) or approximate.weights != weights:
+                approximate = ApproximateIndex.build(window_index, weights,
+                                                     norm_windows=self.normalized(end_time, tuple(weights)))
+                if path:
+                    approximate.save(path)
+            self._approximate[key] = approximate
+        return self._approximate[key]
+
+    def search(self, target_end: datetime, top: int = None, strategy: str | dict[str, float] = 'dtw_high_low_close_4',
+               multivariate: bool = False, prune: bool = True, constraint: DtwConstraint | None = None,
+               progress_reporter: ProgressReporter | None = None,
+               should_cancel: Callable[[], bool] | None = None, shortlist: int | None = None) -> list[MatchModel]:
+        """Find the windows most similar to the one ending at target_end.
+
+        strategy is a name from STRATEGY_WEIGHTS, or feature weights as taken by StrategyRunner.find_similar_features.
+        should_cancel is the cancellation hook of StrategyRunner.
+        With a shortlist, only the shortlist candidates nearest to the target in the approximate_index are scored
+        with DTW. This is much faster on long histories, but may miss some of the exact top, see ann.recall_at_n.
+        """
+        weights, key = self._query(target_end, top, strategy, multivariate, prune, constraint, shortlist)
+        matches = self._cached(key)
+        if matches is not None:
+            return matches
+
+        runner = StrategyRunner(progress_reporter, profiler=self.profiler, should_cancel=should_cancel)
+        runner.max_outer_loop_count = 1
+        end_time = target_end.time()
+        if shortlist:
+            target_window = self.target_window(target_end)
+            candidates = self.approximate_index(end_time, weights).shortlist(target_window, shortlist)
+            logger.info(f'Shortlisted {len(candidates)} of {len(self.window_index(end_time))} candidates')
+            matches = runner.find_similar_to(self.window_index(end_time).subset(candidates), target_window, weights,
+                                             multivariate, top, prune, constraint,
+                                             self.normalized(end_time, tuple(weights))[candidates])
+        else:
+            matches = runner.find_similar_features(self.data, self.window_time_start, self.window_size_days,
+                                                   target_end, weights, multivariate, top,
+                                                   self.window_index(end_time), prune, constraint,
+                                                   self.normalized(end_time, tuple(weights)))
+        self._store(key, matches)
+        return list(matches)
+
+    def target_window(self, target_end: datetime) -> np.ndarray:
+        """Return the bars of the window ending at target_end, to search other datasets with search_window"""
+        window_index = self.window_index(target_end.time())
+        bounds = window_index.locate(target_end)
+        if bounds is None:
+            raise ValueError(f"Can't locate the window ending at {target_end}")
+        return window_index.bars(*bounds)
+
+    def search_window(self, target_window: np.ndarray, end_time: time, top: int = None,
+                      strategy: str | dict[str, float] = 'dtw_high_low_close_4', multivariate: bool = False,
+                      prune: bool = True, constraint: DtwConstraint | None = None,
+                      progress_reporter: ProgressReporter | None = None,
+                      should_cancel: Callable[[], bool] | None = None) -> list[MatchModel]:
+        """Find the windows ending at end_time most similar to the bars of target_window, e.g. the target_window of
+        another symbol's SearchIndex. Results aren't cached.
+        """
+        weights = STRATEGY_WEIGHTS[strategy] if isinstance(strategy, str) else strategy
+        runner = StrategyRunner(progress_reporter, profiler=self.profiler, should_cancel=should_cancel)
+        runner.max_outer_loop_count = 1
+        return runner.find_similar_to(self.window_index(end_time), target_window, weights, multivariate, top, prune,
+                                      constraint, self.normalized(end_time, tuple(weights)))
+
+    def stream(self, target_end: datetime, top: int, strategy: str | dict[str, float] = 'dtw_high_low_close_4',
+               multivariate: bool = False, prune: bool = True, constraint: DtwConstraint | None = None,
+               every: int = 1, progress_reporter: ProgressReporter | None = None,
+               should_cancel: Callable[[], bool] | None = None) -> Iterator[list[MatchModel]]:
+        """Like search, but yield the provisional top matches while the search runs, see stream_top.
+
+        The last list yielded is the result of search. It is only cached if the stream is consumed to the end.
+        """
+        weights, key = self._query(target_end, top, strategy, multivariate, prune, constraint)
+        matches = self._cached(key)
+        if matches is not None:
+            yield matches
+            return
+
+        runner = StrategyRunner(progress_reporter, profiler=self.profiler, should_cancel=should_cancel)
+        runner.max_outer_loop_count = 1
+        scored = runner.iter_similar_features(self.data, self.window_time_start, self.window_size_days, target_end,
+                                              weights, multivariate, top, self.window_index(target_end.time()),
+                                              prune, constraint, self.normalized(target_end.time(), tuple(weights)))
+        for matches in stream_top(scored, top, every):
+            yield list(matches)
+        self._store(key, matches)
+
+    def _query(self, target_end: datetime, top: int | None, strategy: str | dict[str, float], multivariate: bool,
+               prune: bool, constraint: DtwConstraint | None,
+               shortlist: int | None = None) -> tuple[dict[str, float], tuple]:
+        """Return the feature weights of a search, and its key in the results cache"""
+        weights = STRATEGY_WEIGHTS[strategy] if isinstance(strategy, str) else strategy
+        key = (pd.Timestamp(target_end), top, tuple(weights.items()), multivariate, prune and bool(top), constraint,
+               shortlist or None)
+        return weights, key
+
+    def _cached(self, key: tuple) -> list[MatchModel] | None:
+        if key not in self._results:
+            return None
+        self._results.move_to_end(key)
+        self.profiler.count('cached_searches')
+        logger.info(f'Using cached results for target {key[0]}')
+        return list(self._results[key])
+
+    def _store(self, key: tuple, matches: list[MatchModel]):
+        self._results[key] = matches
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+
+    def update(self, data: pd.DataFrame, first_changed: int):
+        """Update the index after the bars of data from position first_changed on were appended or replaced.
+
+        See WindowIndex.update. Only the normalized features of the affected windows are computed again. Cached
+        results are dropped.
+        """
+        for end_time, window_index in self.window_indexes.items():
+            kept = int((window_index.ends < first_changed).sum())
+            window_index.update(data, first_changed)
+            for key, normalized in self._normalized.items():
+                if key[0] != end_time:
+                    continue
+                new_normalized = normalize_features(window_index.windows[kept:],
+                                                    window_index.values[window_index.ends[kept:], CLOSE], list(key[1]))
+                max_length = max(normalized.shape[1], new_normalized.shape[1])
+                self._normalized[key] = np.concatenate([_pad_windows(normalized[:kept], max_length),
+                                                        _pad_windows(new_normalized, max_length)])
+        self.data = data
+        self._results.clear()
+        # Rebuilt on next use, saved indexes no longer match the window indexes
+        self._approximate.clear()
+
+
+def _pad_windows(windows: np.ndarray, max_length: int) -> np.ndarray:
+    """NaN pad the second axis of a window tensor to max_length"""
+    if windows.shape[1] >= max_length:
+        return windows
+    padding = np.full((len(windows), max_length - windows.shape[1], windows.shape[2]), np.nan)
+    return np.concatenate([windows, padding], axis=1)
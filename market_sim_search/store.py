@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Bumped when the on-disk layout changes, so stores written by older versions are ignored
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+INDEX_FILE = '_index.bin'
+
+
+def column_file(path: Path, column: str) -> Path:
+    return Path(path) / f'{column}.bin'
+
+
+def read_meta(path: Path) -> dict | None:
+    """Return the metadata of the frame stored at path, or None if there is no readable frame there"""
+    try:
+        meta = json.loads((Path(path) / META_FILE).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return meta if meta.get('version') == FORMAT_VERSION else None
+
+
+def write_frame(df: pd.DataFrame, path: Path, **extra) -> Path:
+    """Write a DataFrame with a DatetimeIndex as one raw binary file per column.
+
+    The index is stored as int64 UTC nanoseconds. Numeric columns keep their dtype, other columns are stored as
+    int32 categorical codes. extra is stored with the metadata. The frame is written to a temporary directory and
+    renamed into place, so readers never see a partial write.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f'.{path.name}.{uuid.uuid4().hex}.tmp'
+    tmp_path.mkdir()
+
+    index = pd.DatetimeIndex(df.index)
+    columns = []
+    _index_ns(index).tofile(tmp_path / INDEX_FILE)
+    for name, series in df.items():
+        column = {'name': name}
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            values = series.to_numpy()
+        else:
+            categorical = pd.Categorical(series)
+            values = categorical.codes.astype(np.int32)
+            column['categories'] = categorical.categories.tolist()
+        column['dtype'] = values.dtype.str
+        np.ascontiguousarray(values).tofile(column_file(tmp_path, name))
+        columns.append(column)
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'length': len(df),
+        'tz': str(index.tz) if index.tz else None,
+        'index_name': index.name,
+        'columns': columns,
+        **extra,
+    }
+    _write_meta(tmp_path, meta)
+
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def append_frame(df: pd.DataFrame, path: Path) -> int:
+    """Append rows to a frame written by write_frame, and return its new length.
+
+    df must have the stored frame's columns. Only the new rows are written. Column files are cut back to the stored
+    length first, so rows left behind by an interrupted append are overwritten.
+    """
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f'No frame stored at {path}')
+    names = [column['name'] for column in meta['columns']]
+    if list(df.columns) != names:
+        raise ValueError(f'Columns {list(df.columns)} do not match the stored columns {names}')
+
+    length = meta['length']
+    _append_array(path / INDEX_FILE, _index_ns(pd.DatetimeIndex(df.index)), length)
+    for column in meta['columns']:
+        series = df[column['name']]
+        if 'categories' in column:
+            categories = pd.Index(column['categories'])
+            new_categories = pd.Index(series.unique()).difference(categories)
+            column['categories'] = categories.append(new_categories).tolist()
+            values = pd.Categorical(series, column['categories']).codes
+        else:
+            values = series.to_numpy()
+        _append_array(column_file(path, column['name']), values.astype(column['dtype']), length)
+
+    meta['length'] = length + len(df)
+    _write_meta(path, meta)
+    return meta['length']
+
+
+def truncate_frame(path: Path, length: int):
+    """Drop the rows of a stored frame past length"""
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f'No frame stored at {path}')
+    if length > meta['length']:
+        raise ValueError(f"Can't truncate a frame of {meta['length']} rows to {length}")
+    meta['length'] = length
+    _write_meta(path, meta)
+    os.truncate(path / INDEX_FILE, length * np.dtype(np.int64).itemsize)
+    for column in meta['columns']:
+        os.truncate(column_file(path, column['name']), length * np.dtype(column['dtype']).itemsize)
+
+
+def read_index(path: Path, mmap: bool = True) -> pd.DatetimeIndex:
+    """Read only the index of a stored frame"""
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f'No frame stored at {path}')
+    return _to_index(_read_array(path / INDEX_FILE, np.dtype(np.int64), meta['length'], mmap), meta)
+
+
+def search_index(path: Path, timestamp: pd.Timestamp, side: str = 'left') -> int:
+    """Return the position of timestamp in the index of a stored frame, reading only the pages searched"""
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f'No frame stored at {path}')
+    ns = _read_array(path / INDEX_FILE, np.dtype(np.int64), meta['length'], mmap=True)
+    return int(np.searchsorted(ns, pd.Timestamp(timestamp).value, side=side))
+
+
+def read_frame(path: Path, mmap: bool = True, start: int = 0) -> pd.DataFrame:
+    """Read a frame written by write_frame.
+
+    With mmap the column files are memory mapped, so reopening a frame costs little more than building the
+    DataFrame from the mapped arrays. Rows before start are skipped.
+    """
+    path = Path(path)
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f'No frame stored at {path}')
+    length = meta['length']
+
+    index = _to_index(_read_array(path / INDEX_FILE, np.dtype(np.int64), length, mmap)[start:], meta)
+    data = {}
+    for column in meta['columns']:
+        values = _read_array(column_file(path, column['name']), np.dtype(column['dtype']), length, mmap)[start:]
+        if 'categories' in column:
+            values = pd.Categorical.from_codes(values, column['categories']).astype(object)
+        data[column['name']] = values
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def _write_meta(path: Path, meta: dict):
+    """Replace the meta file atomically"""
+    tmp_file = path / f'.{META_FILE}.{uuid.uuid4().hex}.tmp'
+    tmp_file.write_text(json.dumps(meta, indent=1, default=str))
+    os.replace(tmp_file, path / META_FILE)
+
+
+def _to_index(ns: np.ndarray, meta: dict) -> pd.DatetimeIndex:
+    index = pd.DatetimeIndex(ns.view('M8[ns]'), name=meta['index_name']).tz_localize('UTC')
+    return index.tz_convert(meta['tz']) if meta['tz'] else index.tz_localize(None)
+
+
+def _append_array(file: Path, values: np.ndarray, length: int):
+    with open(file, 'r+b') as f:
+        f.truncate(length * values.dtype.itemsize)
+        f.seek(0, os.SEEK_END)
+        np.ascontiguousarray(values).tofile(f)
+
+
+def _index_ns(index: pd.DatetimeIndex) -> np.ndarray:
+    """Return the index as int64 UTC nanoseconds"""
+    if index.tz is not None:
+        index = index.tz_convert('UTC')
+    return index.as_unit('ns').asi8
+
+
+def _read_array(file: Path, dtype: np.dtype, length: int, mmap: bool) -> np.ndarray:
+    if not length:
+        return np.empty(0, dtype)
+    if mmap:
+        # Copy on write, so in place edits of the frame stay in memory and never reach the file
+        return np.memmap(file, dtype, mode='c', shape=(length,)).view(np.ndarray)
+    return np.fromfile(file, dtype, count=length)
@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, time
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from market_sim_search.constraints import DtwConstraint
+from market_sim_search.search_index import SearchIndex
+from market_sim_search.types import ProgressReporter
+
+# Columns of the match table returned by batch_search
+MATCH_COLUMNS = ['target_symbol', 'target_end', 'symbol', 'start', 'end', 'score', 'rank']
+
+
+@dataclass(frozen=True)
+class Target:
+    """The window of symbol ending at end, to search for across a universe"""
+    symbol: str
+    end: datetime
+
+
+def batch_search(universe: dict[str, pd.DataFrame], targets: list[Target | tuple[str, datetime]],
+                 window_time_start: time, window_size_days: int, top: int | None = 10,
+                 strategy: str | dict[str, float] = 'dtw_high_low_close_4', multivariate: bool = False,
+                 prune: bool = True, constraint: DtwConstraint | None = None, symbols: list[str] | None = None,
+                 exclude_self: bool = True, n_jobs: int = 1,
+                 progress_reporter: ProgressReporter | None = None) -> pd.DataFrame:
+    """Search the history of many symbols for the windows most similar to each of many targets.
+
+    universe maps symbols to their processed bars, as returned by data.load_symbols. Each target is the window of one
+    of its symbols ending at a time, e.g. today's QQQ morning. The histories searched are those of symbols, all of
+    universe by default.
+
+    Each symbol is searched by one task, through a SearchIndex, so its candidate windows are indexed and normalized
+    once per target time of day and shared by all targets. With n_jobs > 1 the tasks run in a pool of worker
+    processes. The top matches of each symbol are merged into one table of the top matches of each target across
+    symbols, with the columns of MATCH_COLUMNS, ranked from 1 by score. With exclude_self a target's own window isn't
+    a match.
+    """
+    targets = [target if isinstance(target, Target) else Target(*target) for target in targets]
+    symbols = list(universe) if symbols is None else symbols
+    missing = {target.symbol for target in targets} - set(universe) | set(symbols) - set(universe)
+    if missing:
+        raise KeyError(f'Symbols not in the universe: {sorted(missing)}')
+
+    indexes = {symbol: SearchIndex(universe[symbol], window_time_start, window_size_days)
+               for symbol in {target.symbol for target in targets}}
+    target_windows = [indexes[target.symbol].target_window(target.end) for target in targets]
+    logger.info(f'Searching {len(symbols)} symbols for {len(targets)} targets')
+
+    results = {}
+    if n_jobs > 1 and len(symbols) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            # Workers get fresh indexes, rather than the pickled caches of the target indexes
+            futures = {executor.submit(_search_symbol, symbol,
+                                       SearchIndex(universe[symbol], window_time_start, window_size_days), targets,
+                                       target_windows, top, strategy, multivariate, prune, constraint,
+                                       exclude_self): symbol
+                       for symbol in symbols}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if progress_reporter:
+                    progress_reporter(len(results) / len(symbols))
+    else:
+        for symbol in symbols:
+            search_index = indexes.get(symbol) or SearchIndex(universe[symbol], window_time_start, window_size_days)
+            results[symbol] = _search_symbol(symbol, search_index, targets, target_windows, top, strategy,
+                                             multivariate, prune, constraint, exclude_self)
+            if progress_reporter:
+                progress_reporter(len(results) / len(symbols))
+
+    return merge_symbol_matches(targets, [results[symbol] for symbol in symbols], top)
+
+
+def merge_symbol_matches(targets: list[Target], rows: list[list[tuple]], top: int | None) -> pd.DataFrame:
+    """Merge the (target, symbol, start, end, score) rows of each symbol into the ranked table of batch_search.
+
+    Ties are broken by symbol then match end, so the table doesn't depend on the order symbols completed in.
+    """
+    matches = pd.DataFrame([row for symbol_rows in rows for row in symbol_rows],
+                           columns=['target', 'symbol', 'start', 'end', 'score'])
+    matches = matches.sort_values(['target', 'score', 'symbol', 'end'], kind='stable')
+    if top:
+        matches = matches.groupby('target', sort=False).head(top)
+    matches['rank'] = matches.groupby('target', sort=False).cumcount() + 1
+    matches.insert(0, 'target_symbol', [targets[n].symbol for n in matches['target']])
+    matches.insert(1, 'target_end', [targets[n].end for n in matches['target']])
+    return matches[MATCH_COLUMNS].reset_index(drop=True)
+
+
+def _search_symbol(symbol: str, search_index: SearchIndex, targets: list[Target], target_windows: list[np.ndarray],
+                   top: int | None, strategy: str | dict[str, float], multivariate: bool, prune: bool,
+                   constraint: DtwConstraint | None, exclude_self: bool) -> list[tuple]:
+    """Search the history of one symbol for every target, returning (target, symbol, start, end, score) rows"""
+    rows = []
+    for n, (target, target_window) in enumerate(zip(targets, target_windows)):
+        is_self = exclude_self and target.symbol == symbol
+        # One more match, in case the target's own window is among the top
+        symbol_top = top + 1 if top and is_self else top
+        matches = search_index.search_window(target_window, target.end.time(), symbol_top, strategy, multivariate,
+                                             prune, constraint)
+        target_end = pd.Timestamp(target.end)
+        matches = [match for match in matches if not (is_self and match.end == target_end)][:top]
+        rows += [(n, symbol, match.start, match.end, match.score) for match in matches]
+    return rows
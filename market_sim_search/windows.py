@@ -0,0 +1,183 @@
+import hashlib
+from dataclasses import dataclass, replace
+from datetime import datetime, time, timedelta
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from market_sim_search.config import EST
+
+# Column order of the bar arrays. Strategies index windows with these constants, e.g. window[:, CLOSE].
+OHLCV = ['open', 'high', 'low', 'close', 'volume']
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(OHLCV))
+
+window_boundary_tolerance = timedelta(minutes=5)
+
+
+def to_bar_array(data: pd.DataFrame) -> np.ndarray:
+    """Return the OHLCV columns of data as a contiguous (n_bars, 5) float64 array"""
+    return np.ascontiguousarray(data[OHLCV].to_numpy(dtype=np.float64))
+
+
+def session_days(index: pd.DatetimeIndex) -> np.ndarray:
+    """Return the local calendar day of each bar as datetime64[D]"""
+    return index.tz_localize(None).values.astype('datetime64[D]')
+
+
+def locate_window_starts(index: pd.DatetimeIndex, dates: np.ndarray, end_days: np.ndarray, window_time_start: time,
+                         window_size_days: int, tolerance: timedelta = window_boundary_tolerance) -> np.ndarray:
+    """Return the bar offset each window starts at, or -1 if it can't be located.
+
+    This is the vectorized form of get_window. The start is window_time_start on the trading day window_size_days
+    before the day of the window end, snapped to the nearest bar within tolerance.
+    """
+    day_idx = np.searchsorted(dates, end_days)
+    start_day_idx = day_idx - window_size_days
+    has_day = start_day_idx >= 0
+    starts = np.full(len(end_days), -1, dtype=np.int64)
+    if not has_day.any():
+        return starts
+
+    offset = pd.Timedelta(hours=window_time_start.hour, minutes=window_time_start.minute,
+                          seconds=window_time_start.second, microseconds=window_time_start.microsecond)
+    start_times = pd.DatetimeIndex(dates[start_day_idx[has_day]]) + offset
+    start_ns = start_times.tz_localize(EST, ambiguous=False, nonexistent='shift_forward').tz_convert(index.tz).asi8
+
+    # Same tie breaking as DatetimeIndex.get_indexer(method='nearest'): prefer the later bar on equal distance.
+    ns = index.asi8
+    pad = np.searchsorted(ns, start_ns, side='right') - 1
+    backfill = np.searchsorted(ns, start_ns, side='left')
+    inf = np.iinfo(np.int64).max
+    left_distance = np.where(pad >= 0, start_ns - ns[np.maximum(pad, 0)], inf)
+    right_distance = np.where(backfill < len(ns), ns[np.minimum(backfill, len(ns) - 1)] - start_ns, inf)
+    nearest = np.where(left_distance < right_distance, pad, backfill)
+    distance = np.minimum(left_distance, right_distance)
+    starts[has_day] = np.where(distance <= pd.Timedelta(tolerance).value, nearest, -1)
+    return starts
+
+
+def gather_windows(values: np.ndarray, starts: np.ndarray, lengths: np.ndarray, max_length: int) -> np.ndarray:
+    """Copy the bars of each window into a (n_windows, max_length, 5) tensor, NaN padded past each window's length"""
+    offsets = np.arange(max_length)
+    positions = starts[:, None] + offsets
+    in_window = offsets < lengths[:, None]
+    windows = values[np.where(in_window, positions, 0)]
+    windows[~in_window] = np.nan
+    return windows
+
+
+def bars_digest(window_index: 'WindowIndex', n_bars: int) -> str:
+    """Return the sha256 of the first n_bars bars of window_index and their timestamps"""
+    digest = hashlib.sha256(np.ascontiguousarray(window_index.values[:n_bars]).tobytes())
+    digest.update(window_index.index.asi8[:n_bars].tobytes())
+    return digest.hexdigest()
+
+
+def windows_digest(window_index: 'WindowIndex') -> str:
+    """Return the sha256 of all the bars of window_index and the bounds of its windows"""
+    digest = hashlib.sha256(bars_digest(window_index, len(window_index.values)).encode())
+    for bounds in (window_index.starts, window_index.ends, window_index.valid):
+        digest.update(np.ascontiguousarray(bounds).tobytes())
+    return digest.hexdigest()
+
+
+@dataclass(eq=False)
+class WindowIndex:
+    """Candidate windows for one search, precomputed from an OHLCV frame.
+
+    Every candidate ends at end_time on some trading day and starts at window_time_start, window_size_days trading days
+    earlier. The bars are held once as a contiguous (n_bars, 5) array, and each candidate is described by inclusive
+    start/end offsets into it. Candidates whose start couldn't be located are kept, but marked invalid.
+    """
+    index: pd.DatetimeIndex
+    values: np.ndarray
+    window_time_start: time
+    window_size_days: int
+    end_time: time
+    starts: np.ndarray
+    ends: np.ndarray
+    valid: np.ndarray
+
+    @classmethod
+    def build(cls, data: pd.DataFrame, window_time_start: time, window_size_days: int,
+              end_time: time) -> 'WindowIndex':
+        """Index every window of data ending at end_time"""
+        index = data.index
+        days = session_days(index)
+        ends = index.indexer_at_time(end_time).astype(np.int64)
+        starts = locate_window_starts(index, np.unique(days), days[ends], window_time_start, window_size_days)
+        valid = (starts >= 0) & (starts <= ends)
+        return cls(index, to_bar_array(data), window_time_start, window_size_days, end_time, starts, ends, valid)
+
+    def __len__(self):
+        return len(self.ends)
+
+    @cached_property
+    def dates(self) -> np.ndarray:
+        return np.unique(session_days(self.index))
+
+    @cached_property
+    def lengths(self) -> np.ndarray:
+        return np.where(self.valid, self.ends - self.starts + 1, 0)
+
+    @cached_property
+    def windows(self) -> np.ndarray:
+        """A (n_candidates, max_length, 5) tensor of the candidate windows, NaN padded past each window's length"""
+        lengths = self.lengths
+        return gather_windows(self.values, self.starts, lengths, int(lengths.max()) if len(lengths) else 0)
+
+    def window(self, i: int) -> np.ndarray:
+        """Return the bars of candidate i"""
+        return self.windows[i, :self.lengths[i]]
+
+    def locate(self, window_end: datetime) -> tuple[int, int] | None:
+        """Return the inclusive start/end offsets of the window ending at window_end, or None if it can't be located"""
+        end = int(np.searchsorted(self.index.asi8, pd.Timestamp(window_end).value, side='right')) - 1
+        end_day = np.array([np.datetime64(window_end.date(), 'D')])
+        start = int(locate_window_starts(self.index, self.dates, end_day, self.window_time_start,
+                                         self.window_size_days)[0])
+        if start < 0 or start > end:
+            return None
+        return start, end
+
+    def update(self, data: pd.DataFrame, first_changed: int):
+        """Update the index in place after the bars of data from position first_changed on were appended or replaced.
+
+        The bars before first_changed must be unchanged, as returned by ProcessedStore.append. Only candidates ending
+        from first_changed on are located again, and only their rows of the window tensor are rebuilt.
+        """
+        index = data.index
+        days = session_days(index[first_changed:])
+        dates = np.union1d(self.dates, days)
+        new_ends = index[first_changed:].indexer_at_time(self.end_time).astype(np.int64) + first_changed
+        new_starts = locate_window_starts(index, dates, days[new_ends - first_changed], self.window_time_start,
+                                          self.window_size_days)
+
+        keep = self.ends < first_changed
+        self.index = index
+        self.values = np.concatenate([self.values[:first_changed], to_bar_array(data.iloc[first_changed:])])
+        self.dates = dates
+        self.starts = np.concatenate([self.starts[keep], new_starts])
+        self.ends = np.concatenate([self.ends[keep], new_ends])
+        self.valid = np.concatenate([self.valid[keep], (new_starts >= 0) & (new_starts <= new_ends)])
+        self.lengths = np.where(self.valid, self.ends - self.starts + 1, 0)
+
+        if 'windows' in self.__dict__:
+            windows = self.windows[keep]
+            new_lengths = self.lengths[len(windows):]
+            max_length = max(windows.shape[1], int(new_lengths.max()) if len(new_lengths) else 0)
+            if max_length > windows.shape[1]:
+                padding = np.full((len(windows), max_length - windows.shape[1], windows.shape[2]), np.nan)
+                windows = np.concatenate([windows, padding], axis=1)
+            new_windows = gather_windows(self.values, self.starts[len(windows):], new_lengths, max_length)
+            self.windows = np.concatenate([windows, new_windows])
+
+    def subset(self, candidates: np.ndarray) -> 'WindowIndex':
+        """Return an index of only the given candidates, sharing the bars of this one"""
+        return replace(self, starts=self.starts[candidates], ends=self.ends[candidates],
+                       valid=self.valid[candidates])
+
+    def bars(self, start: int, end: int) -> np.ndarray:
+        """Return the bars between the inclusive offsets"""
+        return self.values[start:end + 1]
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from tslearn.metrics import dtw as tslearn_dtw
+
+from market_sim_search.constraints import DtwConstraint, dtw_kwargs
+from market_sim_search.dtw import dtw, dtw_batch
+
+CONSTRAINTS = [None, DtwConstraint('sakoe_chiba', radius=5), DtwConstraint('itakura', max_slope=2.)]
+# (target length, window length) pairs, each feasible under every constraint
+LENGTHS = [(40, 40), (36, 48), (48, 36)]
+
+
+def random_walk(rng: np.random.Generator, *shape: int, dtype=np.float64) -> np.ndarray:
+    return rng.normal(size=shape).cumsum(axis=0).astype(dtype)
+
+
+@pytest.mark.parametrize('constraint', CONSTRAINTS, ids=str)
+@pytest.mark.parametrize('n, m', LENGTHS)
+@pytest.mark.parametrize('n_features', [1, 3])
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_dtw_matches_tslearn(constraint, n, m, n_features, dtype):
+    rng = np.random.default_rng(n * m + n_features)
+    s1, s2 = random_walk(rng, n, n_features, dtype=dtype), random_walk(rng, m, n_features, dtype=dtype)
+    expected = tslearn_dtw(s1, s2, **dtw_kwargs(constraint))
+    assert np.allclose(dtw(s1, s2, constraint), expected)
+
+
+@pytest.mark.parametrize('constraint', CONSTRAINTS, ids=str)
+@pytest.mark.parametrize('n, m', LENGTHS)
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_dtw_batch_matches_tslearn(constraint, n, m, dtype):
+    rng = np.random.default_rng(n * m)
+    target = random_walk(rng, n, 2, dtype=dtype)
+    windows = np.stack([random_walk(rng, m, 2, dtype=dtype) for _ in range(8)])
+    expected = [tslearn_dtw(target, window, **dtw_kwargs(constraint)) for window in windows]
+    assert np.allclose(dtw_batch(target, windows, constraint=constraint), expected)
+
+
+def test_dtw_batch_univariate_matches_tslearn():
+    rng = np.random.default_rng(0)
+    target, windows = random_walk(rng, 30), random_walk(rng, 45, 5).T
+    expected = [tslearn_dtw(target, window) for window in windows]
+    assert np.allclose(dtw_batch(target, windows), expected)
+
+
+def test_dtw_ignores_trailing_nan_rows_like_tslearn():
+    rng = np.random.default_rng(0)
+    s1, s2 = random_walk(rng, 30, 2), random_walk(rng, 40, 2)
+    s2[-5:] = np.nan
+    assert np.allclose(dtw(s1, s2), tslearn_dtw(s1, s2))
@@ -0,0 +1,41 @@
+import threading
+
+from market_sim_search.jobs import CANCELLED, DONE, PENDING, RUNNING, JobRunner
+from market_sim_search.matches import SearchCancelled
+
+
+def blocking_search(release: threading.Event):
+    def search(job):
+        while not release.wait(0.01):
+            if job.cancelled():
+                raise SearchCancelled()
+        return 'result'
+    return search
+
+
+def test_shared_job_is_only_cancelled_once_no_subscriber_holds_it():
+    runner = JobRunner(max_workers=2)
+    release = threading.Event()
+    job = runner.submit('key', blocking_search(release), 'a')
+    assert runner.submit('key', blocking_search(release), 'b') is job
+
+    runner.cancel(job.id, 'a')
+    assert not job.cancelled()
+    assert job.state in (PENDING, RUNNING)
+    runner.cancel(job.id, 'b')
+    assert job.cancelled()
+    runner.shutdown()
+    assert job.state == CANCELLED
+
+
+def test_searches_of_different_sessions_run_concurrently():
+    runner = JobRunner(max_workers=2)
+    release = threading.Event()
+    first = runner.submit('first', blocking_search(release), 'a')
+    second = runner.submit('second', lambda job: 'done', 'b')
+    assert second.result(timeout=5) == 'done'
+    assert first.state == RUNNING
+    release.set()
+    assert first.result(timeout=5) == 'result'
+    assert first.state == second.state == DONE
+    runner.shutdown()